@@ -0,0 +1,96 @@
+"""
+Conditional GETs and delta sync, driven by the per-client change version.
+
+Every write in lg_db / lg_db_async bumps clients.change_version and logs the rows it
+touched (client_changes) in the same transaction. So:
+
+- List endpoints answer with ETag = hash(version, query params) and Cache-Control:
+  no-cache. The browser revalidates with If-None-Match, and an unchanged list costs one
+  primary-key lookup and a 304 instead of the query plus serialization.
+- GET /api/changes?since=<version> returns only the rows changed after that version
+  (or {"full": true} when the log was pruned past it, and the client refetches).
+
+The change log is pruned after KEEP seconds by a background sweep.
+"""
+import os
+import asyncio
+import hashlib
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+import lg_db_async
+
+
+# Browsers may store list responses but must revalidate them (If-None-Match) on every use
+CACHE_CONTROL = "private, no-cache"
+
+# Set on a list response cut at its limit
+TRUNCATED_HEADER = "X-Truncated"
+
+
+def etag(version: int, *parts) -> str:
+    """ETag for a response built at `version` with these query parameters."""
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:12]
+    return f'"v{version}-{digest}"'
+
+
+def matches(if_none_match: str | None, tag: str) -> bool:
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or tag in (t.strip().removeprefix("W/") for t in if_none_match.split(","))
+
+
+async def conditional(client_id: str, if_none_match: str | None, parts: tuple, load,
+                      limit: int | None = None) -> Response:
+    """
+    304 if the client's cached copy (If-None-Match) is still current, else load() as JSON
+    with a fresh ETag. The version is read before load(), so a write racing with load()
+    only makes the tag older than the body: the next request refetches, never misses a change.
+    With a limit, load() returns up to limit + 1 rows; an extra row is dropped and flagged
+    with an X-Truncated header so the client can ask for a narrower range.
+    """
+    version = await lg_db_async.get_change_version(client_id)
+    tag = etag(version, *parts)
+    headers = {"ETag": tag, "Cache-Control": CACHE_CONTROL}
+    if matches(if_none_match, tag):
+        return Response(status_code=304, headers=headers)
+    body = await load()
+    if limit is not None and len(body) > limit:
+        body = body[:limit]
+        headers[TRUNCATED_HEADER] = "true"
+    return JSONResponse(content=jsonable_encoder(body), headers=headers)
+
+
+class ChangeLogPruner:
+    def __init__(self, keep: int, interval: int):
+        self.keep = keep
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start the prune loop. Must be called from the running event loop."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                pruned = await lg_db_async.prune_changes(self.keep)
+                if pruned:
+                    print(f"INFO: Pruned {pruned} change log rows")
+            except Exception as e:
+                print(f"ERROR: Change log prune failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+pruner = ChangeLogPruner(
+    keep=int(os.getenv("LG_CHANGE_LOG_KEEP", str(7 * 86400))),
+    interval=int(os.getenv("LG_CHANGE_LOG_PRUNE_INTERVAL", "3600")),
+)
@@ -1,8 +1,14 @@
 import os
 import json
+import gzip
 from pathlib import Path
+from datetime import date
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from psycopg import sql
 from psycopg_pool import ConnectionPool
+from langgraph.checkpoint.postgres import PostgresSaver
+import lg_migrations
 
 
 # load project .env (optional) then compose .env and force override of OS env vars
@@ -18,7 +24,43 @@ _CONNINFO = (
     f"@{os.getenv('LG_POSTGRES_HOST','db')}:{os.getenv('LG_POSTGRES_PORT','5432')}/"
     f"{os.getenv('LG_POSTGRES_DB','libredb')}"
 )
-_pool = ConnectionPool(conninfo=_CONNINFO, min_size=1, max_size=5)
+# pool sizing and limits, shared by the sync pool here and the async pool in lg_db_async
+POOL_KWARGS = {
+    "min_size": int(os.getenv("LG_POSTGRES_POOL_MIN_SIZE", "1")),
+    "max_size": int(os.getenv("LG_POSTGRES_POOL_MAX_SIZE", "5")),
+    "timeout": float(os.getenv("LG_POSTGRES_POOL_TIMEOUT", "30")),  # seconds to wait for a connection
+    "max_waiting": int(os.getenv("LG_POSTGRES_POOL_MAX_WAITING", "0")),  # 0 = unlimited queue
+    "max_idle": float(os.getenv("LG_POSTGRES_POOL_MAX_IDLE", "600")),
+}
+# Server-side prepared statements: psycopg prepares a query on a connection once it has run
+# it this many times, then only sends Bind/Execute for it. 0 = prepare on first use;
+# "none" disables them (e.g. behind pgbouncer in transaction mode).
+_PREPARE_THRESHOLD = os.getenv("LG_POSTGRES_PREPARE_THRESHOLD", "1")
+POOL_KWARGS["kwargs"] = {
+    "prepare_threshold": None if _PREPARE_THRESHOLD.lower() == "none" else int(_PREPARE_THRESHOLD),
+}
+# Prepared statements kept per connection (LRU). A connection attribute, not a connect
+# option, so it is set by the pools' configure callbacks.
+PREPARED_MAX = int(os.getenv("LG_POSTGRES_PREPARED_MAX", "100"))
+
+def _configure_connection(conn) -> None:
+    conn.prepared_max = PREPARED_MAX
+
+_pool = ConnectionPool(conninfo=_CONNINFO, configure=_configure_connection, **POOL_KWARGS)
+
+
+@contextmanager
+def _autocommit():
+    """
+    Pool connection in autocommit mode, for writes that are a single statement: no BEGIN /
+    COMMIT round trips, the statement is its own transaction. Restored before it goes back.
+    """
+    with _pool.connection() as conn:
+        conn.autocommit = True
+        try:
+            yield conn
+        finally:
+            conn.autocommit = False
 
 
 def lg_hello_db() -> str:
@@ -34,96 +76,32 @@ def lg_hello_db() -> str:
 
 
 def init_db():
-    """Create necessary tables if they don't exist."""
-    pk_type = "SERIAL PRIMARY KEY"
-    json_type = "JSONB"
-    
-    queries = [
-        f"""CREATE TABLE IF NOT EXISTS clients (
-            client_id TEXT PRIMARY KEY,
-            secret TEXT NOT NULL,
-            xp_score INTEGER DEFAULT 0,
-            tasks_completed_count INTEGER DEFAULT 0,
-            objectives_completed_count INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""",
-        f"""CREATE TABLE IF NOT EXISTS client_objectives (
-            id {pk_type},
-            client_id TEXT REFERENCES clients(client_id),
-            title TEXT NOT NULL,
-            description TEXT,
-            status TEXT DEFAULT 'not_started',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""",
-        f"""CREATE TABLE IF NOT EXISTS client_tasks (
-            id {pk_type},
-            objective_id INTEGER REFERENCES client_objectives(id) ON DELETE CASCADE,
-            title TEXT NOT NULL,
-            weight INTEGER DEFAULT 1,
-            is_completed BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""",
-        f"""CREATE TABLE IF NOT EXISTS calendar_events (
-            id {pk_type},
-            client_id TEXT REFERENCES clients(client_id),
-            title TEXT NOT NULL,
-            start_time TIMESTAMP NOT NULL,
-            end_time TIMESTAMP NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""",
-        f"""CREATE TABLE IF NOT EXISTS chat_history (
-            id {pk_type},
-            client_id TEXT REFERENCES clients(client_id),
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""",
-        f"""CREATE TABLE IF NOT EXISTS client_stats (
-            client_id TEXT PRIMARY KEY REFERENCES clients(client_id),
-            xp_score INTEGER DEFAULT 0,
-            last_active TIMESTAMP
-        )""",
-        f"""CREATE TABLE IF NOT EXISTS client_agenda (
-            id {pk_type},
-            client_id TEXT REFERENCES clients(client_id),
-            start_time TIMESTAMP,
-            end_time TIMESTAMP,
-            description TEXT,
-            objective_id INTEGER
-        )""",
-        f"""CREATE TABLE IF NOT EXISTS client_completed_objectives (
-            id {pk_type},
-            client_id TEXT REFERENCES clients(client_id),
-            data {json_type},
-            score INTEGER,
-            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""",
-        f"""CREATE TABLE IF NOT EXISTS client_chat_history (
-            id {pk_type},
-            client_id TEXT REFERENCES clients(client_id),
-            role TEXT,
-            content {json_type},
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""",
-        f"""CREATE TABLE IF NOT EXISTS calendar_events (
-            id {pk_type},
-            client_id TEXT REFERENCES clients(client_id),
-            title TEXT NOT NULL,
-            start_time TEXT NOT NULL,
-            end_time TEXT NOT NULL
-        )"""
-    ]
-    
-    with _pool.connection() as conn:
-        with conn.cursor() as cur:
-            for q in queries:
-                cur.execute(q)
-            
-            # Simple migration for existing dev DB: try adding column
-            try:
-                cur.execute("ALTER TABLE calendar_events ADD COLUMN IF NOT EXISTS client_id TEXT REFERENCES clients(client_id);")
-            except Exception:
-                pass # Table might not exist or other error, handled by CREATE TABLE above
+    """Bring the schema up to date by applying pending migrations (see lg_migrations)."""
+    lg_migrations.migrate(_CONNINFO)
+
+
+# Change feed (ETags and /api/changes): every write bumps the client's change_version and
+# logs the rows it touched at that version, in the same transaction as the write.
+# Task changes are logged as changes of their objective, which embeds its tasks.
+EVENT = "event"
+OBJECTIVE = "objective"
+MESSAGE = "message"
+
+_RECORD_CHANGES_QUERY = """
+    WITH v AS (
+        UPDATE clients SET change_version = change_version + 1
+        WHERE client_id = %(client_id)s RETURNING change_version
+    )
+    INSERT INTO client_changes (client_id, version, entity, entity_id, op)
+    SELECT %(client_id)s, v.change_version, %(entity)s, x.id, %(op)s
+    FROM v, unnest(%(ids)s::int[]) AS x(id);
+"""
+
+def _change_params(client_id: str, entity: str, ids: list[int], op: str) -> dict:
+    return {"client_id": client_id, "entity": entity, "ids": ids, "op": op}
+
+def _record_changes(cur, client_id: str, entity: str, ids: list[int], op: str = "upsert") -> None:
+    cur.execute(_RECORD_CHANGES_QUERY, _change_params(client_id, entity, ids, op))
 
 
 def register_device(client_id: str, secret: str) -> None:
@@ -175,62 +153,306 @@ def get_client(client_id: str, secret: str) -> bool:
             )
             return cur.fetchone() is not None
 
-def add_calendar_event(client_id: str, title: str, start_time: str, end_time: str) -> None:
-    """Add a calendar event to the database."""
+def add_calendar_event(client_id: str, title: str, start_time: str, end_time: str) -> int:
+    """Add a calendar event to the database and return its ID."""
     with _pool.connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO calendar_events (client_id, title, start_time, end_time) VALUES (%s, %s, %s, %s);",
+                "INSERT INTO calendar_events (client_id, title, start_time, end_time) VALUES (%s, %s, %s, %s) RETURNING id;",
                 (client_id, title, start_time, end_time)
             )
+            event_id = cur.fetchone()[0]
+            _record_changes(cur, client_id, EVENT, [event_id])
+            return event_id
 
 def remove_calendar_event(client_id: str, title: str) -> None:
     """Remove a calendar event from the database."""
     with _pool.connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "DELETE FROM calendar_events WHERE client_id = %s AND title = %s;",
+                "DELETE FROM calendar_events WHERE client_id = %s AND title = %s RETURNING id;",
                 (client_id, title)
             )
+            removed = [r[0] for r in cur.fetchall()]
+            if removed:
+                _record_changes(cur, client_id, EVENT, removed, "delete")
 
 def get_all_events(client_id: str) -> list[dict]:
     """Retrieve all calendar events for a specific client."""
     with _pool.connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT title, start_time, end_time FROM calendar_events WHERE client_id = %s;", (client_id,))
+            cur.execute("SELECT id, title, start_time, end_time FROM calendar_events WHERE client_id = %s;", (client_id,))
             rows = cur.fetchall()
             
     # Convert to list of dicts for frontend
     events = []
     for r in rows:
         events.append({
-            "title": r[0],
-            "start": r[1],
-            "end": r[2]
+            "id": r[0],
+            "title": r[1],
+            "start": r[2],
+            "end": r[3]
         })
     return events
 
+# Events overlapping [range_start, range_end), earliest first. The overlap test is bounded on
+# both sides (start_time < end on the start index, end_time > start on the end index), so
+# the scan covers the visible range instead of the client's whole history.
+_EVENTS_IN_RANGE_QUERY = """
+    SELECT id, title, start_time, end_time FROM calendar_events
+    WHERE client_id = %s AND start_time < %s::timestamp AND end_time > %s::timestamp
+    ORDER BY start_time, id
+    LIMIT %s;
+"""
+
+def _events_from_rows(rows) -> list[dict]:
+    return [{"id": r[0], "title": r[1], "start": r[2], "end": r[3]} for r in rows]
+
+def get_events_in_range(client_id: str, range_start: str, range_end: str, limit: int = 1000) -> list[dict]:
+    """Retrieve a client's calendar events overlapping [range_start, range_end), earliest first."""
+    with _pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_EVENTS_IN_RANGE_QUERY, (client_id, range_end, range_start, limit))
+            return _events_from_rows(cur.fetchall())
+
+# Free slots of at least `duration` inside the daily working hours of [range_start, range_end).
+# Busy events overlapping each day's window are clipped to it, then each gap is the space
+# between the running max end of the earlier events and the next start (interval merge),
+# plus the tail of the window after the last event. Only the events in the range are read
+# (client_id + start/end range on the calendar indexes).
+_FREE_SLOTS_QUERY = """
+    WITH windows AS (
+        SELECT w_start, w_end FROM (
+            SELECT GREATEST(d + %(day_start)s::time, %(range_start)s::timestamp) AS w_start,
+                   LEAST(d + %(day_end)s::time, %(range_end)s::timestamp) AS w_end
+            FROM generate_series(date_trunc('day', %(range_start)s::timestamp), %(range_end)s::timestamp, interval '1 day') AS d
+        ) days
+        WHERE w_start < w_end
+    ),
+    busy AS (
+        SELECT start_time, end_time FROM calendar_events
+        WHERE client_id = %(client_id)s
+          AND start_time < %(range_end)s::timestamp AND end_time > %(range_start)s::timestamp
+    ),
+    clipped AS (
+        SELECT w.w_start, w.w_end,
+               GREATEST(b.start_time, w.w_start) AS s, LEAST(b.end_time, w.w_end) AS e
+        FROM windows w JOIN busy b ON b.start_time < w.w_end AND b.end_time > w.w_start
+    ),
+    gaps AS (
+        SELECT COALESCE(MAX(e) OVER (PARTITION BY w_start ORDER BY s, e
+                                     ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), w_start) AS free_start,
+               s AS free_end
+        FROM clipped
+        UNION ALL
+        SELECT COALESCE(MAX(c.e), w.w_start), w.w_end
+        FROM windows w LEFT JOIN clipped c ON c.w_start = w.w_start
+        GROUP BY w.w_start, w.w_end
+    )
+    SELECT free_start, free_end FROM gaps
+    WHERE free_end - free_start >= make_interval(mins => %(duration)s)
+    ORDER BY free_start
+    LIMIT %(limit)s;
+"""
+
+def _free_slots_params(client_id: str, range_start: str, range_end: str, duration_minutes: int,
+                       day_start: str, day_end: str, limit: int) -> dict:
+    return {
+        "client_id": client_id, "range_start": range_start, "range_end": range_end,
+        "duration": duration_minutes, "day_start": day_start, "day_end": day_end, "limit": limit,
+    }
+
+def _slots_from_rows(rows) -> list[dict]:
+    return [{"start": r[0].isoformat(), "end": r[1].isoformat()} for r in rows]
+
+def find_free_slots(client_id: str, range_start: str, range_end: str, duration_minutes: int = 60,
+                    day_start: str = "09:00", day_end: str = "18:00", limit: int = 10) -> list[dict]:
+    """Free intervals of at least `duration_minutes` within working hours, earliest first."""
+    with _pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_FREE_SLOTS_QUERY, _free_slots_params(
+                client_id, range_start, range_end, duration_minutes, day_start, day_end, limit))
+            return _slots_from_rows(cur.fetchall())
+
 def add_chat_message(client_id: str, role: str, content: str) -> None:
     """Save a chat message to the history."""
     with _pool.connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO chat_history (client_id, role, content) VALUES (%s, %s, %s);",
+                "INSERT INTO chat_history (client_id, role, content) VALUES (%s, %s, %s) RETURNING id;",
                 (client_id, role, content)
             )
+            _record_changes(cur, client_id, MESSAGE, [cur.fetchone()[0]])
+
+# Batched insert for the chat history write-behind queue (lg_history_writer): messages of
+# any number of clients in one statement, in order (ids follow the list). Each client
+# involved gets one change_version bump; every message gets its change-log row.
+_ADD_CHAT_MESSAGES_QUERY = """
+    WITH m AS (
+        INSERT INTO chat_history (client_id, role, content)
+        SELECT x.client_id, x.role, x.content
+        FROM unnest(%(client_ids)s::text[], %(roles)s::text[], %(contents)s::text[])
+             WITH ORDINALITY AS x(client_id, role, content, n)
+        ORDER BY x.n
+        RETURNING id, client_id
+    ), v AS (
+        UPDATE clients c SET change_version = c.change_version + 1
+        FROM (SELECT DISTINCT client_id FROM m) d WHERE c.client_id = d.client_id
+        RETURNING c.client_id, c.change_version
+    )
+    INSERT INTO client_changes (client_id, version, entity, entity_id, op)
+    SELECT m.client_id, v.change_version, %(entity)s, m.id, 'upsert' FROM m JOIN v USING (client_id);
+"""
+
+def _chat_messages_params(messages: list[tuple[str, str, str]]) -> dict:
+    return {
+        "client_ids": [m[0] for m in messages],
+        "roles": [m[1] for m in messages],
+        "contents": [m[2] for m in messages],
+        "entity": MESSAGE,
+    }
+
+# Newest-first running token estimate (~4 characters per token, +4 per message for role
+# framing); keeps rows while the total fits the budget, then returns them oldest-first.
+# Rows up to the summary watermark (id <= after_id) are skipped. The upper time bound lets
+# the planner prune the (empty) future month partitions; the minute covers rows committed
+# just after this transaction started.
+_CONTEXT_WINDOW_QUERY = """
+    SELECT role, content FROM (
+        SELECT role, content, timestamp, id,
+               ROW_NUMBER() OVER (ORDER BY timestamp DESC, id DESC) AS n,
+               SUM(length(content) / 4 + 4) OVER (ORDER BY timestamp DESC, id DESC) AS running_tokens
+        FROM (
+            SELECT id, role, content, timestamp FROM chat_history
+            WHERE client_id = %s AND id > %s AND timestamp < LOCALTIMESTAMP + interval '1 minute'
+            ORDER BY timestamp DESC, id DESC LIMIT %s
+        ) recent
+    ) w
+    WHERE n = 1 OR running_tokens <= %s
+    ORDER BY timestamp ASC, id ASC;
+"""
 
 def get_chat_history(client_id: str, limit: int = 50) -> list[dict]:
-    """Retrieve chat history for a client."""
+    """Retrieve the newest `limit` chat messages for a client, in chronological order."""
     with _pool.connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT role, content FROM chat_history WHERE client_id = %s ORDER BY timestamp ASC LIMIT %s;",
+                """SELECT role, content FROM (
+                       SELECT id, role, content, timestamp FROM chat_history
+                       WHERE client_id = %s ORDER BY timestamp DESC, id DESC LIMIT %s
+                   ) recent ORDER BY timestamp ASC, id ASC;""",
                 (client_id, limit)
             )
             rows = cur.fetchall()
             
     return [{"role": r[0], "content": r[1]} for r in rows]
 
+# chat_history partition maintenance (monthly partitions, see lg_migrations), run from a
+# worker thread by lg_history_retention. The lock keeps several workers from doing it at once.
+_CHAT_PARTITIONS_LOCK_KEY = 7_246_530_002
+
+def chat_partitions() -> list[tuple[str, date]]:
+    """Attached chat_history partitions as (name, first day of their month), oldest first."""
+    with _pool.connection() as conn:
+        rows = conn.execute("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'chat_history'::regclass;
+        """).fetchall()
+    partitions = [(r[0], lg_migrations.chat_partition_month(r[0])) for r in rows]
+    return sorted((p for p in partitions if p[1]), key=lambda p: p[1])
+
+def chat_current_month() -> date:
+    """First day of the current month by the database clock (the one partition bounds follow)."""
+    with _pool.connection() as conn:
+        return conn.execute("SELECT date_trunc('month', LOCALTIMESTAMP)::date;").fetchone()[0]
+
+def ensure_chat_partitions(months_ahead: int) -> list[str]:
+    """
+    Create the partitions of the current month and the next `months_ahead`, and of any
+    month with messages in the default partition (they move into it). Returns the names created.
+    """
+    created = []
+    with _pool.connection() as conn:
+        conn.execute("SELECT pg_advisory_xact_lock(%s);", (_CHAT_PARTITIONS_LOCK_KEY,))
+        current = conn.execute("SELECT date_trunc('month', LOCALTIMESTAMP)::date;").fetchone()[0]
+        months = [lg_migrations.add_months(current, n) for n in range(months_ahead + 1)]
+        if conn.execute("SELECT to_regclass(%s);", (lg_migrations.CHAT_DEFAULT_PARTITION,)).fetchone()[0]:
+            strays = conn.execute(sql.SQL("SELECT DISTINCT date_trunc('month', timestamp)::date FROM {};").format(
+                sql.Identifier(lg_migrations.CHAT_DEFAULT_PARTITION))).fetchall()
+            months += [r[0] for r in strays]
+        for month in sorted(set(months)):
+            if lg_migrations.create_chat_partition(conn, month):
+                created.append(lg_migrations.chat_partition_name(month))
+    return created
+
+def archive_chat_partition(name: str, path: str) -> int | None:
+    """
+    Write a chat_history partition to `path` as gzip-compressed JSONL (one message per
+    line), then detach and drop it. The rows leave the database only after the archive
+    is on disk, in the transaction that read them. Returns the number of messages
+    archived, or None if another worker holds the maintenance lock.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with _pool.connection() as conn:
+            if not conn.execute("SELECT pg_try_advisory_xact_lock(%s);", (_CHAT_PARTITIONS_LOCK_KEY,)).fetchone()[0]:
+                return None
+            count = 0
+            # Named (server-side) cursor: the month is streamed, not loaded into memory
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f, conn.cursor(name="chat_archive") as cur:
+                cur.itersize = 2000
+                cur.execute(sql.SQL("SELECT id, client_id, role, content, timestamp FROM {} ORDER BY id;").format(
+                    sql.Identifier(name)))
+                for message_id, client_id, role, content, timestamp in cur:
+                    f.write(json.dumps({"id": message_id, "client_id": client_id, "role": role,
+                                        "content": content, "timestamp": timestamp.isoformat()}) + "\n")
+                    count += 1
+            with open(tmp_path, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+            # The archived messages leave these clients' history: new version (ETags change) and
+            # a changes floor at it, so /api/changes deltas from before give a full refresh
+            conn.execute(sql.SQL("""
+                UPDATE clients SET change_version = change_version + 1, changes_floor = change_version + 1
+                WHERE client_id IN (SELECT DISTINCT client_id FROM {});
+            """).format(sql.Identifier(name)))
+            conn.execute(sql.SQL("ALTER TABLE chat_history DETACH PARTITION {};").format(sql.Identifier(name)))
+            conn.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(name)))
+            return count
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# Agent checkpoint threads (LangGraph's tables) hold the same conversation text as chat_history.
+# A client's threads are their current one (clients.agent_thread) and, from before threads
+# rolled over, the one keyed by the client_id itself.
+CHECKPOINT_TABLES = ("checkpoints", "checkpoint_blobs", "checkpoint_writes")
+
+_STALE_AGENT_THREADS_QUERY = """
+    SELECT t.thread_id FROM clients c
+    CROSS JOIN LATERAL (VALUES (c.client_id), (c.agent_thread)) t(thread_id)
+    WHERE t.thread_id IS NOT NULL
+      AND EXISTS (SELECT 1 FROM checkpoints k WHERE k.thread_id = t.thread_id)
+      AND NOT EXISTS (
+          SELECT 1 FROM checkpoints k
+          WHERE k.thread_id = t.thread_id AND (k.checkpoint->>'ts')::timestamptz >= %s::timestamp
+      );
+"""
+
+def stale_agent_threads(cutoff: date) -> list[str]:
+    """Agent threads whose newest checkpoint is older than `cutoff` (database local time)."""
+    with _pool.connection() as conn:
+        return [r[0] for r in conn.execute(_STALE_AGENT_THREADS_QUERY, (cutoff,)).fetchall()]
+
+def delete_stale_agent_threads(cutoff: date) -> int:
+    """Delete the agent threads last used before `cutoff`. Returns the number deleted."""
+    threads = stale_agent_threads(cutoff)
+    checkpointer = PostgresSaver(_pool)
+    for thread_id in threads:
+        checkpointer.delete_thread(thread_id)
+    return len(threads)
+
 def add_objective(client_id: str, title: str, description: str = "") -> int:
     """Add a new objective for a client and return its ID."""
     with _pool.connection() as conn:
@@ -239,103 +461,296 @@ def add_objective(client_id: str, title: str, description: str = "") -> int:
                 "INSERT INTO client_objectives (client_id, title, description) VALUES (%s, %s, %s) RETURNING id;",
                 (client_id, title, description)
             )
-            return cur.fetchone()[0]
+            objective_id = cur.fetchone()[0]
+            _record_changes(cur, client_id, OBJECTIVE, [objective_id])
+            return objective_id
 
-def add_task(objective_id: int, title: str, weight: int = 1) -> int:
-    """Add a task to an objective and return its ID."""
+_INSERT_TASKS_QUERY = """
+    INSERT INTO client_tasks (objective_id, title, weight)
+    SELECT %s, t.title, t.weight
+    FROM unnest(%s::text[], %s::int[]) WITH ORDINALITY AS t(title, weight, n)
+    ORDER BY t.n
+    RETURNING id;
+"""
+
+def add_tasks(client_id: str, objective_id: int, tasks: list[dict]) -> list[int] | None:
+    """
+    Add several tasks ({title, weight}) to one of the client's objectives in one transaction.
+    Returns their IDs in order, or None if the objective doesn't belong to the client.
+    """
     with _pool.connection() as conn:
         with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM client_objectives WHERE id = %s AND client_id = %s;", (objective_id, client_id))
+            if not cur.fetchone():
+                return None
+            if not tasks:
+                return []
             cur.execute(
-                "INSERT INTO client_tasks (objective_id, title, weight) VALUES (%s, %s, %s) RETURNING id;",
-                (objective_id, title, weight)
+                _INSERT_TASKS_QUERY,
+                (objective_id, [t["title"] for t in tasks], [t.get("weight", 1) for t in tasks])
             )
-            return cur.fetchone()[0]
+            task_ids = sorted(r[0] for r in cur.fetchall())
+            cur.execute(_ADD_TASKS_PROGRESS_QUERY, (sum(t.get("weight", 1) for t in tasks), len(tasks), objective_id))
+            # Task changes are published as a change of their objective (which embeds its tasks)
+            _record_changes(cur, client_id, OBJECTIVE, [objective_id])
+            return task_ids
+
+def add_task(client_id: str, objective_id: int, title: str, weight: int = 1) -> int | None:
+    """Add a task to one of the client's objectives and return its ID (None if not the client's)."""
+    task_ids = add_tasks(client_id, objective_id, [{"title": title, "weight": weight}])
+    return task_ids[0] if task_ids else None
+
+# Objective progress read model: client_objectives.total_weight / done_weight / task_count /
+# done_count, and the client's xp_score / tasks_completed_count / objectives_completed_count,
+# always equal what the current tasks imply. Every task/objective mutation updates them in
+# its own transaction (queries below); rebuild_progress() recomputes them from scratch.
+# Removing a completed task or objective takes its XP and counts back.
+_ADD_TASKS_PROGRESS_QUERY = """
+    UPDATE client_objectives SET total_weight = total_weight + %s, task_count = task_count + %s
+    WHERE id = %s
+    RETURNING client_id;
+"""
+
+# The completion and removal queries below are single statements (one round trip) that
+# also bump the client's change_version and log the change, in the same UPDATE of clients
+# as the stats (a row can only be updated once per statement).
+
+# Marks the task done only if it is the client's and not completed yet: of two concurrent
+# completions the second finds is_completed already set, so XP is awarded once. Also moves
+# a 'not_started' objective to 'in_progress'. Returns the objective id if it was completed.
+_COMPLETE_TASK_QUERY = """
+    WITH t AS (
+        UPDATE client_tasks t SET is_completed = TRUE
+        FROM client_objectives o
+        WHERE t.id = %(task_id)s AND o.id = t.objective_id AND o.client_id = %(client_id)s
+          AND NOT t.is_completed
+        RETURNING t.objective_id, t.weight
+    ), o AS (
+        UPDATE client_objectives o
+        SET done_weight = o.done_weight + t.weight, done_count = o.done_count + 1,
+            status = CASE WHEN o.status = 'not_started' THEN 'in_progress' ELSE o.status END
+        FROM t WHERE o.id = t.objective_id
+    ), c AS (
+        UPDATE clients c
+        SET xp_score = c.xp_score + t.weight, tasks_completed_count = c.tasks_completed_count + 1,
+            change_version = c.change_version + 1
+        FROM t WHERE c.client_id = %(client_id)s
+        RETURNING c.change_version
+    )
+    INSERT INTO client_changes (client_id, version, entity, entity_id, op)
+    SELECT %(client_id)s, c.change_version, %(entity)s, t.objective_id, 'upsert' FROM c, t
+    RETURNING entity_id;
+"""
+
+_COMPLETE_OBJECTIVE_QUERY = """
+    WITH o AS (
+        UPDATE client_objectives SET status = 'completed'
+        WHERE id = %(objective_id)s AND client_id = %(client_id)s AND status != 'completed'
+        RETURNING id
+    ), c AS (
+        UPDATE clients c
+        SET objectives_completed_count = c.objectives_completed_count + 1,
+            change_version = c.change_version + 1
+        FROM o WHERE c.client_id = %(client_id)s
+        RETURNING c.change_version
+    )
+    INSERT INTO client_changes (client_id, version, entity, entity_id, op)
+    SELECT %(client_id)s, c.change_version, %(entity)s, o.id, 'upsert' FROM c, o
+    RETURNING entity_id;
+"""
+
+# Returns the task's objective id if it was removed.
+_REMOVE_TASK_QUERY = """
+    WITH t AS (
+        DELETE FROM client_tasks
+        WHERE id = %(task_id)s
+          AND objective_id IN (SELECT id FROM client_objectives WHERE client_id = %(client_id)s)
+        RETURNING objective_id, weight, is_completed
+    ), o AS (
+        UPDATE client_objectives o
+        SET total_weight = o.total_weight - t.weight, task_count = o.task_count - 1,
+            done_weight = o.done_weight - CASE WHEN t.is_completed THEN t.weight ELSE 0 END,
+            done_count = o.done_count - CASE WHEN t.is_completed THEN 1 ELSE 0 END
+        FROM t WHERE o.id = t.objective_id
+    ), c AS (
+        UPDATE clients c
+        SET xp_score = c.xp_score - CASE WHEN t.is_completed THEN t.weight ELSE 0 END,
+            tasks_completed_count = c.tasks_completed_count - CASE WHEN t.is_completed THEN 1 ELSE 0 END,
+            change_version = c.change_version + 1
+        FROM t WHERE c.client_id = %(client_id)s
+        RETURNING c.change_version
+    )
+    INSERT INTO client_changes (client_id, version, entity, entity_id, op)
+    SELECT %(client_id)s, c.change_version, %(entity)s, t.objective_id, 'upsert' FROM c, t
+    RETURNING entity_id;
+"""
+
+# Tasks go with ON DELETE CASCADE; their completed weight/count come from the objective's
+# progress columns. Returns the objective id if it was removed.
+_REMOVE_OBJECTIVE_QUERY = """
+    WITH o AS (
+        DELETE FROM client_objectives WHERE id = %(objective_id)s AND client_id = %(client_id)s
+        RETURNING id, status, done_weight, done_count
+    ), c AS (
+        UPDATE clients c
+        SET xp_score = c.xp_score - o.done_weight,
+            tasks_completed_count = c.tasks_completed_count - o.done_count,
+            objectives_completed_count = c.objectives_completed_count - CASE WHEN o.status = 'completed' THEN 1 ELSE 0 END,
+            change_version = c.change_version + 1
+        FROM o WHERE c.client_id = %(client_id)s
+        RETURNING c.change_version
+    )
+    INSERT INTO client_changes (client_id, version, entity, entity_id, op)
+    SELECT %(client_id)s, c.change_version, %(entity)s, o.id, 'delete' FROM c, o
+    RETURNING entity_id;
+"""
+
+_OBJECTIVE_PROGRESS_QUERY = """
+    SELECT id, status, total_weight, done_weight, task_count, done_count
+    FROM client_objectives WHERE id = %s AND client_id = %s;
+"""
+
+def _progress_from_row(r) -> dict:
+    return {
+        "objective_id": r[0], "status": r[1],
+        "total_weight": r[2], "done_weight": r[3], "task_count": r[4], "done_count": r[5],
+        "ratio": r[3] / r[2] if r[2] else 0.0,
+    }
+
+# Consistency checker: recompute the read model from the tasks (client_id NULL = everyone),
+# only touching rows that drifted. Objectives first: client stats are summed from them.
+_REBUILD_OBJECTIVE_PROGRESS_QUERY = """
+    WITH actual AS (
+        SELECT o.id,
+               COALESCE(SUM(t.weight), 0) AS total_weight,
+               COALESCE(SUM(t.weight) FILTER (WHERE t.is_completed), 0) AS done_weight,
+               COUNT(t.id) AS task_count,
+               COUNT(t.id) FILTER (WHERE t.is_completed) AS done_count
+        FROM client_objectives o LEFT JOIN client_tasks t ON t.objective_id = o.id
+        WHERE %(client_id)s::text IS NULL OR o.client_id = %(client_id)s
+        GROUP BY o.id
+    )
+    UPDATE client_objectives o
+    SET total_weight = a.total_weight, done_weight = a.done_weight,
+        task_count = a.task_count, done_count = a.done_count
+    FROM actual a
+    WHERE o.id = a.id
+      AND (o.total_weight, o.done_weight, o.task_count, o.done_count)
+          IS DISTINCT FROM (a.total_weight, a.done_weight, a.task_count, a.done_count)
+    RETURNING o.id, o.client_id;
+"""
+
+_REBUILD_CLIENT_STATS_QUERY = """
+    WITH actual AS (
+        SELECT c.client_id,
+               COALESCE(SUM(o.done_weight), 0) AS xp_score,
+               COALESCE(SUM(o.done_count), 0) AS tasks_completed_count,
+               COUNT(o.id) FILTER (WHERE o.status = 'completed') AS objectives_completed_count
+        FROM clients c LEFT JOIN client_objectives o ON o.client_id = c.client_id
+        WHERE %(client_id)s::text IS NULL OR c.client_id = %(client_id)s
+        GROUP BY c.client_id
+    )
+    UPDATE clients c
+    SET xp_score = a.xp_score, tasks_completed_count = a.tasks_completed_count,
+        objectives_completed_count = a.objectives_completed_count
+    FROM actual a
+    WHERE c.client_id = a.client_id
+      AND (c.xp_score, c.tasks_completed_count, c.objectives_completed_count)
+          IS DISTINCT FROM (a.xp_score, a.tasks_completed_count, a.objectives_completed_count)
+    RETURNING c.client_id;
+"""
+
+def rebuild_progress(client_id: str | None = None, dry_run: bool = False) -> dict:
+    """
+    Recompute objective progress and client stats from the tasks (one client, or all).
+    Returns how many rows had drifted; with dry_run the fixes are rolled back. Fixed
+    objectives go to the change log and every client touched gets a new change_version,
+    so ETags and /api/changes pick up the repair.
+    """
+    with _pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_REBUILD_OBJECTIVE_PROGRESS_QUERY, {"client_id": client_id})
+            fixed = cur.fetchall()
+            objectives = [r[0] for r in fixed]
+            cur.execute(_REBUILD_CLIENT_STATS_QUERY, {"client_id": client_id})
+            clients = [r[0] for r in cur.fetchall()]
+            by_client = {c: [] for c in clients}
+            for objective_id, owner in fixed:
+                by_client.setdefault(owner, []).append(objective_id)
+            for owner, ids in by_client.items():
+                _record_changes(cur, owner, OBJECTIVE, ids)
+        if dry_run:
+            conn.rollback()
+    return {"objectives_fixed": objectives, "clients_fixed": clients}
+
+def get_objective_progress(client_id: str, objective_id: int) -> dict | None:
+    """Progress of one objective (single-row lookup on the read model)."""
+    with _pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_OBJECTIVE_PROGRESS_QUERY, (objective_id, client_id))
+            row = cur.fetchone()
+    return _progress_from_row(row) if row else None
+
+# One round trip: objectives with their tasks aggregated as a JSON array (same nested shape)
+_OBJECTIVES_SELECT = """
+    SELECT o.id, o.title, o.description, o.status,
+           COALESCE(
+               json_agg(
+                   json_build_object('id', t.id, 'title', t.title, 'weight', t.weight, 'is_completed', t.is_completed)
+                   ORDER BY t.created_at ASC, t.id ASC
+               ) FILTER (WHERE t.id IS NOT NULL),
+               '[]'
+           ) AS tasks,
+           o.total_weight, o.done_weight, o.task_count, o.done_count
+    FROM client_objectives o
+    LEFT JOIN client_tasks t ON t.objective_id = o.id
+    WHERE {where}
+    GROUP BY o.id
+    ORDER BY o.created_at DESC;
+"""
+_OBJECTIVES_QUERY = _OBJECTIVES_SELECT.format(where="o.client_id = %s")
+# Only some objectives (delta sync)
+_OBJECTIVES_BY_ID_QUERY = _OBJECTIVES_SELECT.format(where="o.client_id = %s AND o.id = ANY(%s)")
+
+def _objectives_from_rows(rows) -> list[dict]:
+    return [
+        {"id": r[0], "title": r[1], "description": r[2], "status": r[3], "tasks": r[4],
+         "progress": {"total_weight": r[5], "done_weight": r[6], "task_count": r[7], "done_count": r[8],
+                      "ratio": r[6] / r[5] if r[5] else 0.0}}
+        for r in rows
+    ]
 
 def get_client_objectives(client_id: str) -> list[dict]:
     """Retrieve all objectives and their tasks for a client."""
     with _pool.connection() as conn:
         with conn.cursor() as cur:
-            # Fetch objectives
-            cur.execute("SELECT id, title, description, status FROM client_objectives WHERE client_id = %s ORDER BY created_at DESC;", (client_id,))
-            objectives = []
-            for row in cur.fetchall():
-                obj_id, title, desc, status = row
-                # Fetch tasks for each objective
-                cur.execute("SELECT id, title, weight, is_completed FROM client_tasks WHERE objective_id = %s ORDER BY created_at ASC;", (obj_id,))
-                tasks = [{"id": t[0], "title": t[1], "weight": t[2], "is_completed": t[3]} for t in cur.fetchall()]
-                objectives.append({
-                    "id": obj_id,
-                    "title": title,
-                    "description": desc,
-                    "status": status,
-                    "tasks": tasks
-                })
-            return objectives
+            cur.execute(_OBJECTIVES_QUERY, (client_id,))
+            return _objectives_from_rows(cur.fetchall())
 
 def complete_task(client_id: str, task_id: int) -> bool:
     """Mark task as completed, update XP and counters. Returns True if successful."""
-    with _pool.connection() as conn:
+    with _autocommit() as conn:
         with conn.cursor() as cur:
-            # Get task details and verify ownership
-            cur.execute("""
-                SELECT t.id, t.weight, t.is_completed, o.id 
-                FROM client_tasks t
-                JOIN client_objectives o ON t.objective_id = o.id
-                WHERE t.id = %s AND o.client_id = %s
-            """, (task_id, client_id))
-            res = cur.fetchone()
-            if not res or res[2]: # Not found or already completed
-                return False
-            
-            weight, objective_id = res[1], res[3]
-
-            # Mark complete
-            cur.execute("UPDATE client_tasks SET is_completed = TRUE WHERE id = %s", (task_id,))
-            
-            # Update Client Stats
-            cur.execute("""
-                UPDATE clients 
-                SET xp_score = xp_score + %s, tasks_completed_count = tasks_completed_count + 1 
-                WHERE client_id = %s
-            """, (weight, client_id))
-
-            # Auto-update status to 'in_progress' if it was 'not_started'
-            cur.execute("""
-                UPDATE client_objectives SET status = 'in_progress' 
-                WHERE id = %s AND status = 'not_started'
-            """, (objective_id,))
-            
-            return True
+            cur.execute(_COMPLETE_TASK_QUERY, {"task_id": task_id, "client_id": client_id, "entity": OBJECTIVE})
+            # No row: not found, not the client's, or already completed
+            return cur.fetchone() is not None
 
 def complete_objective(client_id: str, objective_id: int) -> bool:
-    with _pool.connection() as conn:
+    with _autocommit() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE client_objectives SET status = 'completed' 
-                WHERE id = %s AND client_id = %s AND status != 'completed'
-            """, (objective_id, client_id))
-            
-            if cur.rowcount > 0:
-                cur.execute("UPDATE clients SET objectives_completed_count = objectives_completed_count + 1 WHERE client_id = %s", (client_id,))
-                return True
-            return False
+            cur.execute(_COMPLETE_OBJECTIVE_QUERY, {"objective_id": objective_id, "client_id": client_id, "entity": OBJECTIVE})
+            return cur.fetchone() is not None
 
 def remove_objective(client_id: str, objective_id: int) -> None:
     """Remove an objective (and cascade delete tasks). Client ID check for security."""
-    with _pool.connection() as conn:
+    with _autocommit() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                "DELETE FROM client_objectives WHERE id = %s AND client_id = %s;",
-                (objective_id, client_id)
-            )
+            # Also takes back the XP and counts of its completed tasks / itself
+            cur.execute(_REMOVE_OBJECTIVE_QUERY, {"objective_id": objective_id, "client_id": client_id, "entity": OBJECTIVE})
 
 def remove_task(client_id: str, task_id: int) -> None:
     """Remove a specific task. Client ID check via join ensures ownership."""
-    with _pool.connection() as conn:
+    with _autocommit() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                """DELETE FROM client_tasks 
-                   WHERE id = %s 
-                   AND objective_id IN (SELECT id FROM client_objectives WHERE client_id = %s);""",
-                (task_id, client_id)
-            )
+            # Also updates the objective's progress (and XP if the task was completed)
+            cur.execute(_REMOVE_TASK_QUERY, {"task_id": task_id, "client_id": client_id, "entity": OBJECTIVE})
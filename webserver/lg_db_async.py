@@ -0,0 +1,734 @@
+"""
+Async variant of the lg_db API, backed by psycopg_pool.AsyncConnectionPool.
+
+Used by the async FastAPI routes and the agent tools so a DB call in flight never
+blocks the event loop. Same function names and return shapes as lg_db; schema setup
+(init_db) stays in lg_db. Call open_pool() at startup and close_pool() at shutdown.
+"""
+import os
+import json
+import hmac
+import time
+import hashlib
+from contextlib import asynccontextmanager
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+from lg_db import (
+    _CONNINFO, POOL_KWARGS, PREPARED_MAX, _OBJECTIVES_QUERY, _OBJECTIVES_BY_ID_QUERY, _CONTEXT_WINDOW_QUERY, _FREE_SLOTS_QUERY,
+    _EVENTS_IN_RANGE_QUERY, _RECORD_CHANGES_QUERY, EVENT, OBJECTIVE, MESSAGE,
+    _INSERT_TASKS_QUERY, _ADD_TASKS_PROGRESS_QUERY, _COMPLETE_TASK_QUERY, _COMPLETE_OBJECTIVE_QUERY, _REMOVE_TASK_QUERY, _REMOVE_OBJECTIVE_QUERY,
+    _OBJECTIVE_PROGRESS_QUERY, _progress_from_row, _ADD_CHAT_MESSAGES_QUERY, _chat_messages_params,
+    _objectives_from_rows, _free_slots_params, _slots_from_rows, _events_from_rows, _change_params,
+)
+
+
+async def _configure_connection(conn) -> None:
+    conn.prepared_max = PREPARED_MAX  # see lg_db.PREPARED_MAX
+
+# the pool must be opened from inside the running event loop (see open_pool)
+_pool = AsyncConnectionPool(conninfo=_CONNINFO, open=False, configure=_configure_connection, **POOL_KWARGS)
+
+# LangGraph checkpointer on the same pool: persistent agent threads (one per client and
+# summary, see switch_agent_thread).
+# Its tables are created by lg_migrations. AsyncPostgresSaver binds to the running event
+# loop, so it is created by open_pool(), not at import.
+_checkpointer: AsyncPostgresSaver | None = None
+
+
+# Verified-credential cache: client_id -> (sha256 of secret, expiry). Only successful checks
+# are cached, so a hit skips the DB round trip entirely. register_device invalidates its entry,
+# in other workers through a best-effort NOTIFY (lg_pubsub), which empties the whole cache when
+# its listener reconnects (notifications may have been missed). The TTL bounds what remains:
+# how long a replaced secret can stay valid on another worker if a notification is lost.
+_AUTH_CACHE_TTL = float(os.getenv("LG_AUTH_CACHE_TTL", "30"))  # seconds, 0 disables the cache
+_AUTH_CACHE_MAX_SIZE = int(os.getenv("LG_AUTH_CACHE_MAX_SIZE", "10000"))
+_auth_cache: dict[str, tuple[bytes, float]] = {}
+
+
+async def open_pool() -> None:
+    """Open the async pool and create the checkpointer. Must be called from the running event loop (app startup)."""
+    global _checkpointer
+    await _pool.open()
+    _checkpointer = AsyncPostgresSaver(_pool)
+
+
+def get_checkpointer() -> AsyncPostgresSaver:
+    """The agent checkpointer (after open_pool())."""
+    if _checkpointer is None:
+        raise RuntimeError("lg_db_async.open_pool() must be called before the checkpointer is used")
+    return _checkpointer
+
+
+async def close_pool() -> None:
+    global _run_lock_conn
+    if _run_lock_conn is not None:
+        await _run_lock_conn.close()
+        _run_lock_conn = None
+    await _pool.close()
+
+
+# Agent runs are exclusive per client across workers (they share the client's checkpoint
+# thread): a session-level advisory lock per client, (RUN_LOCK_CLASS, hashtext(client_id)).
+# All of a worker's run locks live on one dedicated connection, so a run doesn't pin a pool
+# connection for its whole duration. If that connection drops, its locks go with it.
+RUN_LOCK_CLASS = 72_465_300
+_run_lock_conn: psycopg.AsyncConnection | None = None
+
+async def try_lock_client_runs(client_id: str) -> bool:
+    """Take the client's run lock. False if a run for this client holds it on another worker."""
+    global _run_lock_conn
+    if _run_lock_conn is None or _run_lock_conn.closed:
+        _run_lock_conn = await psycopg.AsyncConnection.connect(_CONNINFO, autocommit=True)
+    cur = await _run_lock_conn.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s));", (RUN_LOCK_CLASS, client_id))
+    return (await cur.fetchone())[0]
+
+async def unlock_client_runs(client_id: str) -> None:
+    """Release the client's run lock (taken by try_lock_client_runs)."""
+    if _run_lock_conn is None or _run_lock_conn.closed:
+        return  # the lock went with the session
+    await _run_lock_conn.execute("SELECT pg_advisory_unlock(%s, hashtext(%s));", (RUN_LOCK_CLASS, client_id))
+
+
+@asynccontextmanager
+async def _autocommit():
+    """Pool connection in autocommit mode, for single-statement writes (see lg_db._autocommit)."""
+    async with _pool.connection() as conn:
+        await conn.set_autocommit(True)
+        try:
+            yield conn
+        finally:
+            await conn.set_autocommit(False)
+
+
+async def lg_hello_db() -> str:
+    """
+    Query SELECT * FROM hello and return results as a JSON string.
+    """
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT * FROM hello;")
+            rows = await cur.fetchall()  # list of tuples
+    # convert tuples to lists for JSON serialization
+    return json.dumps([list(r) for r in rows])
+
+
+def _secret_digest(secret: str) -> bytes:
+    return hashlib.sha256(secret.encode()).digest()
+
+def invalidate_client(client_id: str) -> None:
+    """Drop a client's cached credentials (e.g. after its secret changed)."""
+    _auth_cache.pop(client_id, None)
+
+def invalidate_all_clients() -> None:
+    """Drop every cached credential (e.g. invalidations may have been missed)."""
+    _auth_cache.clear()
+
+async def register_device(client_id: str, secret: str) -> None:
+    """Store the device uuid and secret pair."""
+    invalidate_client(client_id)
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                INSERT INTO clients (client_id, secret)
+                VALUES (%s, %s)
+                ON CONFLICT (client_id)
+                DO UPDATE SET secret = EXCLUDED.secret;
+                """,
+                (client_id, secret)
+            )
+
+async def get_uuid_secret_count(uuid: str, secret: str) -> int:
+    """Return the count of stored uuid-secret pairs."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT COUNT(*) FROM clients WHERE client_id = %s AND secret = %s;", (uuid, secret))
+            count = (await cur.fetchone())[0]
+    return count
+
+async def get_client_stats(client_id: str) -> dict:
+    """Retrieve XP score, tasks completed count, and objectives completed count."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT xp_score, tasks_completed_count, objectives_completed_count FROM clients WHERE client_id = %s;",
+                (client_id,)
+            )
+            row = await cur.fetchone()
+            if row:
+                return {
+                    "xp_score": row[0],
+                    "tasks_completed_count": row[1],
+                    "objectives_completed_count": row[2]
+                }
+            return {"xp_score": 0, "tasks_completed_count": 0, "objectives_completed_count": 0}
+
+async def get_client(client_id: str, secret: str) -> bool:
+    """Check if client_id and secret match. Verified pairs are served from a TTL cache."""
+    digest = _secret_digest(secret)
+    cached = _auth_cache.get(client_id)
+    if cached and cached[1] > time.monotonic() and hmac.compare_digest(cached[0], digest):
+        return True
+
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT 1 FROM clients WHERE client_id = %s AND secret = %s",
+                (client_id, secret)
+            )
+            valid = (await cur.fetchone()) is not None
+
+    if valid and _AUTH_CACHE_TTL > 0:
+        _auth_cache.pop(client_id, None)
+        if len(_auth_cache) >= _AUTH_CACHE_MAX_SIZE:
+            _auth_cache.pop(next(iter(_auth_cache)))  # evict the oldest entry
+        _auth_cache[client_id] = (digest, time.monotonic() + _AUTH_CACHE_TTL)
+    return valid
+
+async def _record_changes(cur, client_id: str, entity: str, ids: list[int], op: str = "upsert") -> None:
+    await cur.execute(_RECORD_CHANGES_QUERY, _change_params(client_id, entity, ids, op))
+
+async def get_change_version(client_id: str) -> int:
+    """The client's current change version (bumped by every write to its data)."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT change_version FROM clients WHERE client_id = %s;", (client_id,))
+            row = await cur.fetchone()
+    return row[0] if row else 0
+
+async def get_changes(client_id: str, since: int) -> dict | None:
+    """
+    Rows changed after version `since`: {"version", "events": {"upserted", "removed"},
+    "objectives": {"upserted", "removed"}, "messages": [...]}. Returns None when the log no
+    longer reaches back to `since` (pruned, or an unknown version): refetch everything.
+    """
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT change_version, changes_floor FROM clients WHERE client_id = %s;", (client_id,)
+            )
+            row = await cur.fetchone()
+            if not row or since < row[1] or since > row[0]:
+                return None
+            version = row[0]
+
+            # Latest operation per changed row
+            await cur.execute(
+                """SELECT DISTINCT ON (entity, entity_id) entity, entity_id, op
+                   FROM client_changes
+                   WHERE client_id = %s AND version > %s AND version <= %s
+                   ORDER BY entity, entity_id, version DESC;""",
+                (client_id, since, version)
+            )
+            changed = await cur.fetchall()
+            upserted = {EVENT: [], OBJECTIVE: [], MESSAGE: []}
+            removed = {EVENT: [], OBJECTIVE: [], MESSAGE: []}
+            for entity, entity_id, op in changed:
+                (removed if op == "delete" else upserted)[entity].append(entity_id)
+
+            events, objectives, messages = [], [], []
+            if upserted[EVENT]:
+                await cur.execute(
+                    """SELECT id, title, start_time, end_time FROM calendar_events
+                       WHERE client_id = %s AND id = ANY(%s) ORDER BY start_time, id;""",
+                    (client_id, upserted[EVENT])
+                )
+                events = _events_from_rows(await cur.fetchall())
+            if upserted[OBJECTIVE]:
+                await cur.execute(
+                    _OBJECTIVES_BY_ID_QUERY, (client_id, upserted[OBJECTIVE])
+                )
+                objectives = _objectives_from_rows(await cur.fetchall())
+            if upserted[MESSAGE]:
+                await cur.execute(
+                    """SELECT id, role, content FROM chat_history
+                       WHERE client_id = %s AND id = ANY(%s) ORDER BY timestamp, id;""",
+                    (client_id, upserted[MESSAGE])
+                )
+                messages = [{"id": r[0], "role": r[1], "content": r[2]} for r in await cur.fetchall()]
+
+    # Rows changed and then deleted before this read are gone: report them as removed
+    found_events = {e["id"] for e in events}
+    found_objectives = {o["id"] for o in objectives}
+    return {
+        "version": version,
+        "events": {"upserted": events,
+                   "removed": removed[EVENT] + [i for i in upserted[EVENT] if i not in found_events]},
+        "objectives": {"upserted": objectives,
+                       "removed": removed[OBJECTIVE] + [i for i in upserted[OBJECTIVE] if i not in found_objectives]},
+        "messages": messages,
+    }
+
+async def prune_changes(keep_seconds: int) -> int:
+    """
+    Delete change log rows older than `keep_seconds`, remembering per client the newest
+    pruned version (changes_floor) so older `since` values get a full refresh.
+    """
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                WITH pruned AS (
+                    DELETE FROM client_changes
+                    WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    RETURNING client_id, version
+                ), floors AS (
+                    SELECT client_id, MAX(version) AS version, COUNT(*) AS n FROM pruned GROUP BY client_id
+                ), updated AS (
+                    UPDATE clients c SET changes_floor = GREATEST(c.changes_floor, f.version)
+                    FROM floors f WHERE c.client_id = f.client_id
+                )
+                SELECT COALESCE(SUM(n), 0) FROM floors;
+                """,
+                (keep_seconds,)
+            )
+            return (await cur.fetchone())[0]
+
+async def add_calendar_event(client_id: str, title: str, start_time: str, end_time: str) -> int:
+    """Add a calendar event to the database and return its ID."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "INSERT INTO calendar_events (client_id, title, start_time, end_time) VALUES (%s, %s, %s, %s) RETURNING id;",
+                (client_id, title, start_time, end_time)
+            )
+            event_id = (await cur.fetchone())[0]
+            await _record_changes(cur, client_id, EVENT, [event_id])
+            return event_id
+
+async def add_calendar_events(client_id: str, events: list[dict]) -> list[int]:
+    """Add several events ({title, start_time, end_time}) in one transaction. Returns their IDs in order."""
+    if not events:
+        return []
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                INSERT INTO calendar_events (client_id, title, start_time, end_time)
+                SELECT %s, e.title, e.start_time, e.end_time
+                FROM unnest(%s::text[], %s::timestamp[], %s::timestamp[]) WITH ORDINALITY AS e(title, start_time, end_time, n)
+                ORDER BY e.n
+                RETURNING id;
+                """,
+                (client_id, [e["title"] for e in events], [e["start_time"] for e in events],
+                 [e["end_time"] for e in events])
+            )
+            event_ids = sorted(r[0] for r in await cur.fetchall())
+            await _record_changes(cur, client_id, EVENT, event_ids)
+            return event_ids
+
+async def remove_calendar_event(client_id: str, title: str) -> None:
+    """Remove a calendar event from the database."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "DELETE FROM calendar_events WHERE client_id = %s AND title = %s RETURNING id;",
+                (client_id, title)
+            )
+            removed = [r[0] for r in await cur.fetchall()]
+            if removed:
+                await _record_changes(cur, client_id, EVENT, removed, "delete")
+
+async def get_all_events(client_id: str) -> list[dict]:
+    """Retrieve all calendar events for a specific client."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT id, title, start_time, end_time FROM calendar_events WHERE client_id = %s;", (client_id,))
+            rows = await cur.fetchall()
+
+    # Convert to list of dicts for frontend
+    events = []
+    for r in rows:
+        events.append({
+            "id": r[0],
+            "title": r[1],
+            "start": r[2],
+            "end": r[3]
+        })
+    return events
+
+async def get_events_in_range(client_id: str, range_start: str, range_end: str, limit: int = 1000) -> list[dict]:
+    """Retrieve a client's calendar events overlapping [range_start, range_end), earliest first."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_EVENTS_IN_RANGE_QUERY, (client_id, range_end, range_start, limit))
+            return _events_from_rows(await cur.fetchall())
+
+async def find_free_slots(client_id: str, range_start: str, range_end: str, duration_minutes: int = 60,
+                          day_start: str = "09:00", day_end: str = "18:00", limit: int = 10) -> list[dict]:
+    """Free intervals of at least `duration_minutes` within working hours, earliest first."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_FREE_SLOTS_QUERY, _free_slots_params(
+                client_id, range_start, range_end, duration_minutes, day_start, day_end, limit))
+            return _slots_from_rows(await cur.fetchall())
+
+async def add_chat_message(client_id: str, role: str, content: str) -> None:
+    """Save a chat message to the history."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "INSERT INTO chat_history (client_id, role, content) VALUES (%s, %s, %s) RETURNING id;",
+                (client_id, role, content)
+            )
+            await _record_changes(cur, client_id, MESSAGE, [(await cur.fetchone())[0]])
+
+async def add_chat_messages(messages: list[tuple[str, str, str]]) -> None:
+    """Save (client_id, role, content) messages, possibly of several clients, in one statement."""
+    if not messages:
+        return
+    async with _autocommit() as conn:
+        await conn.execute(_ADD_CHAT_MESSAGES_QUERY, _chat_messages_params(messages))
+
+async def get_chat_history(client_id: str, limit: int = 50) -> list[dict]:
+    """Retrieve the newest `limit` chat messages for a client, in chronological order."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """SELECT role, content FROM (
+                       SELECT id, role, content, timestamp FROM chat_history
+                       WHERE client_id = %s ORDER BY timestamp DESC, id DESC LIMIT %s
+                   ) recent ORDER BY timestamp ASC, id ASC;""",
+                (client_id, limit)
+            )
+            rows = await cur.fetchall()
+
+    return [{"role": r[0], "content": r[1]} for r in rows]
+
+async def get_context_window(client_id: str, max_tokens: int, max_messages: int = 200, after_id: int = 0) -> list[dict]:
+    """
+    Retrieve the newest messages that fit in a token budget, in chronological order.
+    Walks chat_history backwards on (client_id, timestamp, id), so the cost depends on
+    the window size, not on how long the history is. The newest message is always included.
+    Messages with id <= after_id (already covered by the summary) are skipped.
+    """
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_CONTEXT_WINDOW_QUERY, (client_id, after_id, max_messages, max_tokens))
+            rows = await cur.fetchall()
+
+    return [{"role": r[0], "content": r[1]} for r in rows]
+
+async def get_chat_summary(client_id: str) -> dict | None:
+    """Retrieve the stored conversation summary and the last message id it covers."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT summary, last_message_id FROM chat_summaries WHERE client_id = %s;",
+                (client_id,)
+            )
+            row = await cur.fetchone()
+    if row:
+        return {"summary": row[0], "last_message_id": row[1]}
+    return None
+
+async def save_chat_summary(client_id: str, summary: str, last_message_id: int) -> None:
+    """Store a summary. Never moves the watermark backwards if two summarizers race."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                INSERT INTO chat_summaries (client_id, summary, last_message_id)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (client_id) DO UPDATE
+                SET summary = EXCLUDED.summary,
+                    last_message_id = EXCLUDED.last_message_id,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE chat_summaries.last_message_id < EXCLUDED.last_message_id;
+                """,
+                (client_id, summary, last_message_id)
+            )
+
+async def switch_agent_thread(client_id: str, thread_id: str) -> str | None:
+    """
+    Record `thread_id` as the client's agent thread. Returns the thread it replaces (the
+    client_id itself for clients from before threads rolled over), or None if unchanged.
+    """
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE clients c SET agent_thread = %s
+                FROM (SELECT client_id, agent_thread FROM clients WHERE client_id = %s FOR UPDATE) old
+                WHERE c.client_id = old.client_id AND c.agent_thread IS DISTINCT FROM %s
+                RETURNING COALESCE(old.agent_thread, old.client_id);
+                """,
+                (thread_id, client_id, thread_id)
+            )
+            row = await cur.fetchone()
+    return row[0] if row else None
+
+async def get_messages_to_summarize(client_id: str, after_id: int, keep_recent: int, limit: int = 200) -> list[dict]:
+    """
+    Retrieve messages newer than the summary watermark, excluding the newest `keep_recent`
+    (those stay verbatim in the prompt), oldest first.
+    """
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT id, role, content FROM chat_history
+                WHERE client_id = %s AND id > %s
+                  AND id < COALESCE((
+                      SELECT MIN(id) FROM (
+                          SELECT id FROM chat_history WHERE client_id = %s
+                          ORDER BY timestamp DESC, id DESC LIMIT %s
+                      ) tail
+                  ), 0)
+                ORDER BY timestamp ASC, id ASC
+                LIMIT %s;
+                """,
+                (client_id, after_id, client_id, keep_recent, limit)
+            )
+            rows = await cur.fetchall()
+    return [{"id": r[0], "role": r[1], "content": r[2]} for r in rows]
+
+async def create_chat_job(job_id: str, client_id: str, question: str) -> None:
+    async with _pool.connection() as conn:
+        await conn.execute(
+            "INSERT INTO chat_jobs (id, client_id, question) VALUES (%s, %s, %s);",
+            (job_id, client_id, question)
+        )
+
+async def update_chat_job(job_id: str, status: str, result: str | None = None, error: str | None = None) -> None:
+    async with _pool.connection() as conn:
+        await conn.execute(
+            """UPDATE chat_jobs SET status = %s, result = %s, error = %s, updated_at = CURRENT_TIMESTAMP
+               WHERE id = %s;""",
+            (status, result, error, job_id)
+        )
+
+async def get_chat_job(client_id: str, job_id: str) -> dict | None:
+    """Retrieve a job of this client (None if it doesn't exist or belongs to someone else)."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """SELECT id, status, result, error, created_at, updated_at
+                   FROM chat_jobs WHERE id = %s AND client_id = %s;""",
+                (job_id, client_id)
+            )
+            row = await cur.fetchone()
+    if not row:
+        return None
+    return {
+        "id": row[0], "status": row[1], "result": row[2], "error": row[3],
+        "created_at": row[4].isoformat() if row[4] else None,
+        "updated_at": row[5].isoformat() if row[5] else None,
+    }
+
+async def touch_chat_jobs(job_ids: list[str]) -> None:
+    """Heartbeat: mark these unfinished jobs as still owned by a live worker."""
+    async with _pool.connection() as conn:
+        await conn.execute(
+            """UPDATE chat_jobs SET updated_at = CURRENT_TIMESTAMP
+               WHERE id = ANY(%s) AND status IN ('queued', 'running');""",
+            (job_ids,)
+        )
+
+async def expire_chat_jobs(stale_after: int, keep_for: int) -> int:
+    """
+    Fail queued/running jobs whose heartbeat (updated_at, refreshed by touch_chat_jobs) is
+    older than `stale_after` seconds, i.e. their worker died, and delete finished jobs
+    older than `keep_for` seconds. Returns the number failed.
+    """
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """UPDATE chat_jobs
+                   SET status = 'error', error = 'Lost: the server restarted before the reply was ready.',
+                       updated_at = CURRENT_TIMESTAMP
+                   WHERE status IN ('queued', 'running')
+                     AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s);""",
+                (stale_after,)
+            )
+            failed = cur.rowcount
+            await cur.execute(
+                """DELETE FROM chat_jobs
+                   WHERE status IN ('done', 'error', 'rejected')
+                     AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s);""",
+                (keep_for,)
+            )
+    return failed
+
+async def claim_idempotency_key(client_id: str, key: str, request_hash: str, ttl: int, lock_timeout: int) -> bool:
+    """
+    Claim an idempotency key for a new request. Returns False if the key is taken: by a
+    stored response younger than `ttl`, or an in-progress claim younger than `lock_timeout`.
+    """
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                INSERT INTO idempotency_keys (client_id, key, request_hash)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (client_id, key) DO UPDATE
+                SET request_hash = EXCLUDED.request_hash, status_code = NULL, response = NULL,
+                    created_at = CURRENT_TIMESTAMP
+                WHERE idempotency_keys.created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                   OR (idempotency_keys.status_code IS NULL
+                       AND idempotency_keys.created_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                RETURNING 1;
+                """,
+                (client_id, key, request_hash, ttl, lock_timeout)
+            )
+            return await cur.fetchone() is not None
+
+async def get_idempotency_key(client_id: str, key: str) -> dict | None:
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT request_hash, status_code, response FROM idempotency_keys WHERE client_id = %s AND key = %s;",
+                (client_id, key)
+            )
+            row = await cur.fetchone()
+    if row:
+        return {"request_hash": row[0], "status_code": row[1], "response": row[2]}
+    return None
+
+async def save_idempotent_response(client_id: str, key: str, status_code: int, response: str) -> None:
+    async with _pool.connection() as conn:
+        await conn.execute(
+            "UPDATE idempotency_keys SET status_code = %s, response = %s WHERE client_id = %s AND key = %s;",
+            (status_code, response, client_id, key)
+        )
+
+async def release_idempotency_key(client_id: str, key: str) -> None:
+    """Drop an in-progress claim (the request failed), so a retry runs again."""
+    async with _pool.connection() as conn:
+        await conn.execute(
+            "DELETE FROM idempotency_keys WHERE client_id = %s AND key = %s AND status_code IS NULL;",
+            (client_id, key)
+        )
+
+async def delete_expired_idempotency_keys(ttl: int) -> int:
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s);",
+                (ttl,)
+            )
+            return cur.rowcount
+
+async def add_objective(client_id: str, title: str, description: str = "") -> int:
+    """Add a new objective for a client and return its ID."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "INSERT INTO client_objectives (client_id, title, description) VALUES (%s, %s, %s) RETURNING id;",
+                (client_id, title, description)
+            )
+            objective_id = (await cur.fetchone())[0]
+            await _record_changes(cur, client_id, OBJECTIVE, [objective_id])
+            return objective_id
+
+async def add_objective_with_tasks(client_id: str, title: str, description: str, tasks: list[dict]) -> tuple[int, list[int]]:
+    """
+    Create an objective and its tasks ({title, weight}) in one transaction.
+    Returns (objective_id, task_ids in order).
+    """
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """INSERT INTO client_objectives (client_id, title, description, total_weight, task_count)
+                   VALUES (%s, %s, %s, %s, %s) RETURNING id;""",
+                (client_id, title, description, sum(t.get("weight", 1) for t in tasks), len(tasks))
+            )
+            objective_id = (await cur.fetchone())[0]
+            task_ids = []
+            if tasks:
+                await cur.execute(
+                    _INSERT_TASKS_QUERY,
+                    (objective_id, [t["title"] for t in tasks], [t.get("weight", 1) for t in tasks])
+                )
+                task_ids = sorted(r[0] for r in await cur.fetchall())
+            await _record_changes(cur, client_id, OBJECTIVE, [objective_id])
+            return objective_id, task_ids
+
+async def add_tasks(client_id: str, objective_id: int, tasks: list[dict]) -> list[int] | None:
+    """
+    Add several tasks ({title, weight}) to one of the client's objectives in one transaction.
+    Returns their IDs in order, or None if the objective doesn't belong to the client.
+    """
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT 1 FROM client_objectives WHERE id = %s AND client_id = %s;",
+                (objective_id, client_id)
+            )
+            if not await cur.fetchone():
+                return None
+            if not tasks:
+                return []
+            await cur.execute(
+                _INSERT_TASKS_QUERY,
+                (objective_id, [t["title"] for t in tasks], [t.get("weight", 1) for t in tasks])
+            )
+            task_ids = sorted(r[0] for r in await cur.fetchall())
+            await cur.execute(_ADD_TASKS_PROGRESS_QUERY, (sum(t.get("weight", 1) for t in tasks), len(tasks), objective_id))
+            await _record_changes(cur, client_id, OBJECTIVE, [objective_id])
+            return task_ids
+
+async def get_client_objectives(client_id: str) -> list[dict]:
+    """Retrieve all objectives and their tasks for a client."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_OBJECTIVES_QUERY, (client_id,))
+            return _objectives_from_rows(await cur.fetchall())
+
+async def get_objective_progress(client_id: str, objective_id: int) -> dict | None:
+    """Progress of one objective (single-row lookup on the read model)."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_OBJECTIVE_PROGRESS_QUERY, (objective_id, client_id))
+            row = await cur.fetchone()
+    return _progress_from_row(row) if row else None
+
+async def complete_task(client_id: str, task_id: int) -> bool:
+    """Mark task as completed, update XP and counters. Returns True if successful."""
+    async with _autocommit() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_COMPLETE_TASK_QUERY, {"task_id": task_id, "client_id": client_id, "entity": OBJECTIVE})
+            # No row: not found, not the client's, or already completed
+            return await cur.fetchone() is not None
+
+async def complete_objective(client_id: str, objective_id: int) -> bool:
+    async with _autocommit() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_COMPLETE_OBJECTIVE_QUERY, {"objective_id": objective_id, "client_id": client_id, "entity": OBJECTIVE})
+            return await cur.fetchone() is not None
+
+async def remove_objective(client_id: str, objective_id: int) -> None:
+    """Remove an objective (and cascade delete tasks). Client ID check for security."""
+    async with _autocommit() as conn:
+        async with conn.cursor() as cur:
+            # Also takes back the XP and counts of its completed tasks / itself
+            await cur.execute(_REMOVE_OBJECTIVE_QUERY, {"objective_id": objective_id, "client_id": client_id, "entity": OBJECTIVE})
+
+async def remove_task(client_id: str, task_id: int) -> None:
+    """Remove a specific task. Client ID check via join ensures ownership."""
+    async with _autocommit() as conn:
+        async with conn.cursor() as cur:
+            # Also updates the objective's progress (and XP if the task was completed)
+            await cur.execute(_REMOVE_TASK_QUERY, {"task_id": task_id, "client_id": client_id, "entity": OBJECTIVE})
+
+async def notify(channel: str, payload: str) -> None:
+    """Send a Postgres NOTIFY on a channel (delivered to listeners on commit)."""
+    async with _pool.connection() as conn:
+        await conn.execute("SELECT pg_notify(%s, %s);", (channel, payload))
+
+async def spill_pubsub_message(payload: str) -> int:
+    """Store a message too large for NOTIFY and return its id. Also sweeps expired ones."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("DELETE FROM pubsub_messages WHERE created_at < CURRENT_TIMESTAMP - interval '5 minutes';")
+            await cur.execute("INSERT INTO pubsub_messages (payload) VALUES (%s) RETURNING id;", (payload,))
+            return (await cur.fetchone())[0]
+
+async def get_pubsub_message(message_id: int) -> str | None:
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT payload FROM pubsub_messages WHERE id = %s;", (message_id,))
+            row = await cur.fetchone()
+    return row[0] if row else None
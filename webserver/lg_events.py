@@ -0,0 +1,46 @@
+"""
+Per-client change events (calendar event added/removed, objective created, task completed, ...).
+
+The bus captures the server's event loop at startup, so publish() works from anywhere:
+from coroutines on the loop (async tools and routes) and from worker threads, which hand
+the event over with call_soon_threadsafe. Delivery is a coroutine supplied by the server
+(sending to the client's open WebSockets) and never blocks the publisher.
+
+Message shape: {"type": "<event type>", ...event fields}
+"""
+import json
+import asyncio
+
+
+class EventBus:
+    def __init__(self, deliver):
+        # deliver(client_id, message: str) -> coroutine
+        self._deliver = deliver
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def bind(self, loop: asyncio.AbstractEventLoop | None = None) -> None:
+        """Capture the event loop deliveries run on. Call once from app startup."""
+        self._loop = loop or asyncio.get_running_loop()
+
+    def publish(self, client_id: str | None, event_type: str, **data) -> None:
+        """Send a change event to one client's sockets (fire and forget)."""
+        if self._loop is None or client_id is None:
+            return
+        message = json.dumps({"type": event_type, **data}, default=str)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is self._loop:
+            self._spawn(client_id, message)
+        else:
+            # Called from a worker thread: schedule on the captured loop
+            self._loop.call_soon_threadsafe(self._spawn, client_id, message)
+
+    def _spawn(self, client_id: str, message: str) -> None:
+        task = self._loop.create_task(self._deliver(client_id, message))
+        # Keep a reference until done so the task isn't garbage collected mid-send
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,92 @@
+"""
+Retention and archival for chat_history.
+
+chat_history is partitioned by month (lg_migrations), so old messages are never deleted
+row by row. Each pass, at startup and then every `interval` seconds:
+
+- creates the partitions for the current month and the next `months_ahead`, and moves any
+  message that landed in the default partition (its month had none) into its month;
+- archives every month older than the last `keep_months` (by the database clock, like the
+  partition bounds) to
+  <archive_dir>/chat_history_yYYYYmMM.jsonl.gz, then detaches and drops its partition;
+- deletes the agent checkpoint threads last used before those months (they hold the same
+  conversation text).
+
+Archiving is off by default (LG_CHAT_RETENTION_MONTHS=0 keeps everything): it drops data,
+so an operator opts in, e.g. LG_CHAT_RETENTION_MONTHS=12 with LG_CHAT_ARCHIVE_DIR pointing
+at durable storage. Partitions are created either way.
+
+With retention on, the table and its indexes hold at most keep_months + months_ahead
+partitions, however long the app runs. Queries that filter on timestamp only visit the partitions they need, and
+the newest-first reads (chat history, context window) scan the newest partition first and
+stop at their LIMIT.
+
+The work runs in a thread (file I/O and gzip), on the sync lg_db pool.
+"""
+import os
+import asyncio
+import lg_db
+import lg_migrations
+
+
+class HistoryRetention:
+    def __init__(self, keep_months: int, months_ahead: int, archive_dir: str, interval: int):
+        self.keep_months = keep_months  # 0 keeps everything
+        self.months_ahead = months_ahead
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start the retention loop. Must be called from the running event loop."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def run_once(self) -> dict:
+        """One maintenance pass (blocking). Returns the partitions created and archived, and the threads deleted."""
+        created = lg_db.ensure_chat_partitions(self.months_ahead)
+        archived = {}
+        threads = 0
+        if self.keep_months > 0:
+            # Months before this one are archived (the current month counts as one kept)
+            cutoff = lg_migrations.add_months(lg_db.chat_current_month(), 1 - self.keep_months)
+            old = [name for name, month in lg_db.chat_partitions() if month < cutoff]
+            if old:
+                os.makedirs(self.archive_dir, exist_ok=True)
+            for name in old:
+                count = lg_db.archive_chat_partition(name, os.path.join(self.archive_dir, f"{name}.jsonl.gz"))
+                if count is None:
+                    break  # another worker is on it
+                archived[name] = count
+            threads = lg_db.delete_stale_agent_threads(cutoff)
+        return {"created": created, "archived": archived, "threads_deleted": threads}
+
+    async def _run(self):
+        while True:
+            try:
+                result = await asyncio.to_thread(self.run_once)
+                if result["created"]:
+                    print(f"INFO: Created chat history partitions {', '.join(result['created'])}")
+                for name, count in result["archived"].items():
+                    print(f"INFO: Archived {count} chat messages from {name} to {self.archive_dir}")
+                if result["threads_deleted"]:
+                    print(f"INFO: Deleted {result['threads_deleted']} agent threads unused since the retention cutoff")
+            except Exception as e:
+                print(f"ERROR: Chat history retention failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+history_retention = HistoryRetention(
+    keep_months=int(os.getenv("LG_CHAT_RETENTION_MONTHS", "0")),
+    months_ahead=int(os.getenv("LG_CHAT_PARTITIONS_AHEAD", "3")),
+    archive_dir=os.getenv("LG_CHAT_ARCHIVE_DIR", "archive/chat_history"),
+    interval=int(os.getenv("LG_CHAT_RETENTION_INTERVAL", "86400")),
+)
@@ -0,0 +1,145 @@
+"""
+Write-behind queue for chat_history.
+
+Every chat turn saves the question and the reply. Instead of one INSERT + commit per
+message on its own pool connection, add() queues the message and a background flusher
+writes everything queued within the flush interval (LG_CHAT_WRITE_FLUSH_INTERVAL,
+default 20 ms) as one multi-row INSERT (lg_db_async.add_chat_messages), across clients
+and requests. Under load that is one commit and one connection checkout per batch
+instead of per message.
+
+Durability (LG_CHAT_WRITE_DURABILITY):
+- "ack" (default): add() returns once the batch holding the message is committed, so a
+  turn is never acknowledged before its messages are stored. Concurrent turns still share
+  commits (group commit); a lone message waits up to one flush interval.
+- "shutdown": add() returns immediately; the queue is flushed on the interval and at
+  shutdown (stop()). A crashed worker loses what was queued, and readers may briefly
+  miss the newest messages (call flush() first where that matters).
+
+Before start() (scripts, tests) add() writes directly.
+"""
+import os
+import asyncio
+import lg_db_async
+
+
+ACK = "ack"
+SHUTDOWN = "shutdown"
+
+# Pause before retrying a batch that failed in "shutdown" mode
+RETRY_DELAY = 1.0  # seconds
+
+
+class HistoryWriter:
+    def __init__(self, flush_interval: float, max_batch: int, durability: str):
+        if durability not in (ACK, SHUTDOWN):
+            raise ValueError(f"Unknown chat write durability {durability!r} (expected {ACK!r} or {SHUTDOWN!r})")
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.durability = durability
+        # (client_id, role, content, future to resolve once written, or None)
+        self._pending: list[tuple[str, str, str, asyncio.Future | None]] = []
+        self._wakeup: asyncio.Event | None = None
+        self._lock: asyncio.Lock | None = None
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        # metrics
+        self._batches = 0
+        self._messages = 0
+        self._largest_batch = 0
+        self._failures = 0
+
+    def start(self) -> None:
+        """Start the flusher. Must be called from the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flusher after its current batch, then write everything still queued."""
+        if self._task:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._pending:
+            print(f"ERROR: {len(self._pending)} chat messages could not be saved at shutdown")
+
+    async def add(self, client_id: str, role: str, content: str) -> None:
+        """Queue a chat message (in "ack" mode, wait until it is committed)."""
+        if self._task is None:
+            await lg_db_async.add_chat_messages([(client_id, role, content)])
+            return
+        future = asyncio.get_running_loop().create_future() if self.durability == ACK else None
+        self._pending.append((client_id, role, content, future))
+        self._wakeup.set()
+        if future is not None:
+            await future
+
+    async def flush(self) -> bool:
+        """Write everything queued so far, in batches of at most max_batch. False if a batch was re-queued."""
+        if self._lock is None:
+            return True  # not started: add() wrote directly
+        async with self._lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                if not await self._write(batch):
+                    return False
+        return True
+
+    def metrics(self) -> dict:
+        return {
+            "durability": self.durability,
+            "queued": len(self._pending),
+            "batches_total": self._batches,
+            "messages_total": self._messages,
+            "messages_per_batch_avg": self._messages / self._batches if self._batches else 0.0,
+            "largest_batch": self._largest_batch,
+            "failed_batches_total": self._failures,
+        }
+
+    async def _run(self):
+        while not self._closing:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Give concurrent turns a moment to join the batch, unless it is already full
+            if len(self._pending) < self.max_batch and not self._closing:
+                await asyncio.sleep(self.flush_interval)
+            if not await self.flush() and not self._closing:
+                # A failed batch was re-queued: retry after a pause instead of spinning
+                await asyncio.sleep(RETRY_DELAY)
+                self._wakeup.set()
+
+    async def _write(self, batch: list) -> bool:
+        """Insert one batch. On failure, waiters get the error ("ack") or it is re-queued ("shutdown")."""
+        try:
+            await lg_db_async.add_chat_messages([(c, r, t) for c, r, t, _ in batch])
+        except Exception as e:
+            self._failures += 1
+            if self.durability == ACK:
+                print(f"ERROR: Could not save {len(batch)} chat messages: {e}")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return True
+            print(f"ERROR: Could not save {len(batch)} chat messages, will retry: {e}")
+            self._pending[:0] = batch
+            return False
+
+        self._batches += 1
+        self._messages += len(batch)
+        self._largest_batch = max(self._largest_batch, len(batch))
+        for *_, future in batch:
+            if future is not None and not future.done():
+                future.set_result(None)
+        return True
+
+
+history_writer = HistoryWriter(
+    flush_interval=float(os.getenv("LG_CHAT_WRITE_FLUSH_INTERVAL", "0.02")),  # seconds
+    max_batch=int(os.getenv("LG_CHAT_WRITE_MAX_BATCH", "500")),
+    durability=os.getenv("LG_CHAT_WRITE_DURABILITY", ACK),
+)
@@ -0,0 +1,113 @@
+"""
+Idempotency-Key support for POST endpoints.
+
+A client that retries a request after a network blip sends the same Idempotency-Key
+header. The first request claims the key in Postgres (idempotency_keys) and stores its
+response when done; a retry gets that stored response back (header
+Idempotent-Replayed: true) without running the handler again, so no second LLM loop and
+no duplicated events, objectives or XP.
+
+- Keys are scoped per client and per endpoint + body: reusing a key for a different
+  request is refused with 422.
+- A retry that arrives while the first request is still running gets 409.
+- Only successful (2xx/3xx) responses are stored; errors release the key so the
+  request can be retried for real.
+- Keys expire after TTL seconds; a background sweep deletes them.
+
+Usage (inside a route, after the client is authenticated):
+    return await idempotency.run(client_id, key, "/api/tasks", data, lambda: handler(data))
+"""
+import os
+import json
+import asyncio
+import hashlib
+from fastapi.responses import JSONResponse, Response
+import lg_db_async
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: int, lock_timeout: int, sweep_interval: int):
+        self.ttl = ttl
+        # A claim without a stored response older than this is assumed abandoned (worker died)
+        self.lock_timeout = lock_timeout
+        self.sweep_interval = sweep_interval
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start the expiry sweep. Must be called from the running event loop."""
+        self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self, client_id: str, key: str | None, endpoint: str, data, handler) -> Response:
+        """
+        Run handler() once per (client_id, key). handler is a coroutine function returning
+        a dict (sent as 200 JSON) or a Response. Without a key, just runs the handler.
+        """
+        if not key:
+            return _as_response(await handler())
+
+        fingerprint = request_fingerprint(endpoint, data)
+        if not await lg_db_async.claim_idempotency_key(client_id, key, fingerprint, self.ttl, self.lock_timeout):
+            stored = await lg_db_async.get_idempotency_key(client_id, key)
+            if stored is None:
+                # Expired and swept between the two queries: the caller can simply retry
+                return JSONResponse(content={"error": "Idempotency key expired, retry the request."}, status_code=409)
+            if stored["request_hash"] != fingerprint:
+                return JSONResponse(content={"error": "Idempotency-Key was already used for a different request."}, status_code=422)
+            if stored["status_code"] is None:
+                return JSONResponse(content={"error": "A request with this Idempotency-Key is still in progress."}, status_code=409)
+            print(f"DEBUG: Replaying {endpoint} for {client_id} (Idempotency-Key {key})")
+            return Response(
+                content=stored["response"],
+                status_code=stored["status_code"],
+                media_type="application/json",
+                headers={"Idempotent-Replayed": "true"},
+            )
+
+        try:
+            response = _as_response(await handler())
+        except BaseException:
+            # Nothing was produced (error or cancelled): let a retry run again
+            await asyncio.shield(lg_db_async.release_idempotency_key(client_id, key))
+            raise
+        if response.status_code >= 400:
+            await lg_db_async.release_idempotency_key(client_id, key)
+        else:
+            await lg_db_async.save_idempotent_response(client_id, key, response.status_code, response.body.decode())
+        return response
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                deleted = await lg_db_async.delete_expired_idempotency_keys(self.ttl)
+                if deleted:
+                    print(f"INFO: Deleted {deleted} expired idempotency keys")
+            except Exception as e:
+                print(f"ERROR: Idempotency key sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+
+def request_fingerprint(endpoint: str, data) -> str:
+    """Hash of the endpoint and request body (minus the secret), to detect key reuse."""
+    body = data.model_dump(exclude={"secret"}) if hasattr(data, "model_dump") else data
+    raw = json.dumps({"endpoint": endpoint, "body": body}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _as_response(result) -> Response:
+    return result if isinstance(result, Response) else JSONResponse(content=result)
+
+
+idempotency = IdempotencyStore(
+    ttl=int(os.getenv("LG_IDEMPOTENCY_TTL", "86400")),
+    lock_timeout=int(os.getenv("LG_IDEMPOTENCY_LOCK_TIMEOUT", "600")),
+    sweep_interval=int(os.getenv("LG_IDEMPOTENCY_SWEEP_INTERVAL", "3600")),
+)
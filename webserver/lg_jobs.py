@@ -0,0 +1,113 @@
+"""
+Asynchronous chat jobs.
+
+A long agent run shouldn't hold an HTTP request open (proxies time it out), so
+/api/chat can hand the turn to this runner and return a job id right away. The job's
+status and result are persisted in chat_jobs; the reply reaches the client's sockets as
+a normal chat_response (id = job id), and a client that was offline can collect it with
+GET /api/chat/jobs/{id}.
+
+A job is "queued" until the scheduler gives its turn a run slot, then "running", and
+ends "done", "error", or "rejected" when admission control refused it after all (the
+queue filled up between the check in /api/chat and the job starting, or another worker
+was running a turn for the client).
+
+Jobs run as tasks in this worker. A sweep every SWEEP_INTERVAL seconds refreshes the
+heartbeat (updated_at) of this worker's unfinished jobs, marks as failed the jobs whose
+heartbeat is older than STALE_AFTER (their worker died), and deletes finished jobs older
+than KEEP_FOR.
+"""
+import os
+import json
+import uuid
+import asyncio
+import lg_db_async
+import lg_scheduler
+
+
+# Queued/running jobs older than this are considered lost (their worker died)
+STALE_AFTER = int(os.getenv("LG_CHAT_JOB_STALE_AFTER", "900"))  # seconds
+# Finished jobs are kept this long for polling, then deleted
+KEEP_FOR = int(os.getenv("LG_CHAT_JOB_KEEP_FOR", "86400"))  # seconds
+# Heartbeat and expiry sweep; must stay well below STALE_AFTER
+SWEEP_INTERVAL = max(1, min(int(os.getenv("LG_CHAT_JOB_SWEEP_INTERVAL", "60")), STALE_AFTER // 3))  # seconds
+
+
+class JobRunner:
+    def __init__(self, run, publish):
+        # run(client_id, question, on_start) -> coroutine returning the reply text (already saved
+        # to chat_history); awaits on_start() once the turn has its run slot
+        # publish(client_id, message: str) -> coroutine, sends to the client's sockets
+        self._run = run
+        self._publish = publish
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._sweeper: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        """Start the heartbeat / expiry sweep. Must be called from the running event loop."""
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        """Stop the sweep and cancel this worker's jobs; they are recorded as failed."""
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(self, client_id: str, question: str) -> str:
+        """Persist a new job, start it in the background and return its id."""
+        job_id = uuid.uuid4().hex
+        await lg_db_async.create_chat_job(job_id, client_id, question)
+        task = asyncio.create_task(self._execute(job_id, client_id, question))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda t: self._tasks.pop(job_id, None))
+        return job_id
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                # Heartbeat first, so this worker's own jobs are never taken for lost
+                if self._tasks:
+                    await lg_db_async.touch_chat_jobs(list(self._tasks))
+                failed = await lg_db_async.expire_chat_jobs(STALE_AFTER, KEEP_FOR)
+                if failed:
+                    print(f"INFO: Marked {failed} stale chat jobs as failed")
+            except Exception as e:
+                print(f"ERROR: Chat job sweep failed: {e}")
+            await asyncio.sleep(SWEEP_INTERVAL)
+
+    async def _execute(self, job_id: str, client_id: str, question: str):
+        async def started():
+            await lg_db_async.update_chat_job(job_id, "running")
+        try:
+            result = await self._run(client_id, question, on_start=started)
+        except lg_scheduler.Rejected as e:
+            await self._fail(job_id, client_id, e.reason, status="rejected", http_status=e.status_code)
+        except asyncio.CancelledError:
+            await self._fail(job_id, client_id, "Cancelled: the server stopped before the reply was ready.")
+            raise
+        except Exception as e:
+            print(f"ERROR: Chat job {job_id} failed: {e}")
+            await self._fail(job_id, client_id, str(e))
+        else:
+            # Persist first, so a client that polls right after the push sees the result
+            await lg_db_async.update_chat_job(job_id, "done", result=result)
+            await self._publish(client_id, json.dumps(
+                {"type": "chat_response", "id": job_id, "job_id": job_id, "content": result}))
+
+    async def _fail(self, job_id: str, client_id: str, error: str, status: str = "error", http_status: int | None = None):
+        try:
+            await lg_db_async.update_chat_job(job_id, status, error=error)
+            event = {"type": "error", "id": job_id, "error": error}
+            if http_status:
+                event["status"] = http_status  # same shape as a rejected /ws turn
+            await self._publish(client_id, json.dumps(event))
+        except Exception as e:
+            print(f"ERROR: Could not record failure of chat job {job_id}: {e}")
@@ -0,0 +1,368 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once, inside its own transaction, and is recorded in
+schema_migrations. migrate() holds a Postgres advisory lock while it runs, so several
+workers starting at the same time don't race: the first applies pending migrations,
+the others wait and then find nothing left to do.
+
+LangGraph's checkpoint tables are set up here too, under the same lock.
+
+To change the schema, append a new (version, name, steps) entry to MIGRATIONS; never
+edit one that has shipped. A step is either a SQL string or a callable taking the
+connection (for migrations that need to inspect the current schema first).
+"""
+from datetime import date
+import psycopg
+from psycopg import sql
+from langgraph.checkpoint.postgres import PostgresSaver
+
+
+# Arbitrary constant identifying the migration lock in pg_advisory_lock
+MIGRATION_LOCK_KEY = 7_246_530_001
+
+PK_TYPE = "SERIAL PRIMARY KEY"
+JSON_TYPE = "JSONB"
+
+
+def _calendar_times_to_timestamp(conn):
+    """
+    Databases created by the old init_db, where the TEXT-typed duplicate definition of
+    calendar_events won, store event times as text: range filters then compare strings
+    and can't use the indexes as ranges. Convert those columns to TIMESTAMP.
+    """
+    rows = conn.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'calendar_events'
+          AND column_name IN ('start_time', 'end_time') AND data_type = 'text'
+    """).fetchall()
+    for (column,) in rows:
+        conn.execute(
+            f"ALTER TABLE calendar_events ALTER COLUMN {column} TYPE TIMESTAMP USING {column}::timestamp"
+        )
+        print(f"Converted calendar_events.{column} from TEXT to TIMESTAMP")
+
+
+# chat_history is partitioned by month on timestamp: chat_history_y2026m01 holds January 2026.
+# Partitions are created ahead of time (lg_db.ensure_chat_partitions), so old months can be
+# detached cheaply (see lg_history_retention). The default partition only catches messages
+# whose month has no partition yet; creating that month's partition moves them into it.
+CHAT_PARTITION_PREFIX = "chat_history_y"
+CHAT_DEFAULT_PARTITION = "chat_history_default"
+CHAT_PARTITIONS_AHEAD = 3  # months created past the current one by the migration
+
+
+def add_months(month: date, n: int) -> date:
+    """First day of the month n months after `month`'s."""
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def chat_partition_name(month: date) -> str:
+    return f"{CHAT_PARTITION_PREFIX}{month.year:04d}m{month.month:02d}"
+
+
+def chat_partition_month(name: str) -> date | None:
+    """Inverse of chat_partition_name (None for tables not named like a partition)."""
+    try:
+        year, month = name.removeprefix(CHAT_PARTITION_PREFIX).split("m")
+        return date(int(year), int(month), 1)
+    except ValueError:
+        return None
+
+
+def create_chat_partition(conn, month: date) -> bool:
+    """
+    Create the chat_history partition for a month, moving that month's messages out of the
+    default partition (Postgres refuses the new partition while the default holds any).
+    Returns False if it already existed.
+    """
+    name = chat_partition_name(month)
+    if conn.execute("SELECT to_regclass(%s)", (name,)).fetchone()[0]:
+        return False
+    bounds = (month, add_months(month, 1))
+    in_month = sql.SQL("timestamp >= {} AND timestamp < {}").format(*(sql.Literal(b.isoformat()) for b in bounds))
+    strays = False
+    if conn.execute("SELECT to_regclass(%s)", (CHAT_DEFAULT_PARTITION,)).fetchone()[0]:
+        strays = conn.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {} WHERE {})").format(
+            sql.Identifier(CHAT_DEFAULT_PARTITION), in_month)).fetchone()[0]
+    if strays:
+        conn.execute(sql.SQL("CREATE TEMP TABLE chat_history_strays AS SELECT * FROM {} WHERE {}").format(
+            sql.Identifier(CHAT_DEFAULT_PARTITION), in_month))
+        conn.execute(sql.SQL("DELETE FROM {} WHERE {}").format(sql.Identifier(CHAT_DEFAULT_PARTITION), in_month))
+    conn.execute(sql.SQL("CREATE TABLE {} PARTITION OF chat_history FOR VALUES FROM ({}) TO ({})").format(
+        sql.Identifier(name), *(sql.Literal(b.isoformat()) for b in bounds)))
+    if strays:
+        conn.execute("INSERT INTO chat_history SELECT * FROM chat_history_strays")
+        conn.execute("DROP TABLE chat_history_strays")
+    return True
+
+
+def _partition_chat_history(conn):
+    """
+    Rebuild chat_history as a table partitioned by month, moving the existing rows. The id
+    sequence is kept, so message ids (summary watermarks, change log) stay valid. The
+    primary key becomes (id, timestamp): a partitioned table's unique keys must include
+    the partition key.
+    """
+    kind = conn.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('chat_history')").fetchone()
+    if kind and kind[0] == "p":
+        return
+    sequence = conn.execute("SELECT pg_get_serial_sequence('chat_history', 'id')").fetchone()[0]
+    conn.execute("ALTER TABLE chat_history RENAME TO chat_history_unpartitioned")
+    conn.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY NONE").format(sql.SQL(sequence)))
+    conn.execute(sql.SQL("""CREATE TABLE chat_history (
+        id INTEGER NOT NULL DEFAULT nextval({}::regclass),
+        client_id TEXT REFERENCES clients(client_id),
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) PARTITION BY RANGE (timestamp)""").format(sql.Literal(sequence)))
+    conn.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY chat_history.id").format(sql.SQL(sequence)))
+
+    oldest, newest = conn.execute("""
+        SELECT date_trunc('month', MIN(timestamp))::date, date_trunc('month', MAX(timestamp))::date
+        FROM chat_history_unpartitioned
+    """).fetchone()
+    current = conn.execute("SELECT date_trunc('month', LOCALTIMESTAMP)::date").fetchone()[0]
+    month, last = min(oldest or current, current), max(newest or current, add_months(current, CHAT_PARTITIONS_AHEAD))
+    while month <= last:
+        create_chat_partition(conn, month)
+        month = add_months(month, 1)
+
+    moved = conn.execute("""
+        INSERT INTO chat_history (id, client_id, role, content, timestamp)
+        SELECT id, client_id, role, content, COALESCE(timestamp, CURRENT_TIMESTAMP) FROM chat_history_unpartitioned
+    """).rowcount
+    conn.execute("DROP TABLE chat_history_unpartitioned")
+    conn.execute("ALTER TABLE chat_history ADD PRIMARY KEY (id, timestamp)")
+    conn.execute("CREATE INDEX idx_chat_history_client_ts_id ON chat_history (client_id, timestamp, id)")
+    print(f"Partitioned chat_history by month ({moved} rows moved)")
+
+
+MIGRATIONS = [
+    (1, "baseline schema", [
+        f"""CREATE TABLE IF NOT EXISTS clients (
+            client_id TEXT PRIMARY KEY,
+            secret TEXT NOT NULL,
+            xp_score INTEGER DEFAULT 0,
+            tasks_completed_count INTEGER DEFAULT 0,
+            objectives_completed_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS client_objectives (
+            id {PK_TYPE},
+            client_id TEXT REFERENCES clients(client_id),
+            title TEXT NOT NULL,
+            description TEXT,
+            status TEXT DEFAULT 'not_started',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS client_tasks (
+            id {PK_TYPE},
+            objective_id INTEGER REFERENCES client_objectives(id) ON DELETE CASCADE,
+            title TEXT NOT NULL,
+            weight INTEGER DEFAULT 1,
+            is_completed BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS calendar_events (
+            id {PK_TYPE},
+            client_id TEXT REFERENCES clients(client_id),
+            title TEXT NOT NULL,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS chat_history (
+            id {PK_TYPE},
+            client_id TEXT REFERENCES clients(client_id),
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS client_stats (
+            client_id TEXT PRIMARY KEY REFERENCES clients(client_id),
+            xp_score INTEGER DEFAULT 0,
+            last_active TIMESTAMP
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS client_agenda (
+            id {PK_TYPE},
+            client_id TEXT REFERENCES clients(client_id),
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            description TEXT,
+            objective_id INTEGER
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS client_completed_objectives (
+            id {PK_TYPE},
+            client_id TEXT REFERENCES clients(client_id),
+            data {JSON_TYPE},
+            score INTEGER,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS client_chat_history (
+            id {PK_TYPE},
+            client_id TEXT REFERENCES clients(client_id),
+            role TEXT,
+            content {JSON_TYPE},
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        # Old dev DBs may have calendar_events without an owner column
+        "ALTER TABLE calendar_events ADD COLUMN IF NOT EXISTS client_id TEXT REFERENCES clients(client_id)",
+    ]),
+    # One composite index per hot query in lg_db (filter column first, then the sort/range column)
+    (2, "indexes for hot queries", [
+        # get_chat_history: WHERE client_id ORDER BY timestamp
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_client_ts ON chat_history (client_id, timestamp)",
+        # get_all_events / remove_calendar_event: WHERE client_id (time-ordered for range scans)
+        "CREATE INDEX IF NOT EXISTS idx_calendar_events_client_start ON calendar_events (client_id, start_time)",
+        # get_client_objectives / remove_task ownership check: WHERE client_id ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS idx_client_objectives_client_created ON client_objectives (client_id, created_at)",
+        # tasks of an objective (objectives join, ON DELETE CASCADE)
+        "CREATE INDEX IF NOT EXISTS idx_client_tasks_objective_created ON client_tasks (objective_id, created_at)",
+    ]),
+    # Context window reads the newest rows first; id breaks ties between rows with the
+    # same timestamp so the backward index scan returns a stable order.
+    (3, "chat_history newest-first index", [
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_client_ts_id ON chat_history (client_id, timestamp, id)",
+        "DROP INDEX IF EXISTS idx_chat_history_client_ts",
+    ]),
+    # Rolling per-client summary of chat_history rows with id <= last_message_id
+    (4, "chat summaries", [
+        """CREATE TABLE IF NOT EXISTS chat_summaries (
+            client_id TEXT PRIMARY KEY REFERENCES clients(client_id),
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+    ]),
+    # Cross-worker messages too large for a NOTIFY payload (see lg_pubsub)
+    (5, "pubsub spill table", [
+        """CREATE TABLE IF NOT EXISTS pubsub_messages (
+            id BIGSERIAL PRIMARY KEY,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_pubsub_messages_created ON pubsub_messages (created_at)",
+    ]),
+    # Background chat turns started with /api/chat {"wait": false} (see lg_jobs)
+    (6, "chat jobs", [
+        """CREATE TABLE IF NOT EXISTS chat_jobs (
+            id TEXT PRIMARY KEY,
+            client_id TEXT REFERENCES clients(client_id),
+            question TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            result TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_chat_jobs_status_updated ON chat_jobs (status, updated_at)",
+    ]),
+    # Stored responses for Idempotency-Key retries (see lg_idempotency)
+    (7, "idempotency keys", [
+        """CREATE TABLE IF NOT EXISTS idempotency_keys (
+            client_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            request_hash TEXT NOT NULL,
+            status_code INTEGER,
+            response TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (client_id, key)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)",
+    ]),
+    # find_free_slots: events overlapping a future range, bounded by end_time > range start
+    (8, "calendar end-time index", [
+        "CREATE INDEX IF NOT EXISTS idx_calendar_events_client_end ON calendar_events (client_id, end_time)",
+    ]),
+    (9, "calendar event times as TIMESTAMP", [_calendar_times_to_timestamp]),
+    # Per-client change version and change log (ETags, /api/changes delta sync)
+    (10, "client change feed", [
+        "ALTER TABLE clients ADD COLUMN IF NOT EXISTS change_version BIGINT NOT NULL DEFAULT 0",
+        # Newest version whose log rows were pruned: deltas from before it need a full refresh
+        "ALTER TABLE clients ADD COLUMN IF NOT EXISTS changes_floor BIGINT NOT NULL DEFAULT 0",
+        """CREATE TABLE IF NOT EXISTS client_changes (
+            id BIGSERIAL PRIMARY KEY,
+            client_id TEXT NOT NULL,
+            version BIGINT NOT NULL,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_client_changes_client_version ON client_changes (client_id, version)",
+        "CREATE INDEX IF NOT EXISTS idx_client_changes_created ON client_changes (created_at)",
+    ]),
+    # Objective progress read model, kept up to date by the task/objective writes in lg_db.
+    # Client stats are left as they are: run testings/check_progress.py to fix any drift.
+    (11, "objective progress read model", [
+        """ALTER TABLE client_objectives
+            ADD COLUMN IF NOT EXISTS total_weight INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS done_weight INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS task_count INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS done_count INTEGER NOT NULL DEFAULT 0""",
+        """UPDATE client_objectives o
+           SET total_weight = a.total_weight, done_weight = a.done_weight,
+               task_count = a.task_count, done_count = a.done_count
+           FROM (
+               SELECT objective_id,
+                      SUM(weight) AS total_weight,
+                      COALESCE(SUM(weight) FILTER (WHERE is_completed), 0) AS done_weight,
+                      COUNT(*) AS task_count,
+                      COUNT(*) FILTER (WHERE is_completed) AS done_count
+               FROM client_tasks GROUP BY objective_id
+           ) a
+           WHERE o.id = a.objective_id""",
+    ]),
+    # Monthly partitions, so old months can be archived and detached (see lg_history_retention)
+    (12, "partition chat_history by month", [_partition_chat_history]),
+    # Safety net: a message whose month has no partition yet is still saved (see create_chat_partition)
+    (13, "chat_history default partition", [
+        f"CREATE TABLE IF NOT EXISTS {CHAT_DEFAULT_PARTITION} PARTITION OF chat_history DEFAULT",
+    ]),
+    # The client's current agent checkpoint thread (threads roll over with the summary, see server.py)
+    (14, "client agent thread", [
+        "ALTER TABLE clients ADD COLUMN IF NOT EXISTS agent_thread TEXT",
+    ]),
+]
+
+
+def migrate(conninfo: str) -> list[int]:
+    """Apply pending migrations in order. Returns the versions applied by this call."""
+    applied_now = []
+    # Dedicated autocommit connection: the advisory lock is session-level and each
+    # migration gets its own explicit transaction.
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            conn.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )""")
+            applied = {r[0] for r in conn.execute("SELECT version FROM schema_migrations").fetchall()}
+
+            for version, name, steps in MIGRATIONS:
+                if version in applied:
+                    continue
+                with conn.transaction():
+                    for step in steps:
+                        if callable(step):
+                            step(conn)
+                        else:
+                            conn.execute(step)
+                    conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name)
+                    )
+                print(f"Applied migration {version}: {name}")
+                applied_now.append(version)
+
+            # LangGraph's checkpoint tables are versioned by langgraph itself (idempotent).
+            # Run outside a transaction: it uses CREATE INDEX CONCURRENTLY.
+            PostgresSaver(conn).setup()
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+    return applied_now
@@ -0,0 +1,115 @@
+"""
+Cross-worker fan-out over Postgres LISTEN/NOTIFY.
+
+Sockets live in one worker's memory, but a chat reply or calendar change can be produced
+in any worker (or container). publish() delivers to this worker's sockets right away,
+then NOTIFYs the shared channel; every other worker LISTENs on a dedicated connection
+and delivers the message to the sockets it holds for that client_id. Workers skip their
+own notifications (origin = worker id).
+
+NOTIFY payloads are limited to 8000 bytes, so larger messages are spilled to the
+pubsub_messages table and only their id is sent.
+
+Delivery is best effort: notifications sent while a listener is disconnected are lost.
+A reconnecting listener therefore drops the whole credential cache instead of relying on
+the invalidations it may have missed.
+"""
+import json
+import uuid
+import asyncio
+import psycopg
+
+import lg_db_async
+from lg_db import _CONNINFO
+
+
+CHANNEL = "lg_client_events"
+# Stay well under Postgres' 8000-byte NOTIFY payload limit
+MAX_NOTIFY_BYTES = 7000
+
+
+class PgPubSub:
+    def __init__(self, deliver, conninfo: str = _CONNINFO, channel: str = CHANNEL):
+        # deliver(client_id, message: str) -> coroutine, sends to this worker's sockets
+        self._deliver = deliver
+        self._conninfo = conninfo
+        self.channel = channel
+        self.worker_id = uuid.uuid4().hex
+        self._task: asyncio.Task | None = None
+        self._deliveries: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        """Start the listener. Must be called from the running event loop."""
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish(self, client_id: str, message: str) -> None:
+        """Deliver a message to a client's sockets in every worker."""
+        await self._deliver(client_id, message)
+        await self._notify({"origin": self.worker_id, "client_id": client_id, "message": message})
+
+    async def invalidate_client(self, client_id: str) -> None:
+        """Drop a client's cached credentials in every worker (e.g. after a new secret)."""
+        lg_db_async.invalidate_client(client_id)
+        await self._notify({"origin": self.worker_id, "client_id": client_id, "invalidate": True})
+
+    async def _notify(self, envelope: dict) -> None:
+        # Best effort: local delivery already happened, so a DB hiccup must not fail the caller
+        try:
+            payload = json.dumps(envelope)
+            if len(payload.encode()) > MAX_NOTIFY_BYTES:
+                ref = await lg_db_async.spill_pubsub_message(payload)
+                payload = json.dumps({"origin": self.worker_id, "ref": ref})
+            await lg_db_async.notify(self.channel, payload)
+        except Exception as e:
+            print(f"ERROR: Pub/sub notify failed: {e}")
+
+    async def _listen(self):
+        backoff = 1
+        while True:
+            try:
+                # Dedicated autocommit connection: notifications are only delivered outside transactions
+                async with await psycopg.AsyncConnection.connect(self._conninfo, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {self.channel}")
+                    # Invalidations sent while this worker wasn't listening are lost: start over
+                    lg_db_async.invalidate_all_clients()
+                    print(f"INFO: Listening for cross-worker events on '{self.channel}'")
+                    backoff = 1
+                    async for notify in conn.notifies():
+                        await self._handle(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ERROR: Pub/sub listener failed, retrying in {backoff}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    async def _handle(self, payload: str):
+        try:
+            envelope = json.loads(payload)
+            if envelope.get("origin") == self.worker_id:
+                return
+            if "ref" in envelope:
+                spilled = await lg_db_async.get_pubsub_message(envelope["ref"])
+                if spilled is None:
+                    return
+                envelope = json.loads(spilled)
+
+            client_id = envelope["client_id"]
+            if envelope.get("invalidate"):
+                lg_db_async.invalidate_client(client_id)
+                return
+            # Don't hold up the listener on socket sends
+            task = asyncio.create_task(self._deliver(client_id, envelope["message"]))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+        except Exception as e:
+            print(f"ERROR: Bad pub/sub payload: {e}")
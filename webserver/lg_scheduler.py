@@ -0,0 +1,142 @@
+"""
+Admission control and fair scheduling for agent runs.
+
+- At most `max_concurrent` runs at once across the worker (protects the DB pool and the
+  LLM connection pool).
+- At most one run in flight per client; a client's extra requests wait in its own FIFO.
+  This holds within one worker; server.agent_run adds a Postgres lock per client across
+  workers (a request finding another worker's run in progress is rejected with 429).
+- Waiting clients are served round-robin, so one busy client can't starve the others.
+- When the queue is full a request is rejected immediately (Rejected: 429 if that
+  client already has too many queued, 503 if the whole queue is full).
+
+Usage:
+    async with scheduler.slot(client_id):
+        ... run the agent ...
+"""
+import os
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class Rejected(Exception):
+    """Request refused by admission control. status_code is the HTTP status to return."""
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+
+class AgentScheduler:
+    def __init__(self, max_concurrent: int, max_queue: int, max_queue_per_client: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self._running: set[str] = set()
+        # client_id -> waiting futures; key order is the round-robin order
+        self._waiting: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+        self._queued = 0
+        # metrics
+        self._admitted = 0
+        self._rejected = {429: 0, 503: 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+
+    def check(self, client_id: str) -> None:
+        """Raise Rejected if a new request from this client would not be admitted."""
+        if self._can_start(client_id):
+            return
+        if len(self._waiting.get(client_id, ())) >= self.max_queue_per_client:
+            self._rejected[429] += 1
+            raise Rejected(429, "Too many requests in progress for this client.")
+        if self._queued >= self.max_queue:
+            self._rejected[503] += 1
+            raise Rejected(503, "Server busy, please retry shortly.")
+
+    @asynccontextmanager
+    async def slot(self, client_id: str):
+        """Wait for a run slot for this client (or raise Rejected), release it on exit."""
+        await self._acquire(client_id)
+        try:
+            yield
+        finally:
+            self._release(client_id)
+
+    def metrics(self) -> dict:
+        return {
+            "running": len(self._running),
+            "queue_depth": self._queued,
+            "queued_clients": len(self._waiting),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted_total": self._admitted,
+            "rejected_429_total": self._rejected[429],
+            "rejected_503_total": self._rejected[503],
+            "wait_seconds_avg": self._wait_total / self._admitted if self._admitted else 0.0,
+            "wait_seconds_max": self._wait_max,
+            "wait_seconds_last": self._wait_last,
+        }
+
+    def _can_start(self, client_id: str) -> bool:
+        # Free slots are always handed out by _dispatch, so room now means nobody eligible is waiting
+        return (client_id not in self._running and client_id not in self._waiting
+                and len(self._running) < self.max_concurrent)
+
+    async def _acquire(self, client_id: str) -> None:
+        enqueued_at = time.monotonic()
+        self.check(client_id)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(client_id, deque()).append(future)
+        self._queued += 1
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: hand the slot on
+                self._release(client_id)
+            else:
+                self._remove_waiter(client_id, future)
+            raise
+
+        waited = time.monotonic() - enqueued_at
+        self._admitted += 1
+        self._wait_total += waited
+        self._wait_last = waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def _release(self, client_id: str) -> None:
+        self._running.discard(client_id)
+        self._dispatch()
+
+    def _remove_waiter(self, client_id: str, future: asyncio.Future) -> None:
+        waiters = self._waiting.get(client_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self._queued -= 1
+            if not waiters:
+                del self._waiting[client_id]
+
+    def _dispatch(self) -> None:
+        """Grant free slots to waiting clients, round-robin, skipping clients already running."""
+        while len(self._running) < self.max_concurrent:
+            client_id = next((c for c in self._waiting if c not in self._running), None)
+            if client_id is None:
+                return
+            waiters = self._waiting.pop(client_id)
+            future = waiters.popleft()
+            self._queued -= 1
+            if waiters:
+                self._waiting[client_id] = waiters  # re-inserted at the end: round-robin
+            self._running.add(client_id)
+            future.set_result(None)
+
+
+scheduler = AgentScheduler(
+    max_concurrent=int(os.getenv("LG_AGENT_MAX_CONCURRENT", "4")),
+    max_queue=int(os.getenv("LG_AGENT_MAX_QUEUE", "32")),
+    max_queue_per_client=int(os.getenv("LG_AGENT_MAX_QUEUE_PER_CLIENT", "2")),
+)
@@ -0,0 +1,96 @@
+"""
+Rolling conversation summaries.
+
+Older chat_history rows are compacted into one stored summary per client
+(chat_summaries), updated incrementally: each pass folds the messages after the
+current watermark into the previous summary. The agent then gets the summary plus the
+recent tail instead of a raw transcript.
+
+Summarization runs in a background task fed by schedule(), never on the request path.
+The LLM is injected, so any LangChain chat model works, including a local fake one.
+"""
+import os
+import asyncio
+import lg_db_async
+
+
+# Newest messages always left verbatim (never summarized)
+KEEP_RECENT = int(os.getenv("LG_SUMMARY_KEEP_RECENT", "10"))
+# Only summarize once this many unsummarized messages piled up (keeps LLM calls rare)
+MIN_BATCH = int(os.getenv("LG_SUMMARY_MIN_BATCH", "20"))
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and 'Genie', "
+    "their planning assistant. Update the summary with the new messages. Keep facts the "
+    "assistant will need later: the user's goals, preferences, decisions, commitments, "
+    "dates and open questions. Drop greetings and chit-chat. Be concise (at most ~300 words). "
+    "Reply with the updated summary only."
+)
+
+
+def build_summary_prompt(previous_summary: str | None, messages: list[dict]) -> list[dict]:
+    """Messages for the summarizer LLM: instructions, the previous summary and the new rows."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": (
+            f"Current summary:\n{previous_summary or '(none yet)'}\n\n"
+            f"New messages:\n{transcript}"
+        )},
+    ]
+
+
+class Summarizer:
+    """Background worker that keeps chat_summaries up to date."""
+
+    def __init__(self, get_llm):
+        # get_llm is a callable so the worker picks up a reloaded LLM (key rotation)
+        self._get_llm = get_llm
+        self._queue: asyncio.Queue | None = None
+        self._pending: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start the worker. Must be called from the running event loop."""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, client_id: str) -> None:
+        """Queue a summary pass for a client (deduplicated; returns immediately)."""
+        if self._queue is None or client_id in self._pending:
+            return
+        self._pending.add(client_id)
+        self._queue.put_nowait(client_id)
+
+    async def _run(self):
+        while True:
+            client_id = await self._queue.get()
+            # Discard before running, so messages arriving meanwhile schedule another pass
+            self._pending.discard(client_id)
+            try:
+                await self.summarize(client_id)
+            except Exception as e:
+                print(f"ERROR: Summary for {client_id} failed: {e}")
+
+    async def summarize(self, client_id: str) -> bool:
+        """Fold unsummarized messages into the stored summary. Returns True if it was updated."""
+        current = await lg_db_async.get_chat_summary(client_id)
+        after_id = current["last_message_id"] if current else 0
+        batch = await lg_db_async.get_messages_to_summarize(client_id, after_id, KEEP_RECENT)
+        if len(batch) < MIN_BATCH:
+            return False
+
+        previous = current["summary"] if current else None
+        response = await self._get_llm().ainvoke(build_summary_prompt(previous, batch))
+        await lg_db_async.save_chat_summary(client_id, response.content, batch[-1]["id"])
+        print(f"INFO: Summarized {len(batch)} messages for {client_id}")
+        return True
@@ -0,0 +1,82 @@
+"""
+Run-scoped cache for the agent's read tools.
+
+Within one ReAct run the model often calls get_objectives / get_calendar_events /
+get_user_stats several times. Each run gets a fresh ToolCache (begin_run()); read tools
+go through cached(), which keeps the serialized result per (client_id, entity, args), and
+write tools call invalidate() for the entities they touch, so a read after a write in
+the same run sees fresh data. end_run() resets the context, so the cache doesn't outlive
+its run in the request or job task.
+
+Nothing is shared between runs, so there is no staleness across requests. Hit/miss
+counts are logged at the end of each run and summed in totals() for the metrics endpoint.
+"""
+from contextvars import ContextVar, Token
+
+
+# Entities read tools are cached under; write tools invalidate by entity
+CALENDAR = "calendar"
+OBJECTIVES = "objectives"
+STATS = "stats"
+
+_current: ContextVar["ToolCache | None"] = ContextVar("tool_cache", default=None)
+_totals = {"runs": 0, "hits": 0, "misses": 0}
+
+
+class ToolCache:
+    def __init__(self):
+        self._entries: dict[tuple[str, str, tuple], str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, entity: str, client_id: str, load, args: tuple = ()):
+        key = (client_id, entity, args)
+        if key in self._entries:
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        value = await load()
+        self._entries[key] = value
+        return value
+
+    def invalidate(self, client_id: str, *entities: str) -> None:
+        for key in [k for k in self._entries if k[0] == client_id and k[1] in entities]:
+            del self._entries[key]
+
+
+def begin_run() -> tuple[ToolCache, Token]:
+    """Start a fresh cache for the agent run in the current context; pass both to end_run()."""
+    cache = ToolCache()
+    return cache, _current.set(cache)
+
+
+def end_run(cache: ToolCache, token: Token, label: str = "") -> None:
+    """Detach the run's cache from the context, log its hit/miss counts and add them to the totals."""
+    _current.reset(token)
+    _totals["runs"] += 1
+    _totals["hits"] += cache.hits
+    _totals["misses"] += cache.misses
+    if cache.hits or cache.misses:
+        print(f"DEBUG: Tool cache {label}: {cache.hits} hits, {cache.misses} misses")
+
+
+async def cached(entity: str, client_id: str, load, args: tuple = ()):
+    """
+    Return load()'s result, memoized for the current run per entity and args (e.g. a date
+    range). Outside a run, just loads.
+    """
+    cache = _current.get()
+    if cache is None:
+        return await load()
+    return await cache.get(entity, client_id, load, args)
+
+
+def invalidate(client_id: str, *entities: str) -> None:
+    """Drop cached reads of these entities for the current run (call after a write)."""
+    cache = _current.get()
+    if cache is not None:
+        cache.invalidate(client_id, *entities)
+
+
+def totals() -> dict:
+    return dict(_totals)
@@ -1,43 +1,98 @@
 import os
-from fastapi import FastAPI, Request, Query, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, Query, Header, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.tools import tool
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage
+from langchain_core.messages.utils import trim_messages, count_tokens_approximately
+from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
-from datetime import datetime
+from datetime import datetime, timezone, time as dt_time
 import json
 import lg_db
+import lg_db_async
+import lg_summary
+import lg_events
+import lg_pubsub
+import lg_scheduler
+import lg_jobs
+import lg_tool_cache
+import lg_changes
+from lg_tool_cache import CALENDAR, OBJECTIVES, STATS
+from lg_idempotency import idempotency
+from lg_history_writer import history_writer
+from lg_history_retention import history_retention
 import asyncio
+import signal
+import time
+import uuid
+import threading
+import httpx
 from pydantic import BaseModel, Field
 from contextvars import ContextVar
+from contextlib import aclosing, asynccontextmanager
 
 # Context to store current client_id during a request
 current_client_id = ContextVar("client_id", default=None)
 
 # WebSocket Connection Manager
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+    """
+    Tracks open sockets per authenticated client_id and delivers messages only to that client.
+    Sends run concurrently with a per-send timeout, so a slow or dead socket is dropped
+    instead of stalling everyone else.
+    """
+    def __init__(self, send_timeout: float = 5.0, max_concurrent_sends: int = 64):
+        self.active_connections: dict[str, set[WebSocket]] = {}
+        self.send_timeout = send_timeout
+        self._send_slots = asyncio.Semaphore(max_concurrent_sends)
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        self.active_connections.setdefault(client_id, set()).add(websocket)
+
+    def disconnect(self, websocket: WebSocket, client_id: str):
+        sockets = self.active_connections.get(client_id)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            del self.active_connections[client_id]
+
+    def connection_count(self, client_id: str | None = None) -> int:
+        if client_id is not None:
+            return len(self.active_connections.get(client_id, ()))
+        return sum(len(sockets) for sockets in self.active_connections.values())
+
+    async def send(self, client_id: str, websocket: WebSocket, message: str):
+        """Send to one socket, bounded by the send slots and timeout. Drops it on failure."""
+        try:
+            async with self._send_slots:
+                await asyncio.wait_for(websocket.send_text(message), timeout=self.send_timeout)
+        except Exception as e:
+            # Slow (timed out) or dead socket: drop it so it can't block later sends
+            print(f"WS Dropping {websocket.client} for {client_id}: {e!r}")
+            self.disconnect(websocket, client_id)
+            try:
+                await websocket.close(code=1013)
+            except Exception:
+                pass
+
+    async def send_to_client(self, client_id: str, message: str):
+        """Send a message to every open socket of one client, concurrently."""
+        sockets = list(self.active_connections.get(client_id, ()))
+        if sockets:
+            await asyncio.gather(*(self.send(client_id, ws, message) for ws in sockets))
 
 ws_manager = ConnectionManager()
 
-# Global list of queues for connected SSE clients
-connections = []
+# Cross-worker fan-out: a message published here reaches the client's sockets in every worker
+pubsub = lg_pubsub.PgPubSub(ws_manager.send_to_client)
+
+# Per-client change events (calendar/objectives/tasks), delivered to that client's sockets
+event_bus = lg_events.EventBus(pubsub.publish)
 
 class DeviceRegistration(BaseModel):
     client_id: str
@@ -47,6 +102,8 @@ class ChatInput(BaseModel):
     question: str
     client_id: str
     secret: str
+    # False: return a job id right away and deliver the reply over /ws (see lg_jobs)
+    wait: bool = True
 
 class CalendarEventInput(BaseModel):
     title: str
@@ -77,98 +134,206 @@ class RemoveItemInput(BaseModel):
 load_dotenv()
 
 @tool
-def get_server_time():
+async def get_server_time():
      """Get the current server time. ALWAYS call this tool first before scheduling any events to ensure you are using the correct reference date (Year 2026)."""
      current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
      return f"The current server time is {current_time}."
 
 
 @tool
-def my_server_function():
+async def my_server_function():
     """Execute a simple local test function."""
     print("   [Server] Executing local python code...")
     return "SUCCESS: The local code ran!"
 
 @tool("add_calendar_event", args_schema=CalendarEventInput)
-def add_calendar_event(title: str, start_time: str, end_time: str):
+async def add_calendar_event(title: str, start_time: str, end_time: str):
     """Add an event to the calendar. Use strict ISO format."""
     
     client_id = current_client_id.get()
     
     # 1. Save to DB
-    lg_db.add_calendar_event(client_id, title, start_time, end_time)
+    event_id = await lg_db_async.add_calendar_event(client_id, title, start_time, end_time)
+    lg_tool_cache.invalidate(client_id, CALENDAR)
     
-    # 2. Push to frontend via SSE (Best effort sync-to-async bridge)
-    # Since this runs in a thread, we need to schedule the update on the main loop
-    payload = {
-        "command": "add_event",
-        "parameters": [title, start_time, end_time]
-    }
-    
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = None
-
-    if loop:
-        for q in connections:
-             loop.call_soon_threadsafe(q.put_nowait, payload)
+    # 2. Push to the client's open pages
+    event_bus.publish(client_id, "event_added", event={
+        "id": event_id, "title": title, "start": start_time, "end": end_time
+    })
     
     return f"Event '{title}' scheduled for {start_time}"
 
+class ScheduleEventsSchema(BaseModel):
+    events: list[CalendarEventInput] = Field(description="The events to add, each with title, start_time and end_time.")
+
+@tool("schedule_events", args_schema=ScheduleEventsSchema)
+async def schedule_events_tool(events: list):
+    """Add several calendar events at once (e.g. all the sessions of a plan). Use strict ISO format.
+    Prefer this over calling add_calendar_event repeatedly."""
+    client_id = current_client_id.get()
+    if not client_id: return "Error: No client context."
+    events = [_as_dict(e) for e in events]
+
+    # One transaction: either every event is saved or none
+    event_ids = await lg_db_async.add_calendar_events(client_id, events)
+    lg_tool_cache.invalidate(client_id, CALENDAR)
+
+    for event_id, e in zip(event_ids, events):
+        event_bus.publish(client_id, "event_added", event={
+            "id": event_id, "title": e["title"], "start": e["start_time"], "end": e["end_time"]
+        })
+    return f"{len(event_ids)} events scheduled: " + ", ".join(f"'{e['title']}' at {e['start_time']}" for e in events)
+
+# Longest range find_free_slots searches (keeps the day series and the answer small)
+FREE_SLOTS_MAX_DAYS = 62
+
+def check_range(range_start: str, range_end: str, max_days: int | None = None) -> str | None:
+    """Return an error message if [range_start, range_end) isn't a valid ISO 8601 range, else None."""
+    try:
+        # The queries cast these to timestamp, which ignores any UTC offset; compare them the same way
+        # so a mix of aware and naive values can't raise a TypeError.
+        start = datetime.fromisoformat(range_start).replace(tzinfo=None)
+        end = datetime.fromisoformat(range_end).replace(tzinfo=None)
+    except ValueError as e:
+        return f"Invalid date: {e}"
+    if end <= start:
+        return "The range end must be after its start."
+    if max_days is not None and (end - start).days > max_days:
+        return f"The range can be at most {max_days} days."
+    return None
+
+def check_free_slot_args(range_start: str, range_end: str, duration_minutes: int, day_start: str, day_end: str) -> str | None:
+    """Return an error message if the find_free_slots arguments are invalid, else None."""
+    error = check_range(range_start, range_end, FREE_SLOTS_MAX_DAYS)
+    if error:
+        return error
+    try:
+        day_from = dt_time.fromisoformat(day_start).replace(tzinfo=None)
+        day_to = dt_time.fromisoformat(day_end).replace(tzinfo=None)
+    except ValueError as e:
+        return f"Invalid time: {e}"
+    if day_to <= day_from:
+        return "day_end must be after day_start."
+    if duration_minutes <= 0:
+        return "duration_minutes must be positive."
+    return None
+
+class FindFreeSlotsSchema(BaseModel):
+    range_start: str = Field(description="Start of the search range, ISO 8601 (YYYY-MM-DDTHH:MM:SS). Use the current server time to search from now.")
+    range_end: str = Field(description="End of the search range, ISO 8601 (YYYY-MM-DDTHH:MM:SS).")
+    duration_minutes: int = Field(description="Minimum length of a slot in minutes.", default=60)
+    day_start: str = Field(description="Start of the working hours each day (HH:MM).", default="09:00")
+    day_end: str = Field(description="End of the working hours each day (HH:MM).", default="18:00")
+
+@tool("find_free_slots", args_schema=FindFreeSlotsSchema)
+async def find_free_slots_tool(range_start: str, range_end: str, duration_minutes: int = 60,
+                               day_start: str = "09:00", day_end: str = "18:00"):
+    """Find open time slots in the user's calendar: free intervals of at least duration_minutes
+    within the daily working hours, earliest first. Use this to pick when to schedule something."""
+    client_id = current_client_id.get()
+    if not client_id: return "Error: No client context."
+    error = check_free_slot_args(range_start, range_end, duration_minutes, day_start, day_end)
+    if error:
+        return f"Error: {error}"
+    slots = await lg_db_async.find_free_slots(client_id, range_start, range_end, duration_minutes, day_start, day_end)
+    if not slots:
+        return "No free slot of that length in the given range."
+    return json.dumps(slots)
+
 @tool("get_calendar_events", args_schema=None)
-def get_calendar_events_tool():
-    """Retrieve all calendar events for the current client. Use this to find event titles before removing them."""
+async def get_calendar_events_tool():
+    """Retrieve ALL calendar events for the current client (can be long). Prefer get_calendar_events_in_range
+    for a given period, and find_free_slots to find open time."""
     client_id = current_client_id.get()
-    events = lg_db.get_all_events(client_id)
-    return json.dumps(events)
+    # Memoized for the rest of this run (until a calendar write)
+    return await lg_tool_cache.cached(CALENDAR, client_id,
+                                      lambda: _dumps(lg_db_async.get_all_events(client_id)))
+
+# Most events the range tool returns (keeps the tool result small)
+CALENDAR_TOOL_MAX_EVENTS = 50
+
+class CalendarRangeSchema(BaseModel):
+    range_start: str = Field(description="Start of the period, ISO 8601 (YYYY-MM-DDTHH:MM:SS).")
+    range_end: str = Field(description="End of the period, ISO 8601 (YYYY-MM-DDTHH:MM:SS).")
+
+@tool("get_calendar_events_in_range", args_schema=CalendarRangeSchema)
+async def get_calendar_events_in_range_tool(range_start: str, range_end: str):
+    """Retrieve the current client's calendar events that overlap a period (e.g. this week), earliest first.
+    Use this to see what is planned or to find event titles before removing them."""
+    client_id = current_client_id.get()
+    if not client_id: return "Error: No client context."
+    error = check_range(range_start, range_end)
+    if error:
+        return f"Error: {error}"
+
+    async def load():
+        # One extra row tells whether the list was cut
+        events = await lg_db_async.get_events_in_range(client_id, range_start, range_end, CALENDAR_TOOL_MAX_EVENTS + 1)
+        result = json.dumps(events[:CALENDAR_TOOL_MAX_EVENTS], default=str)
+        if len(events) > CALENDAR_TOOL_MAX_EVENTS:
+            result += f"\n(Only the first {CALENDAR_TOOL_MAX_EVENTS} events are shown; use a shorter range for the rest.)"
+        return result
+    return await lg_tool_cache.cached(CALENDAR, client_id, load, args=(range_start, range_end))
 
 @tool("remove_calendar_event", args_schema=CalendarEventRemovalInput)
-def remove_calendar_event(title: str):
+async def remove_calendar_event(title: str):
     """Remove an event from the calendar by title."""
     
     client_id = current_client_id.get()
     
     # 1. Remove from DB
-    lg_db.remove_calendar_event(client_id, title)
+    await lg_db_async.remove_calendar_event(client_id, title)
+    lg_tool_cache.invalidate(client_id, CALENDAR)
     
-    # 2. Push to frontend via SSE (Best effort sync-to-async bridge)
-    payload = {
-        "command": "remove_event",
-        "parameters": [title]
-    }
-    
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = None
-
-    if loop:
-        for q in connections:
-             loop.call_soon_threadsafe(q.put_nowait, payload)
+    # 2. Push to the client's open pages
+    event_bus.publish(client_id, "event_removed", title=title)
     
     return f"Event '{title}' removed from calendar."
 
+def _as_dict(item) -> dict:
+    """Nested tool arguments arrive as pydantic models or plain dicts depending on the caller."""
+    return item.model_dump() if isinstance(item, BaseModel) else dict(item)
+
+async def _dumps(rows) -> str:
+    """Await a DB read and serialize it for the LLM (the string is what the tool cache keeps)."""
+    # default=str: event times are TIMESTAMP columns (datetime objects)
+    return json.dumps(await rows, default=str)
+
 # --- Objective & Task Tools ---
 
+def publish_objective_created(client_id: str, objective_id: int, title: str, description: str,
+                              tasks: list[dict] | None = None):
+    event_bus.publish(client_id, "objective_created", objective={
+        "id": objective_id, "title": title, "description": description,
+        "status": "not_started", "tasks": tasks or []
+    })
+
+def publish_task_added(client_id: str, objective_id: int, task_id: int, title: str, weight: int):
+    event_bus.publish(client_id, "task_added", objective_id=objective_id, task={
+        "id": task_id, "title": title, "weight": weight, "is_completed": False
+    })
+
 @tool
-def get_objectives_tool():
+async def get_objectives_tool():
     """Get all objectives and their tasks for the current user. Returns a list of dictionaries.
     Use this to find IDs of objectives or tasks before adding/removing them."""
     client_id = current_client_id.get()
     if not client_id: return "Error: No client context."
-    return json.dumps(lg_db.get_client_objectives(client_id))
+    return await lg_tool_cache.cached(OBJECTIVES, client_id,
+                                      lambda: _dumps(lg_db_async.get_client_objectives(client_id)))
 
 class AddObjectiveSchema(BaseModel):
     title: str
     description: str = ""
 
 @tool("add_objective", args_schema=AddObjectiveSchema)
-def add_objective_tool(title: str, description: str = ""):
+async def add_objective_tool(title: str, description: str = ""):
     """Create a new objective. Returns the result string."""
     client_id = current_client_id.get()
     if not client_id: return "Error: No client context."
-    obj_id = lg_db.add_objective(client_id, title, description)
+    obj_id = await lg_db_async.add_objective(client_id, title, description)
+    lg_tool_cache.invalidate(client_id, OBJECTIVES)
+    publish_objective_created(client_id, obj_id, title, description)
     return f"Objective '{title}' created with ID {obj_id}."
 
 class AddTaskSchema(BaseModel):
@@ -177,87 +342,217 @@ class AddTaskSchema(BaseModel):
     weight: int = Field(description="Importance weight of the task (default 1).", default=1)
 
 @tool("add_task", args_schema=AddTaskSchema)
-def add_task_tool(objective_id: int, title: str, weight: int = 1):
+async def add_task_tool(objective_id: int, title: str, weight: int = 1):
     """Add a task to a specific objective. Requires knowing the objective_id first."""
     client_id = current_client_id.get()
     if not client_id: return "Error: No client context."
-    task_id = lg_db.add_task(objective_id, title, weight)
+    task_ids = await lg_db_async.add_tasks(client_id, objective_id, [{"title": title, "weight": weight}])
+    if task_ids is None:
+        return f"Error: Objective {objective_id} not found."
+    task_id = task_ids[0]
+    lg_tool_cache.invalidate(client_id, OBJECTIVES)
+    publish_task_added(client_id, objective_id, task_id, title, weight)
     return f"Task '{title}' (weight {weight}) added to objective {objective_id}."
 
+class PlanTaskSchema(BaseModel):
+    title: str = Field(description="The task content.")
+    weight: int = Field(description="Importance weight of the task (default 1).", default=1)
+
+class CreatePlanSchema(BaseModel):
+    title: str = Field(description="Title of the new objective.")
+    description: str = ""
+    tasks: list[PlanTaskSchema] = Field(description="The objective's tasks, in order.", default_factory=list)
+
+@tool("create_objective_with_tasks", args_schema=CreatePlanSchema)
+async def create_objective_with_tasks_tool(title: str, description: str = "", tasks: list | None = None):
+    """Create a new objective together with all of its tasks in one step.
+    Prefer this over add_objective followed by many add_task calls."""
+    client_id = current_client_id.get()
+    if not client_id: return "Error: No client context."
+    tasks = [_as_dict(t) for t in tasks or []]
+
+    # One transaction: the objective and all its tasks, or nothing
+    obj_id, task_ids = await lg_db_async.add_objective_with_tasks(client_id, title, description, tasks)
+    lg_tool_cache.invalidate(client_id, OBJECTIVES)
+    publish_objective_created(client_id, obj_id, title, description, tasks=[
+        {"id": task_id, "title": t["title"], "weight": t["weight"], "is_completed": False}
+        for task_id, t in zip(task_ids, tasks)
+    ])
+    task_list = ", ".join(f"{task_id}: '{t['title']}'" for task_id, t in zip(task_ids, tasks))
+    return f"Objective '{title}' created with ID {obj_id} and {len(task_ids)} tasks ({task_list})."
+
+class AddTasksSchema(BaseModel):
+    objective_id: int = Field(description="The ID of the objective to add these tasks to.")
+    tasks: list[PlanTaskSchema] = Field(description="The tasks to add, in order.")
+
+@tool("add_tasks", args_schema=AddTasksSchema)
+async def add_tasks_tool(objective_id: int, tasks: list):
+    """Add several tasks to an existing objective at once. Prefer this over calling add_task repeatedly."""
+    client_id = current_client_id.get()
+    if not client_id: return "Error: No client context."
+    tasks = [_as_dict(t) for t in tasks]
+
+    task_ids = await lg_db_async.add_tasks(client_id, objective_id, tasks)
+    if task_ids is None:
+        return f"Error: Objective {objective_id} not found."
+    lg_tool_cache.invalidate(client_id, OBJECTIVES)
+    for task_id, t in zip(task_ids, tasks):
+        publish_task_added(client_id, objective_id, task_id, t["title"], t["weight"])
+    task_list = ", ".join(f"{task_id}: '{t['title']}'" for task_id, t in zip(task_ids, tasks))
+    return f"{len(task_ids)} tasks added to objective {objective_id} ({task_list})."
+
 class RemoveTaskSchema(BaseModel):
     task_id: int
 
 @tool("remove_task", args_schema=RemoveTaskSchema)
-def remove_task_tool(task_id: int):
+async def remove_task_tool(task_id: int):
     """Remove a task by ID."""
     client_id = current_client_id.get()
     if not client_id: return "Error: No client context."
-    lg_db.remove_task(client_id, task_id)
+    await lg_db_async.remove_task(client_id, task_id)
+    lg_tool_cache.invalidate(client_id, OBJECTIVES, STATS)  # removing completed work takes its XP back
+    event_bus.publish(client_id, "task_removed", task_id=task_id)
     return f"Task {task_id} removed."
 
 class RemoveObjectiveSchema(BaseModel):
     objective_id: int
 
 @tool("remove_objective", args_schema=RemoveObjectiveSchema)
-def remove_objective_tool(objective_id: int):
+async def remove_objective_tool(objective_id: int):
     """Remove an objective by ID. This also removes all tasks under it."""
     client_id = current_client_id.get()
     if not client_id: return "Error: No client context."
-    lg_db.remove_objective(client_id, objective_id)
+    await lg_db_async.remove_objective(client_id, objective_id)
+    lg_tool_cache.invalidate(client_id, OBJECTIVES, STATS)  # removing completed work takes its XP back
+    event_bus.publish(client_id, "objective_removed", objective_id=objective_id)
     return f"Objective {objective_id} removed."
 
 class CompleteTaskSchema(BaseModel):
     task_id: int
 
 @tool("complete_task", args_schema=CompleteTaskSchema)
-def complete_task_tool(task_id: int):
+async def complete_task_tool(task_id: int):
     """Mark a task as completed. This updates the user's XP score."""
     client_id = current_client_id.get()
     if not client_id: return "Error: No client context."
-    res = lg_db.complete_task(client_id, task_id)
+    res = await lg_db_async.complete_task(client_id, task_id)
+    if res:
+        # Completion also changes XP / counters
+        lg_tool_cache.invalidate(client_id, OBJECTIVES, STATS)
+        event_bus.publish(client_id, "task_completed", task_id=task_id)
     return f"Task {task_id} completed. Success: {res}"
 
 class CompleteObjectiveSchema(BaseModel):
     objective_id: int
 
 @tool("complete_objective", args_schema=CompleteObjectiveSchema)
-def complete_objective_tool(objective_id: int):
+async def complete_objective_tool(objective_id: int):
     """Mark an entire objective as completed. This updates the user's completed objectives count."""
     client_id = current_client_id.get()
     if not client_id: return "Error: No client context."
-    res = lg_db.complete_objective(client_id, objective_id)
+    res = await lg_db_async.complete_objective(client_id, objective_id)
+    if res:
+        lg_tool_cache.invalidate(client_id, OBJECTIVES, STATS)
+        event_bus.publish(client_id, "objective_completed", objective_id=objective_id)
     return f"Objective {objective_id} completed. Success: {res}"
 
+class ObjectiveProgressSchema(BaseModel):
+    objective_id: int
+
+@tool("get_objective_progress", args_schema=ObjectiveProgressSchema)
+async def get_objective_progress_tool(objective_id: int):
+    """Get one objective's progress: completed weight / total weight of its tasks, and task counts.
+    Cheaper than get_objectives when you only need how far along an objective is."""
+    client_id = current_client_id.get()
+    if not client_id: return "Error: No client context."
+
+    async def load():
+        progress = await lg_db_async.get_objective_progress(client_id, objective_id)
+        return json.dumps(progress) if progress else f"Error: Objective {objective_id} not found."
+    return await lg_tool_cache.cached(OBJECTIVES, client_id, load, args=("progress", objective_id))
+
 @tool("get_user_stats", args_schema=None)
-def get_user_stats_tool():
+async def get_user_stats_tool():
     """Retrieve the current user's gamification stats: XP score, task completion count, and objective completion count."""
     client_id = current_client_id.get()
     if not client_id: return "Error: No client context."
-    stats = lg_db.get_client_stats(client_id)
-    return json.dumps(stats)
+    return await lg_tool_cache.cached(STATS, client_id,
+                                      lambda: _dumps(lg_db_async.get_client_stats(client_id)))
+
+# LLM providers, in order of preference. The first one with a key in the env is the default.
+PROVIDERS = {
+    "deepseek": {
+        "model": "deepseek-chat",
+        "key_env": "DEEPSEEK_API_KEY",
+        "base_url": "https://api.deepseek.com",
+        "temperature": 1.3,
+    },
+    "openai": {
+        "model": "gpt-4o", # or gpt-3.5-turbo
+        "key_env": "OPENAI_API_KEY",
+        "base_url": None, # uses default https://api.openai.com/v1
+        "temperature": 0.7,
+    },
+}
+
+# Shared keep-alive HTTP clients: every agent reuses the same connection pool,
+# so a chat turn does not pay a fresh TCP/TLS handshake to the LLM provider.
+_http_limits = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+_http_client = httpx.Client(limits=_http_limits, timeout=120)
+_http_async_client = httpx.AsyncClient(limits=_http_limits, timeout=120)
+
+
+def default_provider() -> str | None:
+    """Return the first provider that has an API key configured, or None."""
+    for name, cfg in PROVIDERS.items():
+        if os.getenv(cfg["key_env"]):
+            return name
+    return None
+
+
+def trim_llm_input(state: dict, config: RunnableConfig) -> dict:
+    """
+    Pre-model hook: send the LLM the rolling summary plus the newest thread messages that
+    fit CONTEXT_TOKEN_BUDGET, starting on a user message so no tool result is orphaned.
+    `config` must stay annotated RunnableConfig: langgraph only passes it to hooks that
+    declare it with that type.
+    """
+    messages = state["messages"]
+    trimmed = trim_messages(
+        messages,
+        max_tokens=CONTEXT_TOKEN_BUDGET,
+        strategy="last",
+        token_counter=count_tokens_approximately,
+        start_on="human",
+    )
+    if not trimmed:
+        # The current turn alone is over budget: keep it from its user message on
+        last_human = max((i for i, m in enumerate(messages) if m.type == "human"), default=0)
+        trimmed = messages[last_human:]
 
-class Assistant:
-    def __init__(self):
-        deepseek_key = os.getenv("DEEPSEEK_API_KEY")
-        openai_key = os.getenv("OPENAI_API_KEY")
+    summary = config.get("configurable", {}).get("summary")
+    if summary:
+        trimmed = [SystemMessage(content=f"Summary of the earlier conversation with this user:\n{summary}")] + trimmed
+    return {"llm_input_messages": trimmed}
 
-        if deepseek_key:
-            # Use DeepSeek
-            print("INFO: Using DeepSeek API")
-            self.llm = ChatOpenAI(
-                model="deepseek-chat",
-                openai_api_key=deepseek_key,
-                openai_api_base="https://api.deepseek.com",
-                temperature=1.3,
-            )
-        elif openai_key:
-            # Use OpenAI (Fallback)
-            print("INFO: Using OpenAI API")
+
+class Assistant:
+    def __init__(self, provider: str | None = None, model: str | None = None, llm=None, checkpointer=None):
+        # llm / checkpointer can be injected (tests: a fake chat model, an in-memory saver)
+        cfg = PROVIDERS.get(provider)
+        api_key = os.getenv(cfg["key_env"]) if cfg else None
+
+        if llm is not None:
+            self.llm = llm
+        elif cfg and api_key:
+            print(f"INFO: Using {provider} API ({model or cfg['model']})")
             self.llm = ChatOpenAI(
-                model="gpt-4o", # or gpt-3.5-turbo
-                openai_api_key=openai_key,
-                # No openai_api_base needed, uses default https://api.openai.com/v1
-                temperature=0.7,
+                model=model or cfg["model"],
+                openai_api_key=api_key,
+                openai_api_base=cfg["base_url"],
+                temperature=cfg["temperature"],
+                http_client=_http_client,
+                http_async_client=_http_async_client,
             )
         else:
             print("CRITICAL: No API Key found for DeepSeek or OpenAI!")
@@ -274,7 +569,7 @@ class Assistant:
                 
                 "CORE STRATEGY (THE 5 Ws):\n"
                 "When analyzing objectives or tasks, you must process them through this tactical lens to help the user:\n"
-                "1. **WHEN (Timing & Agenda)**: Don't just list tasks. Use `read_calendar` (via `get_calendar_events`) to find gaps. Proactively suggest: 'Your Tuesday morning is open; that is the optimal time for this work.' Pick the best date available.\n"
+                "1. **WHEN (Timing & Agenda)**: Don't just list tasks. Use `find_free_slots` to find gaps (it returns only the open slots). Proactively suggest: 'Your Tuesday morning is open; that is the optimal time for this work.' Pick the best date available.\n"
                 "2. **WHERE (Environment)**: Suggest the optimal physical setting to achieve the objective. 'This task requires focus; try a quiet place.' vs 'This is routine; do it while commuting.'\n"
                 "3. **WHO (Resources)**: Is this a solo effort or a team effort? Suggest looking for help if a task looks overwhelming.\n"
                 "4. **WHAT (Critical Path)**: Identify the most important task. Which task blocks the others? Suggest subdivision if a task seems too heavy. 'This task is critical; dividing it into smaller chunks will make it manageable.'\n"
@@ -291,24 +586,65 @@ class Assistant:
                 "3. **Encouragement**: Instead of demanding, suggest kindly why completing a task is beneficial.\n"
                 "4. **Scheduler**: Always try to ground abstract plans into concrete time slots using `add_calendar_event`. IMPORTANT: The current year is 2026. Always schedule events in the future relative to the current server time, which you should check first.\n"
                 "5. **Missing Objectives**: If the user wants to schedule a task but it has no parent Objective, CREATE IT. Use `add_objective` to build the structure first, then schedule the tasks.\n"
-                "6. **Modifications**: For vague ideas, ask confirmation. For specific commands, ACT IMMEDIATELY."
+                "6. **Modifications**: For vague ideas, ask confirmation. For specific commands, ACT IMMEDIATELY.\n"
+                "7. **Batch Plans**: Build whole plans in as few steps as possible: use `create_objective_with_tasks` for a new objective with its tasks, `add_tasks` for several tasks on an existing one, and `schedule_events` for several calendar events."
             )
         )
 
         # Add the calendar tool to the list
         self.tools = [
             my_server_function, get_server_time, 
-            add_calendar_event, get_calendar_events_tool, remove_calendar_event,
-            get_objectives_tool, add_objective_tool, remove_objective_tool,
-            add_task_tool, remove_task_tool,
+            add_calendar_event, schedule_events_tool, get_calendar_events_tool,
+            get_calendar_events_in_range_tool, remove_calendar_event,
+            find_free_slots_tool,
+            get_objectives_tool, add_objective_tool, create_objective_with_tasks_tool, remove_objective_tool,
+            add_task_tool, add_tasks_tool, remove_task_tool,
             complete_task_tool, complete_objective_tool,
-            get_user_stats_tool
+            get_objective_progress_tool, get_user_stats_tool
         ]
 
         # create_react_agent expects (model, tools, ...)
-        self.agent = create_react_agent(self.llm, self.tools, prompt=self.system_message)
+        # Threads persist in Postgres (see agent_thread_id); the pre-model hook bounds what
+        # the LLM sees per call, the thread rollover bounds what is stored.
+        self.agent = create_react_agent(
+            self.llm,
+            self.tools,
+            prompt=self.system_message,
+            pre_model_hook=trim_llm_input,
+            checkpointer=checkpointer or lg_db_async.get_checkpointer(),
+        )
         self.config = {}
 
+
+# Process-wide agent registry keyed by (provider, model). Building the LLM client and
+# compiling the LangGraph graph is expensive, so it happens once per process, not per request.
+_assistants: dict[tuple[str | None, str | None], Assistant] = {}
+_assistants_lock = threading.Lock()
+
+def get_assistant(provider: str | None = None, model: str | None = None) -> Assistant:
+    """Return the shared Assistant for (provider, model), building it on first use."""
+    if provider is None:
+        provider = default_provider()
+    if model is None and provider in PROVIDERS:
+        model = PROVIDERS[provider]["model"]
+    key = (provider, model)
+
+    assistant = _assistants.get(key)
+    if assistant is None:
+        with _assistants_lock:
+            assistant = _assistants.get(key)
+            if assistant is None:
+                assistant = Assistant(provider, model)
+                _assistants[key] = assistant
+    return assistant
+
+def reload_assistants() -> None:
+    """Re-read API keys from .env and drop cached agents so they are rebuilt (key rotation)."""
+    load_dotenv(override=True)
+    with _assistants_lock:
+        _assistants.clear()
+    print("INFO: Agent registry reloaded.")
+
 app = FastAPI()
 
 @app.middleware("http")
@@ -345,13 +681,52 @@ async def add_security_headers(request: Request, call_next):
     return response
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     try:
-        lg_db.init_db()
+        await asyncio.to_thread(lg_db.init_db)
         print("Database initialized.")
     except Exception as e:
         print(f"DB init failed: {e}")
 
+    await lg_db_async.open_pool()
+    history_writer.start()
+    event_bus.bind()
+    await pubsub.start()
+    summarizer.start()
+    await chat_jobs.start()
+    idempotency.start()
+    lg_changes.pruner.start()
+    history_retention.start()
+
+    # Warm up the default agent so the first chat turn doesn't pay for graph compilation
+    try:
+        get_assistant()
+    except Exception as e:
+        print(f"Agent warm-up failed: {e}")
+
+    # `kill -HUP <pid>` reloads API keys without restarting the worker. Registered on the
+    # loop, so the reload runs as a normal callback and never interrupts a thread that
+    # holds _assistants_lock (a plain signal handler would deadlock on it).
+    if hasattr(signal, "SIGHUP"):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_assistants)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass # no loop signal support, or not in the main thread
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await chat_jobs.stop()
+    await idempotency.stop()
+    await lg_changes.pruner.stop()
+    await history_retention.stop()
+    await pubsub.stop()
+    await summarizer.stop()
+    # After everything that saves chat messages, before the pool closes
+    await history_writer.stop()
+    await lg_db_async.close_pool()
+    _http_client.close()
+    await _http_async_client.aclose()
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
@@ -375,178 +750,577 @@ def robots_txt():
     return FileResponse("static/robots.txt")
 
 
+# Seconds between server pings on /ws; a socket silent for 3 intervals is closed
+WS_HEARTBEAT_INTERVAL = float(os.getenv("LG_WS_HEARTBEAT_INTERVAL", "25"))
+
+@asynccontextmanager
+async def agent_run(client_id: str):
+    """
+    Run slot for one agent turn: admission on this worker (lg_scheduler), then the client's
+    run lock across workers, since every worker resumes the same checkpoint thread.
+    Raises Rejected (429) if another worker is running a turn for this client.
+    """
+    async with lg_scheduler.scheduler.slot(client_id):
+        if not await lg_db_async.try_lock_client_runs(client_id):
+            raise lg_scheduler.Rejected(429, "A reply for this client is already in progress.")
+        try:
+            yield
+        finally:
+            # Shielded: a cancelled run must still release the lock
+            await asyncio.shield(lg_db_async.unlock_client_runs(client_id))
+
+async def run_ws_chat(websocket: WebSocket, client_id: str, message_id: str, question: str):
+    """One chat turn requested over /ws: stream events back to the requesting socket."""
+    current_client_id.set(client_id)
+    try:
+        async with agent_run(client_id):
+            agent_input, config = await build_agent_input(client_id, question)
+            async with aclosing(stream_agent_events(client_id, agent_input, config, message_id)) as events:
+                async for event in events:
+                    # The final chat_response is published to every socket of the client (this one included)
+                    if event["type"] != "chat_response":
+                        await ws_manager.send(client_id, websocket, json.dumps(event, default=str))
+    except lg_scheduler.Rejected as e:
+        await ws_manager.send(client_id, websocket, json.dumps(
+            {"type": "error", "id": message_id, "error": e.reason, "status": e.status_code}))
+    except asyncio.CancelledError:
+        print(f"DEBUG: WS chat {message_id} cancelled")
+        await ws_manager.send(client_id, websocket, json.dumps({"type": "cancelled", "id": message_id}))
+        raise
+    except Exception as e:
+        print(f"ERROR: WS chat exception: {e}")
+        import traceback
+        traceback.print_exc()
+        await ws_manager.send(client_id, websocket, json.dumps({"type": "error", "id": message_id, "error": str(e)}))
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await ws_manager.connect(websocket)
-    print(f"WS Connected: {websocket.client}")
+async def websocket_endpoint(websocket: WebSocket, client_id: str = Query(...), secret: str = Query(...)):
+    """
+    Per-client socket, authenticated once on connect. Receives change events and chat replies,
+    and accepts JSON messages:
+      {"type": "chat", "id": "<message id>", "question": "..."}  -> streamed token/tool events + chat_response
+      {"type": "cancel", "id": "<message id>"}                   -> cancels that in-flight run
+      {"type": "ping"} / {"type": "pong"}                        -> heartbeat
+    """
+    if not await lg_db_async.get_client(client_id, secret):
+        await websocket.close(code=1008) # Policy Violation: invalid credentials
+        return
+
+    await ws_manager.connect(websocket, client_id)
+    print(f"WS Connected: {websocket.client} ({client_id})")
+
+    runs: dict[str, asyncio.Task] = {}
+    last_seen = time.monotonic()
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            if time.monotonic() - last_seen > 3 * WS_HEARTBEAT_INTERVAL:
+                print(f"WS Heartbeat timeout: {websocket.client}")
+                await websocket.close(code=1001)
+                return
+            await ws_manager.send(client_id, websocket, json.dumps({"type": "ping"}))
+
+    heartbeat_task = asyncio.create_task(heartbeat())
     try:
         while True:
             data = await websocket.receive_text()
-            # Optional: handle incoming WS messages if you want to support WS-only chat
-            # await websocket.send_text(f"Echo: {data}")
+            last_seen = time.monotonic()
+            try:
+                msg = json.loads(data)
+            except ValueError:
+                continue
+            kind = msg.get("type")
+
+            if kind == "ping":
+                await ws_manager.send(client_id, websocket, json.dumps({"type": "pong"}))
+            elif kind == "chat":
+                message_id = str(msg.get("id") or uuid.uuid4().hex)
+                question = str(msg.get("question") or "").strip()
+                # Backpressure: one run at a time per socket
+                if not question or runs:
+                    error = "A reply is already in progress." if runs else "Empty question."
+                    await ws_manager.send(client_id, websocket, json.dumps({"type": "error", "id": message_id, "error": error}))
+                    continue
+                task = asyncio.create_task(run_ws_chat(websocket, client_id, message_id, question))
+                runs[message_id] = task
+                task.add_done_callback(lambda t, mid=message_id: runs.pop(mid, None))
+            elif kind == "cancel":
+                task = runs.get(str(msg.get("id")))
+                if task:
+                    task.cancel()
     except WebSocketDisconnect:
         print(f"WS Disconnected: {websocket.client}")
-        ws_manager.disconnect(websocket)
     except Exception as e:
         print(f"WS Error: {e}")
-        ws_manager.disconnect(websocket)
+    finally:
+        # In-flight runs keep going: the reply is still saved and reaches the client's other sockets
+        heartbeat_task.cancel()
+        ws_manager.disconnect(websocket, client_id)
 
 @app.get("/api/chat/history")
-def get_history(client_id: str = Query(...), secret: str = Query(...)):
-    if not lg_db.get_client(client_id, secret):
+async def get_history(client_id: str = Query(...), secret: str = Query(...),
+                      if_none_match: str | None = Header(None)):
+    if not await lg_db_async.get_client(client_id, secret):
          return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
-    
-    history = lg_db.get_chat_history(client_id)
-    return history
+
+    # 304 if nothing changed since the browser's copy
+    return await lg_changes.conditional(client_id, if_none_match, ("history",),
+                                        lambda: lg_db_async.get_chat_history(client_id))
+
+@app.get("/api/changes")
+async def get_changes(client_id: str = Query(...), secret: str = Query(...), since: int = Query(..., ge=0)):
+    """
+    Delta sync: events, objectives (with their tasks) and chat messages changed after
+    version `since`, plus the current version to pass next time. {"full": true} means
+    the delta is unavailable and the lists must be refetched.
+    """
+    if not await lg_db_async.get_client(client_id, secret):
+         return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
+
+    changes = await lg_db_async.get_changes(client_id, since)
+    if changes is None:
+        return {"full": True, "version": await lg_db_async.get_change_version(client_id)}
+    return changes
+
+# Max estimated tokens of chat history sent to the LLM per turn
+CONTEXT_TOKEN_BUDGET = int(os.getenv("LG_CONTEXT_TOKEN_BUDGET", "4000"))
+
+# Compacts older chat history in the background (see lg_summary)
+summarizer = lg_summary.Summarizer(lambda: get_assistant().llm)
+
+def agent_thread_id(client_id: str, summary: dict | None) -> str:
+    """
+    The client's checkpoint thread for the current summary. Every checkpoint stores the whole
+    message list again, so one endless thread per client would grow without bound; instead
+    the thread rolls over whenever the summary moves on, and the new one is seeded from the
+    summary plus the messages after it (build_agent_input).
+    """
+    return f"{client_id}:{summary['last_message_id'] if summary else 0}"
+
+def agent_config(thread_id: str, summary: str | None = None) -> dict:
+    """Run config: the client's persistent thread, plus the rolling summary for the pre-model hook."""
+    # Increased recursion_limit to 100 to handle complex multi-step plans (e.g. creating multiple objectives/tasks)
+    return {
+        "recursion_limit": 100,
+        "configurable": {"thread_id": thread_id, "summary": summary},
+    }
+
+async def close_dangling_tool_calls(agent, config: dict, messages: list) -> None:
+    """
+    A run interrupted between the model's tool calls and their results (cancelled, crashed,
+    client gone) leaves an unanswered AIMessage that the LLM API rejects on the next turn.
+    Answer those calls with a placeholder result so the thread stays valid.
+    """
+    last = messages[-1]
+    tool_calls = getattr(last, "tool_calls", None)
+    if last.type != "ai" or not tool_calls:
+        return
+    await agent.aupdate_state(config, {"messages": [
+        ToolMessage(content="Cancelled: this tool call was interrupted.", tool_call_id=call["id"])
+        for call in tool_calls
+    ]}, as_node="tools")
+
+async def build_agent_input(client_id: str, question: str) -> tuple[dict, dict]:
+    """Save the user's question and return the agent input and run config for this turn."""
+    # Save User Context (chat_history is what the chat page shows)
+    await history_writer.add(client_id, "user", question)
+
+    summary = await lg_db_async.get_chat_summary(client_id)
+    thread_id = agent_thread_id(client_id, summary)
+    config = agent_config(thread_id, summary["summary"] if summary else None)
+
+    # The agent resumes the client's checkpointed thread (including prior tool calls and
+    # results), so a turn only sends the new question.
+    agent = get_assistant().agent
+    state = await agent.aget_state(config)
+    if state.values.get("messages"):
+        await close_dangling_tool_calls(agent, config, state.values["messages"])
+        return {"messages": [{"role": "user", "content": question}]}, config
+
+    # No thread yet (new client, or the summary moved on): drop the client's previous thread,
+    # then seed this one from chat_history, the newest messages after the summary that fit the budget.
+    previous = await lg_db_async.switch_agent_thread(client_id, thread_id)
+    if previous:
+        await agent.checkpointer.adelete_thread(previous)
+    # Note: The current question we just added is included in 'history_records'
+    # because the window always contains the newest message.
+    await history_writer.flush()  # the question may still be queued ("shutdown" durability)
+    history_records = await lg_db_async.get_context_window(
+        client_id,
+        max_tokens=CONTEXT_TOKEN_BUDGET,
+        after_id=summary["last_message_id"] if summary else 0,
+    )
+    messages_payload = []
+    for record in history_records:
+        # Map DB roles to LangChain roles just in case, though they match (user/assistant)
+        role = record["role"]
+        messages_payload.append({"role": role, "content": record["content"]})
+    return {"messages": messages_payload}, config
+
+def extract_final_text(response) -> str:
+    """Normalize the different possible agent response shapes into the final reply text."""
+    messages = None
+    if isinstance(response, dict):
+        messages = response.get("messages") or response.get("output") or response.get("outputs")
+    if messages is None:
+        return str(response)
+    last = messages[-1]
+    if hasattr(last, "content"):
+        return last.content
+    elif isinstance(last, dict) and "content" in last:
+        return last["content"]
+    return str(last)
+
+async def run_chat_turn(client_id: str, question: str, on_start=None) -> str:
+    """
+    Run one agent turn to completion, save the reply and return its text. `on_start` is
+    awaited once the turn has its run slot (background jobs switch to "running" then).
+    """
+    current_client_id.set(client_id)
+    # Waits for a run slot (or is rejected when the queue is full); the input is built
+    # inside the slot so it sees the thread as left by this client's previous run
+    async with agent_run(client_id):
+        if on_start:
+            await on_start()
+        agent_input, config = await build_agent_input(client_id, question)
+
+        assistant = get_assistant()
+        # create_react_agent expects input like: {"messages": [{"role":"user","content": ...}]}
+        # Tools and DB calls are async, so the agent runs on the event loop without blocking WS
+        tool_cache, tool_cache_token = lg_tool_cache.begin_run()
+        try:
+            response = await assistant.agent.ainvoke(agent_input, config)
+        finally:
+            lg_tool_cache.end_run(tool_cache, tool_cache_token, client_id)
+        print(f"DEBUG: Agent response: {response}")
+
+        final = extract_final_text(response)
+        print(f"DEBUG: Final text: {final}")
+
+        # Save Assistant Response
+        await history_writer.add(client_id, "assistant", final)
+    summarizer.schedule(client_id)
+    return final
+
+# Chat turns run in the background for /api/chat {"wait": false}
+chat_jobs = lg_jobs.JobRunner(run_chat_turn, pubsub.publish)
 
 @app.post("/api/chat")
-async def chat(input_data: ChatInput):
+async def chat(input_data: ChatInput, idempotency_key: str | None = Header(None)):
     print(f"DEBUG: Chat request: {input_data.question} from {input_data.client_id}")
+    # Verify client
+    if not await lg_db_async.get_client(input_data.client_id, input_data.secret):
+         print("DEBUG: Client verification failed")
+         return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
+
+    # A retried request with the same Idempotency-Key gets the first reply back, no new LLM run
+    return await idempotency.run(input_data.client_id, idempotency_key, "/api/chat", input_data,
+                                 lambda: handle_chat(input_data))
+
+async def handle_chat(input_data: ChatInput):
     try:
         question = input_data.question
         client_id = input_data.client_id
-        secret = input_data.secret
-        
-        # Verify client
-        if not lg_db.get_client(client_id, secret):
-             print("DEBUG: Client verification failed")
-             return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
-        
-        current_client_id.set(client_id)
-        
-        # Save User Context
-        lg_db.add_chat_message(client_id, "user", question)
-        
-        # Fetch Context (History) to give the assistant memory
-        # We fetch the last 20 messages to provide enough context
-        history_records = lg_db.get_chat_history(client_id, limit=20)
-        
-        # Convert DB records to LangGraph message format
-        # Note: The current question we just added is included in 'history_records'
-        # because get_chat_history sorts by timestamp.
-        messages_payload = []
-        for record in history_records:
-            # Map DB roles to LangChain roles just in case, though they match (user/assistant)
-            role = record["role"]
-            messages_payload.append({"role": role, "content": record["content"]})
-    
-        assistant = Assistant()
-        # create_react_agent expects input like: {"messages": [{"role":"user","content": ...}]}
-        # Run blocking agent in a thread to keep async loop responsive for WS
-        # Increased recursion_limit to 100 to handle complex multi-step plans (e.g. creating multiple objectives/tasks)
-        response = await asyncio.to_thread(
-            assistant.agent.invoke, 
-            {"messages": messages_payload},
-            {"recursion_limit": 100}
-        )
-        print(f"DEBUG: Agent response: {response}")
-        
-        # Normalize different possible response shapes
-        messages = None
-        if isinstance(response, dict):
-            messages = response.get("messages") or response.get("output") or response.get("outputs")
-        if messages is None:
-            final = str(response)
-        else:
-            last = messages[-1]
-            if hasattr(last, "content"):
-                final = last.content
-            elif isinstance(last, dict) and "content" in last:
-                final = last["content"]
-            else:
-                final = str(last)
-        
-        print(f"DEBUG: Final text: {final}")
 
-        # Save Assistant Response
-        lg_db.add_chat_message(client_id, "assistant", final)
+        if not input_data.wait:
+            # Reject now rather than accepting a job that can't be queued
+            lg_scheduler.scheduler.check(client_id)
+            job_id = await chat_jobs.submit(client_id, question)
+            return JSONResponse(content={"job_id": job_id, "status": "queued"}, status_code=202)
 
-        # Broadcast response to WebSockets
-        print(f"DEBUG: Broadcasting to {len(ws_manager.active_connections)} clients")
-        await ws_manager.broadcast(json.dumps({
+        final = await run_chat_turn(client_id, question)
+
+        # Send response to this client's other open WebSockets (e.g. other tabs)
+        message_id = uuid.uuid4().hex
+        print(f"DEBUG: Sending to {ws_manager.connection_count(client_id)} sockets of {client_id}")
+        await pubsub.publish(client_id, json.dumps({
             "type": "chat_response",
+            "id": message_id,
             "content": final
         }))
 
-        return JSONResponse(content={"response": final})
+        return JSONResponse(content={"response": final, "id": message_id})
+    except lg_scheduler.Rejected as e:
+        print(f"DEBUG: Chat rejected for {input_data.client_id}: {e.reason}")
+        return JSONResponse(content={"error": e.reason}, status_code=e.status_code)
     except Exception as e:
         print(f"ERROR: Chat exception: {e}")
         import traceback
         traceback.print_exc()
         return JSONResponse(content={"error": str(e)}, status_code=500)
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+async def save_final_reply(agent, client_id: str, config: dict, final: str | None, since: datetime) -> str | None:
+    """
+    Save a streamed turn's reply to chat_history and return it. `final` is None when the
+    stream stopped before the graph's end event (client gone, run cancelled): the reply is
+    then taken from the thread if the run still finished (after `since`), so history and
+    thread agree. Returns None if there is no reply to save.
+    """
+    if final is None:
+        state = await agent.aget_state(config)
+        messages = state.values.get("messages") or []
+        finished = (messages and not state.next and state.created_at
+                    and datetime.fromisoformat(state.created_at) >= since)
+        if not finished or messages[-1].type != "ai" or messages[-1].tool_calls:
+            return None
+        final = messages[-1].content
+    await history_writer.add(client_id, "assistant", final)
+    return final
+
+async def stream_agent_events(client_id: str, agent_input: dict, config: dict, message_id: str):
+    """
+    Run the agent with astream_events and yield chat events as dicts:
+    token deltas, tool start/end and the final message (which is persisted and sent to the client's sockets).
+    """
+    assistant = get_assistant()
+    started = time.perf_counter()
+    started_at = datetime.now(timezone.utc)
+    first_token_at = None
+    final = None
+
+    tool_cache, tool_cache_token = lg_tool_cache.begin_run()
+    try:
+        # aclosing: on cancellation the run stops before the reply is looked up in the thread
+        async with aclosing(assistant.agent.astream_events(agent_input, config, version="v2")) as events:
+            async for event in events:
+                kind = event["event"]
+                if kind == "on_chat_model_stream":
+                    delta = event["data"]["chunk"].content
+                    if isinstance(delta, str) and delta:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        yield {"type": "token", "id": message_id, "content": delta}
+                elif kind == "on_tool_start":
+                    yield {"type": "tool_start", "id": message_id, "name": event["name"],
+                           "input": event["data"].get("input")}
+                elif kind == "on_tool_end":
+                    yield {"type": "tool_end", "id": message_id, "name": event["name"]}
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    # The graph's final state: its last message is the reply, streamed or not
+                    final = extract_final_text(event["data"]["output"])
+    finally:
+        lg_tool_cache.end_run(tool_cache, tool_cache_token, client_id)
+        # Runs even when the generator is cancelled or closed (client disconnected); shielded
+        # so that cancellation can't interrupt the write itself
+        final = await asyncio.shield(save_final_reply(assistant.agent, client_id, config, final, started_at))
+
+    total = time.perf_counter() - started
+    ttft = (first_token_at - started) if first_token_at else total
+    print(f"DEBUG: Stream done, TTFT {ttft * 1000:.0f} ms, total {total * 1000:.0f} ms")
+    summarizer.schedule(client_id)
+
+    final_event = {"type": "chat_response", "id": message_id, "content": final}
+    yield final_event
+    await pubsub.publish(client_id, json.dumps(final_event))
+
+@app.get("/api/chat/jobs/{job_id}")
+async def get_chat_job(job_id: str, client_id: str = Query(...), secret: str = Query(...)):
+    """Status of a background chat job: queued, running, done (with result), error or rejected (see lg_jobs)."""
+    if not await lg_db_async.get_client(client_id, secret):
+         return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
+
+    job = await lg_db_async.get_chat_job(client_id, job_id)
+    if job is None:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    return job
+
+# /api/chat/stream turns in flight (see chat_stream)
+_stream_runs: set[asyncio.Task] = set()
+
+@app.post("/api/chat/stream")
+async def chat_stream(input_data: ChatInput):
+    """Same as /api/chat, but streams the reply as Server-Sent Events (one JSON object per event)."""
+    print(f"DEBUG: Chat stream request: {input_data.question} from {input_data.client_id}")
+    client_id = input_data.client_id
+    if not await lg_db_async.get_client(client_id, input_data.secret):
+         return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
+
+    # Reject up front with a proper status when the queue is full; once the stream has
+    # started the status is already sent
+    try:
+        lg_scheduler.scheduler.check(client_id)
+    except lg_scheduler.Rejected as e:
+        return JSONResponse(content={"error": e.reason}, status_code=e.status_code)
+
+    message_id = uuid.uuid4().hex
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def run():
+        # Its own task, fed to the response through the queue: Starlette never closes the
+        # response body, so a turn run inside it would just stop when the client disconnects,
+        # without saving the reply. Like /ws runs, the turn finishes and is saved anyway.
+        current_client_id.set(client_id)
+        try:
+            async with agent_run(client_id):
+                agent_input, config = await build_agent_input(client_id, input_data.question)
+                async with aclosing(stream_agent_events(client_id, agent_input, config, message_id)) as stream:
+                    async for event in stream:
+                        events.put_nowait(event)
+        except lg_scheduler.Rejected as e:
+            events.put_nowait({"type": "error", "id": message_id, "error": e.reason, "status": e.status_code})
+        except Exception as e:
+            print(f"ERROR: Chat stream exception: {e}")
+            import traceback
+            traceback.print_exc()
+            events.put_nowait({"type": "error", "id": message_id, "error": str(e)})
+        finally:
+            events.put_nowait(None)
+
+    task = asyncio.create_task(run())
+    _stream_runs.add(task)  # the loop only keeps weak references to tasks
+    task.add_done_callback(_stream_runs.discard)
+
+    async def sse():
+        while (event := await events.get()) is not None:
+            yield f"data: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(
+        sse(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/metrics/agent")
+async def agent_metrics():
+    """Agent scheduler state (running runs, queue depth, admissions/rejections, wait times), tool cache totals and chat history write batching."""
+    return {**lg_scheduler.scheduler.metrics(), "tool_cache": lg_tool_cache.totals(),
+            "chat_writes": history_writer.metrics()}
 
 
 @app.get("/api/calendar/events")
-def get_calendar_events(client_id: str = Query(...), secret: str = Query(...)):
-    """Fetch all events from the database for FullCalendar"""
-    if not lg_db.get_client(client_id, secret):
+async def get_calendar_events(client_id: str = Query(...), secret: str = Query(...),
+                              start: str | None = None, end: str | None = None,
+                              limit: int = Query(1000, ge=1, le=5000), if_none_match: str | None = Header(None)):
+    """
+    Fetch events for FullCalendar. FullCalendar sends the visible range as start/end, so
+    only that view is queried; without them, all events are returned (older clients).
+    A range with more than `limit` events is cut and marked with an X-Truncated header.
+    """
+    if not await lg_db_async.get_client(client_id, secret):
          return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
-         
-    events = lg_db.get_all_events(client_id)
-    return events
+
+    if start is None and end is None:
+        load = lambda: lg_db_async.get_all_events(client_id)
+    elif start is None or end is None:
+        return JSONResponse(content={"error": "start and end must be given together"}, status_code=400)
+    else:
+        error = check_range(start, end)
+        if error:
+            return JSONResponse(content={"error": error}, status_code=400)
+        # One extra row tells whether the range was cut
+        load = lambda: lg_db_async.get_events_in_range(client_id, start, end, limit + 1)
+        return await lg_changes.conditional(client_id, if_none_match, ("events", start, end, limit), load, limit)
+    return await lg_changes.conditional(client_id, if_none_match, ("events", start, end, limit), load)
+
+
+@app.get("/api/calendar/free_slots")
+async def get_free_slots(client_id: str = Query(...), secret: str = Query(...),
+                         start: str = Query(...), end: str = Query(...),
+                         duration_minutes: int = 60, day_start: str = "09:00", day_end: str = "18:00",
+                         limit: int = Query(10, ge=1, le=100)):
+    """Free intervals of at least duration_minutes within working hours between start and end."""
+    if not await lg_db_async.get_client(client_id, secret):
+         return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
+
+    error = check_free_slot_args(start, end, duration_minutes, day_start, day_end)
+    if error:
+        return JSONResponse(content={"error": error}, status_code=400)
+    return await lg_db_async.find_free_slots(client_id, start, end, duration_minutes, day_start, day_end, limit)
 
 
 @app.get("/api/objectives")
-def get_objectives(client_id: str = Query(...), secret: str = Query(...)):
-    if not lg_db.get_client(client_id, secret):
+async def get_objectives(client_id: str = Query(...), secret: str = Query(...),
+                         if_none_match: str | None = Header(None)):
+    if not await lg_db_async.get_client(client_id, secret):
+         return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
+    return await lg_changes.conditional(client_id, if_none_match, ("objectives",),
+                                        lambda: lg_db_async.get_client_objectives(client_id))
+
+@app.get("/api/objectives/{objective_id}/progress")
+async def get_objective_progress(objective_id: int, client_id: str = Query(...), secret: str = Query(...)):
+    if not await lg_db_async.get_client(client_id, secret):
          return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
-    return lg_db.get_client_objectives(client_id)
+
+    progress = await lg_db_async.get_objective_progress(client_id, objective_id)
+    if progress is None:
+        return JSONResponse(content={"error": "Objective not found"}, status_code=404)
+    return progress
 
 @app.post("/api/objectives")
-def add_objective(data: ObjectiveInput):
-    if not lg_db.get_client(data.client_id, data.secret):
+async def add_objective(data: ObjectiveInput, idempotency_key: str | None = Header(None)):
+    if not await lg_db_async.get_client(data.client_id, data.secret):
          return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
-    
-    obj_id = lg_db.add_objective(data.client_id, data.title, data.description)
-    return {"id": obj_id, "status": "success"}
+
+    async def handle():
+        obj_id = await lg_db_async.add_objective(data.client_id, data.title, data.description)
+        publish_objective_created(data.client_id, obj_id, data.title, data.description)
+        return {"id": obj_id, "status": "success"}
+    return await idempotency.run(data.client_id, idempotency_key, "/api/objectives", data, handle)
 
 @app.delete("/api/objectives")
-def delete_objective(data: RemoveItemInput):
-    if not lg_db.get_client(data.client_id, data.secret):
+async def delete_objective(data: RemoveItemInput):
+    if not await lg_db_async.get_client(data.client_id, data.secret):
          return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
     
-    lg_db.remove_objective(data.client_id, data.id)
+    await lg_db_async.remove_objective(data.client_id, data.id)
+    event_bus.publish(data.client_id, "objective_removed", objective_id=data.id)
     return {"status": "success"}
 
 @app.post("/api/objectives/complete")
-def complete_objective_endpoint(data: RemoveItemInput): # Reusing RemoveItemInput (id, client_id, secret)
-    if not lg_db.get_client(data.client_id, data.secret):
+async def complete_objective_endpoint(data: RemoveItemInput, idempotency_key: str | None = Header(None)): # Reusing RemoveItemInput (id, client_id, secret)
+    if not await lg_db_async.get_client(data.client_id, data.secret):
          return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
-    
-    success = lg_db.complete_objective(data.client_id, data.id)
-    return {"status": "success" if success else "failed"}
+
+    async def handle():
+        success = await lg_db_async.complete_objective(data.client_id, data.id)
+        if success:
+            event_bus.publish(data.client_id, "objective_completed", objective_id=data.id)
+        return {"status": "success" if success else "failed"}
+    return await idempotency.run(data.client_id, idempotency_key, "/api/objectives/complete", data, handle)
 
 @app.post("/api/tasks")
-def add_task(data: TaskInput):
-    if not lg_db.get_client(data.client_id, data.secret):
+async def add_task(data: TaskInput, idempotency_key: str | None = Header(None)):
+    if not await lg_db_async.get_client(data.client_id, data.secret):
          return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
-    
-    # Optional: Verify objective belongs to client? (lg_db.add_task doesn't check owner of obj, 
-    # but since objectives are scoped, it's somewhat safe provided ID is valid)
-    task_id = lg_db.add_task(data.objective_id, data.title, data.weight)
-    return {"id": task_id, "status": "success"}
+
+    async def handle():
+        task_ids = await lg_db_async.add_tasks(data.client_id, data.objective_id, [{"title": data.title, "weight": data.weight}])
+        if task_ids is None:
+            return JSONResponse(content={"error": "Objective not found"}, status_code=404)
+        task_id = task_ids[0]
+        publish_task_added(data.client_id, data.objective_id, task_id, data.title, data.weight)
+        return {"id": task_id, "status": "success"}
+    return await idempotency.run(data.client_id, idempotency_key, "/api/tasks", data, handle)
 
 @app.delete("/api/tasks")
-def delete_task(data: RemoveItemInput):
-    if not lg_db.get_client(data.client_id, data.secret):
+async def delete_task(data: RemoveItemInput):
+    if not await lg_db_async.get_client(data.client_id, data.secret):
          return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
     
-    lg_db.remove_task(data.client_id, data.id)
+    await lg_db_async.remove_task(data.client_id, data.id)
+    event_bus.publish(data.client_id, "task_removed", task_id=data.id)
     return {"status": "success"}
 
 @app.post("/api/tasks/complete")
-def complete_task_endpoint(data: RemoveItemInput): # Reusing RemoveItemInput (id, client_id, secret)
-    if not lg_db.get_client(data.client_id, data.secret):
+async def complete_task_endpoint(data: RemoveItemInput, idempotency_key: str | None = Header(None)): # Reusing RemoveItemInput (id, client_id, secret)
+    if not await lg_db_async.get_client(data.client_id, data.secret):
          return JSONResponse(content={"error": "Invalid client_id or secret"}, status_code=403)
-    
-    success = lg_db.complete_task(data.client_id, data.id)
-    return {"status": "success" if success else "failed"}
+
+    # A retried completion must not award XP twice
+    async def handle():
+        success = await lg_db_async.complete_task(data.client_id, data.id)
+        if success:
+            event_bus.publish(data.client_id, "task_completed", task_id=data.id)
+        return {"status": "success" if success else "failed"}
+    return await idempotency.run(data.client_id, idempotency_key, "/api/tasks/complete", data, handle)
 
 
 @app.get("/api/hello_db")
-def hello_db():
-    raw = lg_db.lg_hello_db()  
+async def hello_db():
+    raw = await lg_db_async.lg_hello_db()  
     try:
         parsed = json.loads(raw)  
     except Exception:
@@ -554,25 +1328,21 @@ def hello_db():
     return JSONResponse(content={"message": parsed})
 
 @app.post("/api/uuid_secret_count")
-def uuid_secret_count(device: DeviceRegistration):
-    count = lg_db.get_uuid_secret_count(device.client_id, device.secret)
+async def uuid_secret_count(device: DeviceRegistration):
+    count = await lg_db_async.get_uuid_secret_count(device.client_id, device.secret)
     return {"count": count}
 
 @app.post("/api/register_device")
-def register_device_api(device: DeviceRegistration):
+async def register_device_api(device: DeviceRegistration):
     """
     Register a client device (UUID+Secret).
     The client generates a UUID and a secret (e.g. random bytes), 
     and sends them here for initial pairing.
     """
-    lg_db.register_device(device.client_id, device.secret)
+    await lg_db_async.register_device(device.client_id, device.secret)
+    # Other workers may have the old secret cached
+    await pubsub.invalidate_client(device.client_id)
     
-    # Example: Notify all connected SSE clients about this event
-    # Note: Since this function is synchronous, we'd use a thread-safe way in production,
-    # or make this route 'async def'. For now, this is a conceptual example:
-    # for q in connections:
-    #     q.put_nowait({"event": "device_registered", "id": device.client_id})
-
     return {"status": "registered", "client_id": device.client_id}
 
 
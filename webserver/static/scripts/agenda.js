@@ -54,7 +54,14 @@ document.addEventListener('DOMContentLoaded', function () {
 
         // 3. Load from API (fetches from database) with credentials
         events: eventsSource,
-        
+        eventSourceSuccess: function(rawEvents, response) {
+            // The server cuts long ranges; say so instead of silently hiding events
+            if (response && response.headers.get('X-Truncated') === 'true') {
+                console.warn("Calendar range has more events than shown; narrow the view to see the rest");
+            }
+            return rawEvents;
+        },
+
         dateClick: function(info) {
             calendar.changeView('timeGridDay', info.dateStr);
         },
@@ -87,4 +94,19 @@ document.addEventListener('DOMContentLoaded', function () {
             
             // Expose calendar to global scope so our window helper works
             window.calendar = calendar;
+
+            // Apply the agent's (and other tabs') calendar changes without refetching
+            if (window.connectLiveUpdates) {
+                window.connectLiveUpdates((msg) => {
+                    if (msg.type === 'event_added') {
+                        if (!calendar.getEventById(String(msg.event.id))) {
+                            calendar.addEvent(msg.event);
+                        }
+                    } else if (msg.type === 'event_removed') {
+                        calendar.getEvents()
+                            .filter(ev => ev.title === msg.title)
+                            .forEach(ev => ev.remove());
+                    }
+                });
+            }
 });
\ No newline at end of file
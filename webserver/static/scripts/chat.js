@@ -65,6 +65,10 @@ document.addEventListener('DOMContentLoaded', () => {
     const sendButton = document.getElementById('send-button');
     
     let isWaitingForResponse = false;
+    // IDs of assistant replies already rendered (the same reply can arrive via stream and WS)
+    const renderedReplies = new Set();
+    // Replies requested over the WebSocket, by message ID -> stream state
+    const wsStreams = new Map();
 
     function showLoading() {
         if (isWaitingForResponse) return;
@@ -133,7 +137,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // WebSocket
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/ws`;
+    const wsBase = `${protocol}//${window.location.host}/ws`;
     let ws;
     let reconnectInterval = 2000;
 
@@ -141,7 +145,10 @@ document.addEventListener('DOMContentLoaded', () => {
         // Avoid duplicate connects
         if (ws && (ws.readyState === WebSocket.OPEN || ws.readyState === WebSocket.CONNECTING)) return;
 
-        console.log("Connecting to WS:", wsUrl);
+        if (!CLIENT_ID) return;
+        // The socket is scoped to this client: the server only routes our own replies to it
+        const wsUrl = `${wsBase}?client_id=${encodeURIComponent(CLIENT_ID)}&secret=${encodeURIComponent(SECRET)}`;
+        console.log("Connecting to WS:", wsBase);
         // We do not show "Connecting..." status on UI to avoid flicker/annoyance
 
         ws = new WebSocket(wsUrl);
@@ -156,7 +163,19 @@ document.addEventListener('DOMContentLoaded', () => {
         ws.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
+                if (data.type === 'ping') {
+                    ws.send(JSON.stringify({ type: 'pong' }));
+                    return;
+                }
+                const stream = data.id && wsStreams.get(data.id);
+                if (stream) {
+                    handleStreamEvent(data, stream);
+                    if (['chat_response', 'error', 'cancelled'].includes(data.type)) wsStreams.delete(data.id);
+                    return;
+                }
                 if (data.type === 'chat_response') {
+                    if (data.id && renderedReplies.has(data.id)) return;
+                    if (data.id) renderedReplies.add(data.id);
                     removeLoading();
                     appendMessage('assistant', data.content);
                 }
@@ -168,6 +187,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
         ws.onclose = (e) => {
             console.log("WS Closed:", e.code, e.reason);
+            // Replies in flight on this socket won't arrive here anymore (they are still saved to history)
+            if (wsStreams.size > 0) {
+                wsStreams.clear();
+                removeLoading();
+                setStatus("Connection lost; the reply will appear in your history.", true, 5000);
+            }
             // Don't clear status here; let the timer or existing alert persist
             setTimeout(connectWS, reconnectInterval);
             reconnectInterval = Math.min(reconnectInterval * 1.5, 30000);
@@ -186,6 +211,68 @@ document.addEventListener('DOMContentLoaded', () => {
         chatBox.appendChild(div);
         // Scroll to bottom
         chatBox.scrollTop = chatBox.scrollHeight;
+        return div;
+    }
+
+    // Apply one streamed chat event to the bubble of the reply being streamed
+    function handleStreamEvent(event, stream) {
+        // Claim the reply ID so the WS copy of the final message is not rendered twice
+        if (!stream.id && event.id) {
+            stream.id = event.id;
+            stream.skip = renderedReplies.has(event.id);
+            renderedReplies.add(event.id);
+        }
+        if (stream.skip) return;
+
+        if (event.type === 'token') {
+            if (!stream.div) {
+                removeLoading();
+                stream.div = appendMessage('assistant', '');
+            }
+            stream.text += event.content;
+            stream.div.innerHTML = marked.parse(stream.text);
+            chatBox.scrollTop = chatBox.scrollHeight;
+        } else if (event.type === 'tool_start') {
+            // Text streamed before a tool call is only a preamble; the next model call replaces it
+            stream.text = '';
+            setStatus(`Genie is using ${event.name}...`, true);
+        } else if (event.type === 'tool_end') {
+            setStatus("", false);
+        } else if (event.type === 'chat_response') {
+            setStatus("", false);
+            removeLoading();
+            if (!stream.div) stream.div = appendMessage('assistant', '');
+            stream.div.innerHTML = marked.parse(event.content);
+            chatBox.scrollTop = chatBox.scrollHeight;
+        } else if (event.type === 'error') {
+            removeLoading();
+            appendMessage('assistant', `Error: ${event.error}`);
+        } else if (event.type === 'cancelled') {
+            removeLoading();
+            setStatus("Reply cancelled.", true, 3000);
+        }
+    }
+
+    // Read a text/event-stream body ("data: {...}" blocks separated by blank lines)
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffered += decoder.decode(value, { stream: true });
+            let sep;
+            while ((sep = buffered.indexOf('\n\n')) !== -1) {
+                const block = buffered.slice(0, sep);
+                buffered = buffered.slice(sep + 2);
+                const data = block.split('\n')
+                    .filter(line => line.startsWith('data: '))
+                    .map(line => line.slice(6))
+                    .join('\n');
+                if (data) onEvent(JSON.parse(data));
+            }
+        }
     }
 
     function renderHistory(history) {
@@ -236,8 +323,18 @@ document.addEventListener('DOMContentLoaded', () => {
         inputField.value = '';
         showLoading();
 
+        // Preferred: ask over the open WebSocket (no per-turn HTTP request or re-auth)
+        if (ws && ws.readyState === WebSocket.OPEN) {
+            const id = newMessageId();
+            wsStreams.set(id, { id: null, skip: false, div: null, text: '' });
+            activeWsMessageId = id;
+            ws.send(JSON.stringify({ type: 'chat', id, question: text }));
+            return;
+        }
+
+        // Fallback: Server-Sent Events over HTTP
         try {
-            const response = await fetch('/api/chat', {
+            const response = await fetch('/api/chat/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
@@ -247,18 +344,16 @@ document.addEventListener('DOMContentLoaded', () => {
                 })
             });
             
-            const data = await response.json();
-            
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
                 removeLoading();
                 appendMessage('assistant', `Error: ${response.status} ${response.statusText}`);
-            } else if (data.response) {
-                // FALLBACK: If WS hasn't handled it yet (loader still present)
-                if (isWaitingForResponse) {
-                     removeLoading();
-                     appendMessage('assistant', data.response);
-                }
+                return;
             }
+
+            const stream = { id: null, skip: false, div: null, text: '' };
+            await readEventStream(response, (event) => handleStreamEvent(event, stream));
+            // Stream ended without a final message (e.g. connection cut)
+            if (isWaitingForResponse) removeLoading();
         } catch (e) {
             removeLoading();
             console.error(e);
@@ -266,12 +361,29 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    let activeWsMessageId = null;
+
+    function newMessageId() {
+        if (typeof crypto.randomUUID === 'function') return crypto.randomUUID();
+        return Math.random().toString(36).substring(2, 15) + Math.random().toString(36).substring(2, 15);
+    }
+
+    // Escape cancels the reply being generated over the WebSocket
+    function cancelReply() {
+        if (!activeWsMessageId || !wsStreams.has(activeWsMessageId)) return;
+        if (ws && ws.readyState === WebSocket.OPEN) {
+            ws.send(JSON.stringify({ type: 'cancel', id: activeWsMessageId }));
+        }
+    }
+
     sendButton.addEventListener('click', sendMessage);
+    document.addEventListener('keydown', (e) => {
+        if (e.key === 'Escape') cancelReply();
+    });
     inputField.addEventListener("keypress", (e) => {
         if (e.key === "Enter") sendMessage();
     });
 
-    // Start
-    loadHistory();
-    connectWS();
+    // Start (the socket needs the registered credentials)
+    loadHistory().then(connectWS);
 });
@@ -0,0 +1,35 @@
+// --- Live updates ---
+// Opens this client's WebSocket and passes every JSON message to onMessage,
+// reconnecting with backoff. Used by pages that apply change events as deltas.
+window.connectLiveUpdates = function(onMessage) {
+    const clientId = localStorage.getItem("client_id");
+    const secret = localStorage.getItem("client_secret");
+    if (!clientId || !secret) return;
+
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const wsUrl = `${protocol}//${window.location.host}/ws?client_id=${encodeURIComponent(clientId)}&secret=${encodeURIComponent(secret)}`;
+    let reconnectInterval = 2000;
+
+    function connect() {
+        const ws = new WebSocket(wsUrl);
+        ws.onopen = () => { reconnectInterval = 2000; };
+        ws.onmessage = (event) => {
+            try {
+                const msg = JSON.parse(event.data);
+                // Answer the server heartbeat, or it closes the socket as dead
+                if (msg.type === 'ping') {
+                    ws.send(JSON.stringify({ type: 'pong' }));
+                    return;
+                }
+                onMessage(msg);
+            } catch (e) {
+                console.log("WS Message (raw):", event.data);
+            }
+        };
+        ws.onclose = () => {
+            setTimeout(connect, reconnectInterval);
+            reconnectInterval = Math.min(reconnectInterval * 1.5, 30000);
+        };
+    }
+    connect();
+};
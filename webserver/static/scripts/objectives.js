@@ -23,8 +23,12 @@ document.addEventListener('DOMContentLoaded', () => {
     let currentModalMode = 'objective'; // 'objective' or 'task'
     let currentObjectiveId = null;
 
+    // Current list as rendered; change events are applied to it as deltas
+    let objectives = [];
+
     // Load initial data
     fetchObjectives();
+    if (window.connectLiveUpdates) window.connectLiveUpdates(applyChange);
 
     // --- Modal Logic ---
     function openModal(mode, objId = null) {
@@ -88,8 +92,8 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             const res = await fetch(`/api/objectives?client_id=${CLIENT_ID}&secret=${SECRET}`);
             if (res.ok) {
-                const data = await res.json();
-                renderObjectives(data);
+                objectives = await res.json();
+                renderObjectives(objectives);
             }
         } catch (e) {
             console.error(e);
@@ -169,6 +173,46 @@ document.addEventListener('DOMContentLoaded', () => {
         } catch (e) { console.error(e); }
     }
 
+    // --- Live Updates ---
+    // Apply a change event to the local list and re-render. Idempotent, since our own
+    // actions both refetch and come back as events.
+    function findTask(taskId) {
+        for (const obj of objectives) {
+            const task = obj.tasks.find(t => t.id === taskId);
+            if (task) return { obj, task };
+        }
+        return null;
+    }
+
+    function applyChange(msg) {
+        if (msg.type === 'objective_created') {
+            if (objectives.some(o => o.id === msg.objective.id)) return;
+            objectives.unshift(msg.objective);
+        } else if (msg.type === 'objective_removed') {
+            objectives = objectives.filter(o => o.id !== msg.objective_id);
+        } else if (msg.type === 'objective_completed') {
+            const obj = objectives.find(o => o.id === msg.objective_id);
+            if (!obj) return;
+            obj.status = 'completed';
+        } else if (msg.type === 'task_added') {
+            const obj = objectives.find(o => o.id === msg.objective_id);
+            if (!obj || obj.tasks.some(t => t.id === msg.task.id)) return;
+            obj.tasks.push(msg.task);
+        } else if (msg.type === 'task_removed') {
+            const found = findTask(msg.task_id);
+            if (!found) return;
+            found.obj.tasks = found.obj.tasks.filter(t => t.id !== msg.task_id);
+        } else if (msg.type === 'task_completed') {
+            const found = findTask(msg.task_id);
+            if (!found) return;
+            found.task.is_completed = true;
+            if (found.obj.status === 'not_started') found.obj.status = 'in_progress';
+        } else {
+            return;
+        }
+        renderObjectives(objectives);
+    }
+
     function renderObjectives(objectives) {
         objectivesContainer.innerHTML = '';
         
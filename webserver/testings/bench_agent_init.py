@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+import asyncio
+
+# A fake key is enough: building the client and compiling the graph never hits the network
+os.environ.setdefault("DEEPSEEK_API_KEY", "sk-bench")
+
+import lg_db_async
+import server
+
+N = 50
+
+
+async def main():
+    # Assistant() takes the Postgres checkpointer, which open_pool() creates
+    await lg_db_async.open_pool()
+    try:
+        # Before: a new Assistant (LLM client + compiled graph) on every /api/chat request
+        start = time.perf_counter()
+        for _ in range(N):
+            server.Assistant(server.default_provider())
+        per_request_before = (time.perf_counter() - start) / N
+
+        # After: the process-wide registry, warmed once at startup
+        server.get_assistant()
+        start = time.perf_counter()
+        for _ in range(N):
+            server.get_assistant()
+        per_request_after = (time.perf_counter() - start) / N
+
+        print(f"Per-request agent setup, {N} requests:")
+        print(f"  Assistant() per request : {per_request_before * 1000:.3f} ms")
+        print(f"  get_assistant() (cached): {per_request_after * 1000:.4f} ms")
+        print(f"  Speedup: {per_request_before / max(per_request_after, 1e-9):.0f}x")
+    finally:
+        await lg_db_async.close_pool()
+
+
+try:
+    asyncio.run(main())
+except Exception as e:
+    print(f"{type(e).__name__}: {e}")
+    sys.exit(1)
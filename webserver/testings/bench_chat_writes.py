@@ -0,0 +1,63 @@
+import time
+import uuid
+import asyncio
+import lg_db
+import lg_db_async
+from lg_history_writer import HistoryWriter, ACK
+
+# Many clients saving chat messages at once: one INSERT + commit per message vs the
+# write-behind queue ("ack" durability, so every add() still waits for its commit).
+# Commits are counted from pg_stat_database (includes other activity on the database).
+CLIENTS = 50
+MESSAGES = 20  # per client
+
+
+async def commits() -> int:
+    async with lg_db_async._pool.connection() as conn:
+        cur = await conn.execute("SELECT xact_commit FROM pg_stat_database WHERE datname = current_database();")
+        return (await cur.fetchone())[0]
+
+
+async def run(add, client_ids) -> tuple[float, int]:
+    async def client(client_id):
+        for i in range(MESSAGES):
+            await add(client_id, "user", f"message {i}")
+    before = await commits()
+    start = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in client_ids))
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(1)  # pg_stat counters are updated asynchronously
+    return elapsed, await commits() - before
+
+
+async def main():
+    client_ids = [f"bench_{uuid.uuid4()}" for _ in range(CLIENTS)]
+    await lg_db_async.open_pool()
+    try:
+        for client_id in client_ids:
+            await lg_db_async.register_device(client_id, "bench")
+
+        direct = await run(lg_db_async.add_chat_message, client_ids)
+        writer = HistoryWriter(flush_interval=0.02, max_batch=500, durability=ACK)
+        writer.start()
+        batched = await run(writer.add, client_ids)
+        await writer.stop()
+
+        total = CLIENTS * MESSAGES
+        print(f"{CLIENTS} clients x {MESSAGES} messages, pool max_size {lg_db.POOL_KWARGS['max_size']}:")
+        print(f"  one commit per message: {total / direct[0]:.0f} msg/s, ~{direct[1]} commits")
+        print(f"  write-behind (ack)    : {total / batched[0]:.0f} msg/s, ~{batched[1]} commits")
+        print(f"  batches: {writer.metrics()}")
+
+    except Exception as e:
+        print(e)
+    finally:
+        async with lg_db_async._pool.connection() as conn:
+            await conn.execute("DELETE FROM client_changes WHERE client_id = ANY(%s);", (client_ids,))
+            await conn.execute("DELETE FROM chat_history WHERE client_id = ANY(%s);", (client_ids,))
+            await conn.execute("DELETE FROM clients WHERE client_id = ANY(%s);", (client_ids,))
+        await lg_db_async.close_pool()
+
+
+lg_db.init_db()
+asyncio.run(main())
@@ -0,0 +1,54 @@
+import asyncio
+import time
+import lg_db
+import lg_db_async
+
+# Measures how long the event loop stalls while DB calls are in flight:
+# sync lg_db calls made directly from async code vs the lg_db_async pool.
+CONCURRENCY = 20
+QUERY = "SELECT pg_sleep(0.05)"
+
+
+async def heartbeat(lags: list, stop: asyncio.Event, interval: float = 0.005):
+    """Tick every `interval` and record how late each tick was."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def sync_call():
+    with lg_db._pool.connection() as conn:
+        conn.execute(QUERY)
+
+
+async def async_call():
+    async with lg_db_async._pool.connection() as conn:
+        await conn.execute(QUERY)
+
+
+async def measure(label: str, call):
+    lags, stop = [], asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(CONCURRENCY)))
+    total = time.perf_counter() - start
+    stop.set()
+    await beat
+    print(f"{label}: {CONCURRENCY} calls in {total * 1000:.0f} ms, "
+          f"max loop stall {max(lags, default=0) * 1000:.1f} ms")
+
+
+async def main():
+    await lg_db_async.open_pool()
+    try:
+        await measure("sync lg_db      ", sync_call)
+        await measure("lg_db_async pool", async_call)
+    finally:
+        await lg_db_async.close_pool()
+
+
+try:
+    asyncio.run(main())
+except Exception as e:
+    print(e)
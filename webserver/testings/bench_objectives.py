@@ -0,0 +1,70 @@
+import sys
+import time
+import uuid
+import lg_db
+
+# Synthetic users with many objectives/tasks: old N+1 loader vs the single json_agg query
+USERS = 5
+OBJECTIVES = 50
+TASKS = 10
+ROUNDS = 20
+
+
+def get_client_objectives_n_plus_one(client_id: str) -> list[dict]:
+    """The previous implementation: one query for objectives, then one per objective."""
+    with lg_db._pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, title, description, status FROM client_objectives WHERE client_id = %s ORDER BY created_at DESC;", (client_id,))
+            objectives = []
+            for obj_id, title, desc, status in cur.fetchall():
+                cur.execute("SELECT id, title, weight, is_completed FROM client_tasks WHERE objective_id = %s ORDER BY created_at ASC;", (obj_id,))
+                tasks = [{"id": t[0], "title": t[1], "weight": t[2], "is_completed": t[3]} for t in cur.fetchall()]
+                # Progress computed from the tasks: also checks the stored read model
+                total = sum(t["weight"] for t in tasks)
+                done = sum(t["weight"] for t in tasks if t["is_completed"])
+                progress = {"total_weight": total, "done_weight": done, "task_count": len(tasks),
+                            "done_count": sum(1 for t in tasks if t["is_completed"]),
+                            "ratio": done / total if total else 0.0}
+                objectives.append({"id": obj_id, "title": title, "description": desc, "status": status,
+                                   "tasks": tasks, "progress": progress})
+            return objectives
+
+
+def timed(fn, client_ids) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for client_id in client_ids:
+            fn(client_id)
+    return (time.perf_counter() - start) / (ROUNDS * len(client_ids))
+
+
+client_ids = [f"bench_{uuid.uuid4()}" for _ in range(USERS)]
+try:
+    lg_db.init_db()
+    for client_id in client_ids:
+        lg_db.register_device(client_id, "bench")
+        for o in range(OBJECTIVES):
+            obj_id = lg_db.add_objective(client_id, f"Objective {o}", "synthetic")
+            for t in range(TASKS):
+                lg_db.add_task(client_id, obj_id, f"Task {t}", t % 3 + 1)
+
+    # Same nested shape from both loaders (ids/order included)
+    expected = get_client_objectives_n_plus_one(client_ids[0])
+    actual = lg_db.get_client_objectives(client_ids[0])
+    assert expected == actual, f"Loaders differ, first objective: {expected[:1]} vs {actual[:1]}"
+
+    before = timed(get_client_objectives_n_plus_one, client_ids)
+    after = timed(lg_db.get_client_objectives, client_ids)
+    print(f"{OBJECTIVES} objectives x {TASKS} tasks per user:")
+    print(f"  N+1 queries  : {before * 1000:.2f} ms/call ({OBJECTIVES + 1} round trips)")
+    print(f"  single query : {after * 1000:.2f} ms/call (1 round trip)")
+    print(f"  Speedup: {before / after:.1f}x")
+
+except Exception as e:
+    print(f"{type(e).__name__}: {e}")
+    sys.exit(1)
+finally:
+    with lg_db._pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM client_objectives WHERE client_id = ANY(%s);", (client_ids,))
+            cur.execute("DELETE FROM clients WHERE client_id = ANY(%s);", (client_ids,))
@@ -0,0 +1,96 @@
+import time
+import uuid
+import psycopg
+import lg_db
+
+# Task completion: the previous multi-statement transaction vs the single CTE statement
+# (autocommit), and the CTE with vs without server-side prepared statements.
+# Run against a local Postgres; the gap grows with network latency.
+USERS = 5
+TASKS = 200  # per user, split between the variants
+
+
+def complete_task_before(client_id: str, task_id: int) -> bool:
+    """The previous implementation: BEGIN, SELECT, 3 UPDATEs, change log, COMMIT."""
+    with lg_db._pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT t.id, t.weight, t.is_completed, o.id
+                FROM client_tasks t
+                JOIN client_objectives o ON t.objective_id = o.id
+                WHERE t.id = %s AND o.client_id = %s
+            """, (task_id, client_id))
+            res = cur.fetchone()
+            if not res or res[2]:
+                return False
+            weight, objective_id = res[1], res[3]
+            cur.execute("UPDATE client_tasks SET is_completed = TRUE WHERE id = %s", (task_id,))
+            cur.execute("""
+                UPDATE clients
+                SET xp_score = xp_score + %s, tasks_completed_count = tasks_completed_count + 1
+                WHERE client_id = %s
+            """, (weight, client_id))
+            cur.execute("""
+                UPDATE client_objectives
+                SET done_weight = done_weight + %s, done_count = done_count + 1,
+                    status = CASE WHEN status = 'not_started' THEN 'in_progress' ELSE status END
+                WHERE id = %s
+            """, (weight, objective_id))
+            lg_db._record_changes(cur, client_id, lg_db.OBJECTIVE, [objective_id])
+            return True
+
+
+def complete_task_on(conn):
+    """Single CTE statement on a dedicated autocommit connection."""
+    def complete(client_id: str, task_id: int) -> bool:
+        cur = conn.execute(lg_db._COMPLETE_TASK_QUERY, {"task_id": task_id, "client_id": client_id, "entity": lg_db.OBJECTIVE})
+        return cur.fetchone() is not None
+    return complete
+
+
+def timed(fn, work) -> float:
+    start = time.perf_counter()
+    for client_id, task_id in work:
+        assert fn(client_id, task_id)
+    return (time.perf_counter() - start) / len(work)
+
+
+client_ids = [f"bench_{uuid.uuid4()}" for _ in range(USERS)]
+try:
+    lg_db.init_db()
+    work = []
+    for client_id in client_ids:
+        lg_db.register_device(client_id, "bench")
+        obj_id = lg_db.add_objective(client_id, "Objective", "synthetic")
+        work += [(client_id, lg_db.add_task(client_id, obj_id, f"Task {t}", t % 3 + 1)) for t in range(TASKS)]
+    quarter = len(work) // 4
+    batches = [work[i * quarter:(i + 1) * quarter] for i in range(4)]
+
+    with psycopg.connect(lg_db._CONNINFO, autocommit=True, prepare_threshold=None) as unprepared, \
+         psycopg.connect(lg_db._CONNINFO, autocommit=True, prepare_threshold=0) as prepared:
+        results = {
+            "multi-statement (7 round trips)": timed(complete_task_before, batches[0]),
+            "lg_db.complete_task (pool)": timed(lg_db.complete_task, batches[1]),
+            "single CTE, not prepared": timed(complete_task_on(unprepared), batches[2]),
+            "single CTE, prepared": timed(complete_task_on(prepared), batches[3]),
+        }
+
+    # Completing twice must not award XP twice
+    assert not lg_db.complete_task(*work[0])
+    # Every variant kept the read model and stats consistent
+    drift = lg_db.rebuild_progress(client_ids[0], dry_run=True)
+    assert not drift["objectives_fixed"] and not drift["clients_fixed"], drift
+
+    baseline = results["multi-statement (7 round trips)"]
+    print(f"complete_task, {quarter} calls each:")
+    for name, seconds in results.items():
+        print(f"  {name:32}: {seconds * 1000:.3f} ms/call ({baseline / seconds:.1f}x)")
+
+except Exception as e:
+    print(e)
+finally:
+    with lg_db._pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM client_changes WHERE client_id = ANY(%s);", (client_ids,))
+            cur.execute("DELETE FROM client_objectives WHERE client_id = ANY(%s);", (client_ids,))
+            cur.execute("DELETE FROM clients WHERE client_id = ANY(%s);", (client_ids,))
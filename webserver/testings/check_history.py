@@ -1,21 +1,80 @@
+import sys
 import lg_db
-import json
+import lg_migrations
+from lg_history_retention import history_retention
+
+# Inspect one client's recent chat history (bounded by time, so only the newest partitions
+# are scanned), then the size of each chat_history partition and of the agent checkpoint tables.
+# With --retention, run one retention pass (LG_CHAT_RETENTION_MONTHS must be set) and check
+# that it left no month and no agent thread older than the cutoff.
+# Usage: python check_history.py [client_id] [days=7] [--retention]
+retention = "--retention" in sys.argv
+args = [a for a in sys.argv[1:] if a != "--retention"]
+client_id = args[0] if args else None
+days = int(args[1]) if len(args) > 1 else 7
+
+
+def print_sizes(cur):
+    print("Partitions:")
+    for name, _ in lg_db.chat_partitions():
+        cur.execute("SELECT pg_table_size(%s), pg_indexes_size(%s);", (name, name))
+        table_size, index_size = cur.fetchone()
+        print(f"  {name}: table {table_size / 1024:.0f} kB, indexes {index_size / 1024:.0f} kB")
+    print("Agent checkpoints:")
+    for table in lg_db.CHECKPOINT_TABLES:
+        cur.execute(f"SELECT count(*), pg_total_relation_size(%s) FROM {table};", (table,))
+        rows, size = cur.fetchone()
+        print(f"  {table}: {rows} rows, {size / 1024:.0f} kB")
+
+
+def row_counts() -> dict:
+    # Own short transaction: its locks would block the pass from detaching partitions
+    with lg_db._pool.connection() as conn:
+        return {table: conn.execute(f"SELECT count(*) FROM {table};").fetchone()[0]
+                for table in ("chat_history",) + lg_db.CHECKPOINT_TABLES}
+
 
 try:
     lg_db.init_db()
     with lg_db._pool.connection() as conn:
         with conn.cursor() as cur:
-            # mimic exactly what server does
-            cur.execute("SELECT client_id, role, content FROM chat_history ORDER BY timestamp ASC;")
-            rows = cur.fetchall()
-            print(f"Total rows: {len(rows)}")
-            for i, r in enumerate(rows):
-                print(f"[{i}] Role: {r[1]}")
-                print(f"    Type: {type(r[2])}")
-                print(f"    Content Start: {str(r[2])[:50]}...")
-                
-                if isinstance(r[2], (list, dict, tuple)):
-                    print("    WARNING: IT IS A SEQUENCE/OBJECT!")
+            if client_id:
+                # mimic exactly what server does, limited to the last `days`
+                cur.execute("""
+                    SELECT client_id, role, content FROM chat_history
+                    WHERE client_id = %s AND timestamp >= LOCALTIMESTAMP - make_interval(days => %s)
+                    ORDER BY timestamp ASC, id ASC;
+                """, (client_id, days))
+                rows = cur.fetchall()
+                print(f"Rows in the last {days} days: {len(rows)}")
+                for i, r in enumerate(rows):
+                    print(f"[{i}] Role: {r[1]}")
+                    print(f"    Type: {type(r[2])}")
+                    print(f"    Content Start: {str(r[2])[:50]}...")
+
+                    if isinstance(r[2], (list, dict, tuple)):
+                        print("    WARNING: IT IS A SEQUENCE/OBJECT!")
+
+            print_sizes(cur)
+
+            if retention:
+                assert history_retention.keep_months > 0, "set LG_CHAT_RETENTION_MONTHS to check retention"
+                conn.commit()  # release the locks taken above: the pass detaches partitions
+                before = row_counts()
+                result = history_retention.run_once()
+                after = row_counts()
+                print(f"Retention pass: {result}")
+                for table in before:
+                    print(f"  {table}: {before[table]} -> {after[table]} rows")
+                    assert after[table] <= before[table], f"{table} grew during the retention pass"
+
+                cutoff = lg_migrations.add_months(lg_db.chat_current_month(), 1 - history_retention.keep_months)
+                old = [name for name, month in lg_db.chat_partitions() if month < cutoff]
+                assert not old, f"partitions older than {cutoff} left: {old}"
+                stale = lg_db.stale_agent_threads(cutoff)
+                assert not stale, f"agent threads unused since {cutoff} left: {stale}"
+                print_sizes(cur)
 
 except Exception as e:
-    print(e)
+    print(f"{type(e).__name__}: {e}")
+    sys.exit(1)
@@ -0,0 +1,23 @@
+import sys
+import lg_db
+
+# Consistency check for the objective progress read model and client stats: recomputes
+# both from the tasks and reports rows that had drifted. Dry run unless --fix is given.
+fix = "--fix" in sys.argv
+client_id = next((a for a in sys.argv[1:] if not a.startswith("--")), None)
+
+try:
+    lg_db.init_db()
+    result = lg_db.rebuild_progress(client_id, dry_run=not fix)
+    objectives, clients = result["objectives_fixed"], result["clients_fixed"]
+    action = "Fixed" if fix else "Drifted (run with --fix to repair)"
+    print(f"{action}: {len(objectives)} objectives, {len(clients)} clients")
+    if objectives:
+        print(f"  objectives: {objectives[:20]}{' ...' if len(objectives) > 20 else ''}")
+    if clients:
+        print(f"  clients: {clients[:20]}{' ...' if len(clients) > 20 else ''}")
+    if (objectives or clients) and not fix:
+        sys.exit(1)
+except Exception as e:
+    print(e)
+    sys.exit(1)
@@ -0,0 +1,125 @@
+import sys
+import json
+import lg_db
+import lg_migrations
+
+# Loads a large synthetic fixture, then EXPLAINs every hot lg_db query for one client
+# and exits non-zero if any of them plans a Seq Scan on a hot table.
+FIXTURE_CLIENTS = 2000
+PREFIX = "plancheck_"
+HOT_TABLES = {"chat_history", "calendar_events", "client_objectives", "client_tasks", "clients"}
+
+HOT_QUERIES = {
+    "get_client": ("SELECT 1 FROM clients WHERE client_id = %s AND secret = %s", lambda c: (c, "x")),
+    "get_chat_history": (
+        "SELECT role, content FROM chat_history WHERE client_id = %s ORDER BY timestamp DESC, id DESC LIMIT 20",
+        lambda c: (c,),
+    ),
+    "get_context_window": (lg_db._CONTEXT_WINDOW_QUERY, lambda c: (c, 0, 200, 4000)),
+    "get_events_in_range": (
+        lg_db._EVENTS_IN_RANGE_QUERY, lambda c: (c, "2030-02-01T00:00", "2030-01-01T00:00", 1000),
+    ),
+    "find_free_slots": (
+        lg_db._FREE_SLOTS_QUERY,
+        lambda c: lg_db._free_slots_params(c, "2030-01-01T00:00", "2030-01-15T00:00", 60, "09:00", "18:00", 10),
+    ),
+    "get_all_events": ("SELECT title, start_time, end_time FROM calendar_events WHERE client_id = %s", lambda c: (c,)),
+    "remove_calendar_event": ("SELECT 1 FROM calendar_events WHERE client_id = %s AND title = %s", lambda c: (c, "Event 1")),
+    "get_client_objectives": (lg_db._OBJECTIVES_QUERY, lambda c: (c,)),
+    "remove_task": (
+        "SELECT 1 FROM client_tasks WHERE id = %s AND objective_id IN (SELECT id FROM client_objectives WHERE client_id = %s)",
+        lambda c: (1, c),
+    ),
+}
+
+
+def seq_scans(plan: dict, empty: set[str]) -> list[str]:
+    """Return the hot tables a plan (EXPLAIN FORMAT JSON node) seq-scans, ignoring `empty` partitions."""
+    found = []
+    relation = plan.get("Relation Name", "")
+    if relation in empty:
+        relation = ""  # nothing to scan: the planner picks a seq scan whatever the indexes
+    elif relation.startswith(lg_migrations.CHAT_PARTITION_PREFIX) or relation == lg_migrations.CHAT_DEFAULT_PARTITION:
+        relation = "chat_history"  # partitions count as the table
+    if plan.get("Node Type") == "Seq Scan" and relation in HOT_TABLES:
+        found.append(relation)
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child, empty))
+    return found
+
+
+def empty_chat_partitions(cur) -> set[str]:
+    """chat_history partitions without rows (months ahead, the default partition)."""
+    cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'chat_history'::regclass")
+    empty = set()
+    for (name,) in cur.fetchall():
+        cur.execute(f'SELECT NOT EXISTS (SELECT 1 FROM "{name}")')
+        if cur.fetchone()[0]:
+            empty.add(name)
+    return empty
+
+
+def load_fixture(cur):
+    cur.execute("""
+        INSERT INTO clients (client_id, secret)
+        SELECT %s || g, 'x' FROM generate_series(1, %s) g
+    """, (PREFIX, FIXTURE_CLIENTS))
+    cur.execute("""
+        INSERT INTO chat_history (client_id, role, content, timestamp)
+        SELECT c.client_id, 'user', 'message ' || g, now() - g * interval '1 minute'
+        FROM clients c, generate_series(1, 50) g WHERE c.client_id LIKE %s
+    """, (PREFIX + "%",))
+    cur.execute("""
+        INSERT INTO calendar_events (client_id, title, start_time, end_time)
+        SELECT c.client_id, 'Event ' || g, now() + g * interval '1 day', now() + g * interval '1 day' + interval '1 hour'
+        FROM clients c, generate_series(1, 20) g WHERE c.client_id LIKE %s
+    """, (PREFIX + "%",))
+    cur.execute("""
+        INSERT INTO client_objectives (client_id, title)
+        SELECT c.client_id, 'Objective ' || g FROM clients c, generate_series(1, 10) g WHERE c.client_id LIKE %s
+    """, (PREFIX + "%",))
+    cur.execute("""
+        INSERT INTO client_tasks (objective_id, title)
+        SELECT o.id, 'Task ' || g FROM client_objectives o, generate_series(1, 5) g WHERE o.client_id LIKE %s
+    """, (PREFIX + "%",))
+    for table in HOT_TABLES:
+        cur.execute(f"ANALYZE {table}")
+
+
+def drop_fixture(cur):
+    cur.execute("DELETE FROM client_objectives WHERE client_id LIKE %s", (PREFIX + "%",))
+    cur.execute("DELETE FROM calendar_events WHERE client_id LIKE %s", (PREFIX + "%",))
+    cur.execute("DELETE FROM chat_history WHERE client_id LIKE %s", (PREFIX + "%",))
+    cur.execute("DELETE FROM clients WHERE client_id LIKE %s", (PREFIX + "%",))
+
+
+failures = []
+try:
+    lg_db.init_db()
+    with lg_db._pool.connection() as conn:
+        with conn.cursor() as cur:
+            load_fixture(cur)
+        conn.commit()
+
+        with conn.cursor() as cur:
+            sample_client = PREFIX + str(FIXTURE_CLIENTS // 2)
+            empty = empty_chat_partitions(cur)
+            for name, (sql, params) in HOT_QUERIES.items():
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql, params(sample_client))
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scanned = seq_scans(plan[0]["Plan"], empty)
+                status = "SEQ SCAN on " + ", ".join(scanned) if scanned else "ok"
+                print(f"{name:24} {status}")
+                if scanned:
+                    failures.append(name)
+finally:
+    with lg_db._pool.connection() as conn:
+        with conn.cursor() as cur:
+            drop_fixture(cur)
+
+if failures:
+    print(f"FAIL: {len(failures)} hot queries plan a sequential scan: {', '.join(failures)}")
+    sys.exit(1)
+print("All hot queries use indexes.")
@@ -0,0 +1,49 @@
+import sys
+import asyncio
+import uuid
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+import lg_db
+import lg_db_async
+import lg_summary
+
+# Runs the rolling summarizer against the DB with a local fake LLM (no API key needed)
+MESSAGES = 45
+
+
+async def main():
+    client_id = f"summary_{uuid.uuid4()}"
+    fake_llm = FakeListChatModel(responses=["Summary v1: user plans a marathon.", "Summary v2: marathon + diet."])
+    summarizer = lg_summary.Summarizer(lambda: fake_llm)
+
+    await lg_db_async.open_pool()
+    try:
+        await lg_db_async.register_device(client_id, "x")
+        for i in range(MESSAGES):
+            await lg_db_async.add_chat_message(client_id, "user" if i % 2 == 0 else "assistant", f"message {i}")
+
+        # First pass compacts everything except the newest KEEP_RECENT messages
+        updated = await summarizer.summarize(client_id)
+        summary = await lg_db_async.get_chat_summary(client_id)
+        print(f"First pass updated={updated}: {summary}")
+
+        # Nothing new yet: below MIN_BATCH, no LLM call
+        print(f"Second pass updated={await summarizer.summarize(client_id)}")
+
+        window = await lg_db_async.get_context_window(client_id, max_tokens=4000, after_id=summary["last_message_id"])
+        print(f"Tail after summary: {len(window)} messages, first={window[0]['content']!r}, last={window[-1]['content']!r}")
+        assert len(window) == lg_summary.KEEP_RECENT, f"expected {lg_summary.KEEP_RECENT} messages after the summary, got {len(window)}"
+        assert window[-1]["content"] == f"message {MESSAGES - 1}", f"newest message missing: {window[-1]}"
+    finally:
+        async with lg_db_async._pool.connection() as conn:
+            await conn.execute("DELETE FROM chat_summaries WHERE client_id = %s", (client_id,))
+            await conn.execute("DELETE FROM chat_history WHERE client_id = %s", (client_id,))
+            await conn.execute("DELETE FROM clients WHERE client_id = %s", (client_id,))
+        await lg_db_async.close_pool()
+
+
+try:
+    lg_db.init_db()
+    asyncio.run(main())
+except Exception as e:
+    print(f"{type(e).__name__}: {e}")
+    sys.exit(1)
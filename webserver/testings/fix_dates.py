@@ -1,21 +1,27 @@
+import sys
 import lg_db
-import datetime
+
+# Dev helper: shift one client's past events forward (420 days by default) so the demo
+# calendar has upcoming events again. Bounded to that client's events that already ended.
+# Usage: python fix_dates.py <client_id> [days=420]
+if len(sys.argv) < 2:
+    sys.exit("Usage: python fix_dates.py <client_id> [days=420]")
+client_id = sys.argv[1]
+days = int(sys.argv[2]) if len(sys.argv) > 2 else 420
 
 try:
     lg_db.init_db()
-    
-    # We want to move 2024-12-16 to next week from "Now" (2026-02-03)
-    # 2024-12-16 to 2026-02-09 (Next Monday)
-    # The difference is approx 419 days
-    
+
     with lg_db._pool.connection() as conn:
         with conn.cursor() as cur:
-            # Shift everything by 1 year and 2 months roughly (419 days)
-            cur.execute("UPDATE calendar_events SET start_time = start_time + interval '420 days', end_time = end_time + interval '420 days';")
-            print("Events shifted forward.")
-            
-            cur.execute("SELECT id, title, start_time FROM calendar_events;")
+            cur.execute("""
+                UPDATE calendar_events
+                SET start_time = start_time + make_interval(days => %s), end_time = end_time + make_interval(days => %s)
+                WHERE client_id = %s AND end_time < LOCALTIMESTAMP
+                RETURNING id, title, start_time;
+            """, (days, days, client_id))
             rows = cur.fetchall()
+            print(f"{len(rows)} events shifted forward.")
             print("New Event Dates:")
             for r in rows:
                 print(f"[{r[0]}] {r[1]} : {r[2]}")
@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime, timezone
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import InMemorySaver
+import lg_tool_cache
+import server
+
+# One agent turn through the real Assistant graph (tools, prompt, pre-model hook) with a
+# fake chat model and an in-memory checkpointer: no LLM API and no database needed.
+# Run with pytest, or directly: python testings/test_agent_turn.py
+
+
+class RecordingFakeModel(GenericFakeChatModel):
+    """Fake chat model that replays canned replies and records what each call was sent."""
+    calls: list = []
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append(messages)
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def test_agent_turn():
+    llm = RecordingFakeModel(messages=iter([
+        AIMessage(content="", tool_calls=[{"name": "get_server_time", "args": {}, "id": "call_1"}]),
+        AIMessage(content="It is time to plan."),
+    ]))
+    assistant = server.Assistant(llm=llm, checkpointer=InMemorySaver())
+    config = server.agent_config("test-client:0", summary="The user is training for a marathon.")
+
+    response = asyncio.run(assistant.agent.ainvoke({"messages": [{"role": "user", "content": "What time is it?"}]}, config))
+
+    assert server.extract_final_text(response) == "It is time to plan."
+    # Model called twice: before and after the tool ran
+    assert len(llm.calls) == 2, llm.calls
+    # The pre-model hook got the run config: the rolling summary reaches the model
+    assert any("marathon" in str(m.content) for m in llm.calls[0]), llm.calls[0]
+    assert any(m.type == "tool" and "server time" in str(m.content) for m in llm.calls[1]), llm.calls[1]
+
+
+class RecordingWriter:
+    """Stands in for the chat history writer: records what would be saved."""
+    def __init__(self):
+        self.saved = []
+
+    async def add(self, client_id, role, content):
+        self.saved.append((client_id, role, content))
+
+
+def stub_stream_deps(monkeypatch, assistant) -> RecordingWriter:
+    writer = RecordingWriter()
+
+    async def publish(client_id, message):
+        pass
+    monkeypatch.setattr(server, "history_writer", writer)
+    monkeypatch.setattr(server.pubsub, "publish", publish)
+    monkeypatch.setattr(server, "get_assistant", lambda: assistant)
+    return writer
+
+
+def test_stream_saves_unstreamed_reply(monkeypatch):
+    # A provider that doesn't stream chunks: the reply comes from the graph's final state
+    llm = RecordingFakeModel(messages=iter([AIMessage(content="No chunks here.")]), disable_streaming=True)
+    assistant = server.Assistant(llm=llm, checkpointer=InMemorySaver())
+    writer = stub_stream_deps(monkeypatch, assistant)
+
+    async def run():
+        agent_input = {"messages": [{"role": "user", "content": "Hi"}]}
+        events = [e async for e in server.stream_agent_events("c", agent_input, server.agent_config("c:0"), "m1")]
+        assert lg_tool_cache._current.get() is None  # the run's cache doesn't outlive it
+        return events
+    events = asyncio.run(run())
+
+    assert events[-1] == {"type": "chat_response", "id": "m1", "content": "No chunks here."}
+    assert writer.saved == [("c", "assistant", "No chunks here.")]
+
+
+def test_save_final_reply_from_thread(monkeypatch):
+    # The stream stopped before the end event, but the run finished: the reply is read from the thread
+    llm = RecordingFakeModel(messages=iter([AIMessage(content="Saved anyway.")]))
+    assistant = server.Assistant(llm=llm, checkpointer=InMemorySaver())
+    writer = stub_stream_deps(monkeypatch, assistant)
+    config = server.agent_config("c:0")
+
+    async def run():
+        since = datetime.now(timezone.utc)
+        await assistant.agent.ainvoke({"messages": [{"role": "user", "content": "Hi"}]}, config)
+        later = datetime.now(timezone.utc)
+        stale = await server.save_final_reply(assistant.agent, "c", config, None, later)
+        return stale, await server.save_final_reply(assistant.agent, "c", config, None, since)
+    stale, saved = asyncio.run(run())
+
+    assert stale is None  # the thread's last run ended before this one started
+    assert saved == "Saved anyway."
+    assert writer.saved == [("c", "assistant", "Saved anyway.")]
+
+
+if __name__ == "__main__":
+    test_agent_turn()
+    print("OK")